@@ -0,0 +1,332 @@
+"""Bulk analytics over the grade history of the Noten-Checker.
+
+load_columns() reads the event log once into column arrays: one array
+per field, users and subjects dictionary-encoded as integer codes. With
+NumPy installed the columns are NumPy arrays and every statistic is a
+handful of vectorised operations (bincount, lexsort, cumsum); without
+it the same arrays come from the array module and the statistics run
+as single passes over them. Both paths return the same results.
+
+Print a report with:
+    python analytics.py report [--since 2025-08-01] [--until 2026-08-01] [--window 5] [--user NAME]
+"""
+import argparse
+import array
+import math
+import os
+import re
+import sys
+from collections import deque
+from datetime import datetime
+
+import grade_history
+
+try:
+    import numpy as np
+except ImportError:  # optional; ohne NumPy rechnen die Funktionen auf array-Spalten
+    np = None
+
+# Steigungen werden pro 30 Tage angegeben
+TREND_SECONDS = 30 * 24 * 3600
+DEFAULT_WINDOW = 5
+
+_NUMERIC_RE = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*$")
+_GRADE_KINDS = (grade_history.KINDS.index("grade"), grade_history.KINDS.index("exam"))
+_NAN = float("nan")
+
+
+def _numeric(value: str | None) -> float:
+    match = _NUMERIC_RE.match(value) if value else None
+    return float(match.group(1).replace(",", ".")) if match else _NAN
+
+
+class GradeColumns:
+    """The grade history as parallel columns; row i is one event."""
+
+    __slots__ = ("ts", "user", "subject", "period", "kind", "value", "average_after", "users", "subjects", "numpy")
+
+    def __init__(self, use_numpy: bool | None = None):
+        self.numpy = np is not None if use_numpy is None else use_numpy and np is not None
+        self.ts = array.array("d")
+        self.user = array.array("I")
+        self.subject = array.array("I")
+        self.period = array.array("B")
+        self.kind = array.array("B")
+        # Zahlenwert der Note, NaN für Einträge wie "2-" oder reine Schnittänderungen
+        self.value = array.array("d")
+        self.average_after = array.array("d")
+        self.users: list[str] = []
+        self.subjects: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @classmethod
+    def from_events(cls, events, use_numpy: bool | None = None) -> "GradeColumns":
+        columns = cls(use_numpy)
+        user_codes: dict[str, int] = {}
+        subject_codes: dict[str, int] = {}
+        kinds = {kind: idx for idx, kind in enumerate(grade_history.KINDS)}
+        for event in events:
+            user = user_codes.get(event.user)
+            if user is None:
+                user = user_codes[event.user] = len(columns.users)
+                columns.users.append(event.user)
+            subject = subject_codes.get(event.subject)
+            if subject is None:
+                subject = subject_codes[event.subject] = len(columns.subjects)
+                columns.subjects.append(event.subject)
+            columns.ts.append(event.ts)
+            columns.user.append(user)
+            columns.subject.append(subject)
+            columns.period.append(event.period)
+            columns.kind.append(kinds[event.kind])
+            columns.value.append(_numeric(event.value))
+            columns.average_after.append(_NAN if event.average_after is None else event.average_after)
+        if columns.numpy:
+            # Ohne Kopie: NumPy übernimmt die Puffer der array-Spalten
+            for name in ("ts", "user", "subject", "period", "kind", "value", "average_after"):
+                setattr(columns, name, np.frombuffer(getattr(columns, name), dtype=getattr(columns, name).typecode))
+        return columns
+
+    def group(self, code: int) -> tuple[str, str]:
+        """(user, subject) of a group code, see _group_codes."""
+        return self.users[code // len(self.subjects)], self.subjects[code % len(self.subjects)]
+
+
+def load_columns(history: grade_history.GradeHistory, start=None, end=None, use_numpy: bool | None = None) -> GradeColumns:
+    """Read the events with start <= ts < end into columns."""
+    return GradeColumns.from_events(history.scan(start, end), use_numpy)
+
+
+def _group_codes(columns: GradeColumns):
+    """One code per (user, subject) pair: user * number of subjects + subject."""
+    width = len(columns.subjects)
+    if columns.numpy:
+        return columns.user.astype(np.int64) * width + columns.subject
+    return array.array("q", (user * width + subject for user, subject in zip(columns.user, columns.subject)))
+
+
+def trends(columns: GradeColumns) -> dict[tuple[str, str], float]:
+    """Least-squares slope of the subject average per 30 days, per user and subject."""
+    groups = _group_codes(columns)
+    result = {}
+    if columns.numpy:
+        mask = ~np.isnan(columns.average_after)
+        if not mask.any():
+            return result
+        g = groups[mask]
+        t = (columns.ts[mask] - columns.ts[mask].min()) / TREND_SECONDS
+        y = columns.average_after[mask]
+        size = int(g.max()) + 1
+        n = np.bincount(g, minlength=size)
+        st = np.bincount(g, t, size)
+        sy = np.bincount(g, y, size)
+        stt = np.bincount(g, t * t, size)
+        sty = np.bincount(g, t * y, size)
+        denominator = n * stt - st * st
+        for code in np.nonzero((n >= 2) & (denominator > 1e-12))[0]:
+            result[columns.group(int(code))] = float((n[code] * sty[code] - st[code] * sy[code]) / denominator[code])
+        return result
+    sums: dict[int, list[float]] = {}
+    origin = min((ts for ts, avg in zip(columns.ts, columns.average_after) if not math.isnan(avg)), default=0.0)
+    for code, ts, avg in zip(groups, columns.ts, columns.average_after):
+        if math.isnan(avg):
+            continue
+        t = (ts - origin) / TREND_SECONDS
+        acc = sums.setdefault(code, [0, 0.0, 0.0, 0.0, 0.0])
+        acc[0] += 1
+        acc[1] += t
+        acc[2] += avg
+        acc[3] += t * t
+        acc[4] += t * avg
+    for code, (n, st, sy, stt, sty) in sorted(sums.items()):
+        denominator = n * stt - st * st
+        if n >= 2 and denominator > 1e-12:
+            result[columns.group(code)] = (n * sty - st * sy) / denominator
+    return result
+
+
+def _grade_rows(columns: GradeColumns):
+    """Indices of grade and exam events with a numeric value, ordered by group and time."""
+    groups = _group_codes(columns)
+    if columns.numpy:
+        mask = np.isin(columns.kind, _GRADE_KINDS) & ~np.isnan(columns.value)
+        rows = np.nonzero(mask)[0]
+        order = np.lexsort((columns.ts[rows], groups[rows]))
+        return groups, rows[order]
+    rows = [
+        i for i, (kind, value) in enumerate(zip(columns.kind, columns.value))
+        if kind in _GRADE_KINDS and not math.isnan(value)
+    ]
+    rows.sort(key=lambda i: (groups[i], columns.ts[i]))
+    return groups, rows
+
+
+def rolling_averages(columns: GradeColumns, window: int = DEFAULT_WINDOW) -> dict[tuple[str, str], float]:
+    """Mean of the latest window grades (and exams), per user and subject."""
+    groups, rows = _grade_rows(columns)
+    result = {}
+    if not len(rows):
+        return result
+    if columns.numpy:
+        g = groups[rows]
+        cumulative = np.concatenate(([0.0], np.cumsum(columns.value[rows])))
+        # Position jeder Note innerhalb ihrer Gruppe
+        starts = np.concatenate(([True], g[1:] != g[:-1]))
+        first = np.maximum.accumulate(np.where(starts, np.arange(len(g)), 0))
+        position = np.arange(len(g)) - first
+        width = np.minimum(position + 1, window)
+        rolling = (cumulative[np.arange(1, len(g) + 1)] - cumulative[np.arange(1, len(g) + 1) - width]) / width
+        last = np.concatenate((g[1:] != g[:-1], [True]))
+        for code, value in zip(g[last], rolling[last]):
+            result[columns.group(int(code))] = float(value)
+        return result
+    recent: deque = deque()
+    current = None
+    for i in rows:
+        if groups[i] != current:
+            if current is not None:
+                result[columns.group(current)] = sum(recent) / len(recent)
+            current = groups[i]
+            recent = deque(maxlen=window)
+        recent.append(columns.value[i])
+    result[columns.group(current)] = sum(recent) / len(recent)
+    return result
+
+
+def period_deltas(columns: GradeColumns) -> dict[tuple[str, str], list[tuple[int, int, float]]]:
+    """Change of the mean grade from one Halbjahr to the next, per user and subject."""
+    groups, rows = _grade_rows(columns)
+    means: dict[int, dict[int, float]] = {}
+    if columns.numpy and len(rows):
+        periods = int(columns.period.max()) + 1
+        keys = groups[rows] * periods + columns.period[rows]
+        counts = np.bincount(keys)
+        totals = np.bincount(keys, columns.value[rows])
+        for key in np.nonzero(counts)[0]:
+            means.setdefault(int(key) // periods, {})[int(key) % periods] = float(totals[key] / counts[key])
+    else:
+        sums: dict[tuple[int, int], list[float]] = {}
+        for i in rows:
+            acc = sums.setdefault((groups[i], columns.period[i]), [0.0, 0])
+            acc[0] += columns.value[i]
+            acc[1] += 1
+        for (code, period), (total, count) in sums.items():
+            means.setdefault(code, {})[period] = total / count
+    result = {}
+    for code in sorted(means):
+        ordered = sorted(means[code].items())
+        deltas = [(a, b, mean_b - mean_a) for (a, mean_a), (b, mean_b) in zip(ordered, ordered[1:])]
+        if deltas:
+            result[columns.group(code)] = deltas
+    return result
+
+
+def cohort_summary(columns: GradeColumns) -> dict[str, dict[str, float]]:
+    """Per subject across all users: accounts, grades, mean grade and spread of the latest averages."""
+    if not len(columns):
+        return {}
+    groups, rows = _grade_rows(columns)
+    width = len(columns.subjects)
+    latest: dict[int, float] = {}
+    if columns.numpy:
+        mask = ~np.isnan(columns.average_after)
+        idx = np.nonzero(mask)[0]
+        idx = idx[np.lexsort((columns.ts[idx], groups[idx]))]
+        if len(idx):
+            g = groups[idx]
+            last = np.concatenate((g[1:] != g[:-1], [True]))
+            latest = {int(code): float(avg) for code, avg in zip(g[last], columns.average_after[idx][last])}
+        subject_of_grade = columns.subject[rows]
+        grade_counts = np.bincount(subject_of_grade, minlength=width)
+        grade_totals = np.bincount(subject_of_grade, columns.value[rows], minlength=width)
+        accounts = np.bincount(np.unique(groups) % width, minlength=width)
+    else:
+        stamps: dict[int, float] = {}
+        for code, ts, avg in zip(groups, columns.ts, columns.average_after):
+            if not math.isnan(avg) and ts >= stamps.get(code, -math.inf):
+                stamps[code] = ts
+                latest[code] = avg
+        grade_counts = [0] * width
+        grade_totals = [0.0] * width
+        for i in rows:
+            grade_counts[columns.subject[i]] += 1
+            grade_totals[columns.subject[i]] += columns.value[i]
+        accounts = [0] * width
+        for code in set(groups):
+            accounts[code % width] += 1
+    per_subject: dict[int, list[float]] = {}
+    for code, avg in latest.items():
+        per_subject.setdefault(code % width, []).append(avg)
+    summary = {}
+    for subject, name in enumerate(columns.subjects):
+        averages = per_subject.get(subject, [])
+        count = int(grade_counts[subject])
+        summary[name] = {
+            "accounts": int(accounts[subject]),
+            "grades": count,
+            "mean_grade": float(grade_totals[subject]) / count if count else None,
+            "mean_average": sum(averages) / len(averages) if averages else None,
+            "min_average": min(averages) if averages else None,
+            "max_average": max(averages) if averages else None,
+        }
+    return summary
+
+
+def _format(value: float | None, digits: int = 2) -> str:
+    return "-" if value is None else f"{value:.{digits}f}".replace(".", ",")
+
+
+def report(columns: GradeColumns, window: int = DEFAULT_WINDOW, user: str | None = None) -> list[str]:
+    """Text report: per-subject trends of each user, then the cohort summary."""
+    slopes = trends(columns)
+    rolling = rolling_averages(columns, window)
+    deltas = period_deltas(columns)
+    lines = [f"{len(columns)} Ereignisse, {len(columns.users)} Benutzer, {len(columns.subjects)} Fächer"]
+    for key in sorted(set(slopes) | set(rolling) | set(deltas)):
+        if user is not None and key[0] != user:
+            continue
+        halves = ", ".join(f"H{a}->H{b} {delta:+.2f}".replace(".", ",") for a, b, delta in deltas.get(key, []))
+        lines.append(
+            f"{key[0]:15} {key[1]:30} Trend {_format(slopes.get(key)):>6}/30 T"
+            f"  gleitend ({window}) {_format(rolling.get(key)):>6}  {halves}"
+        )
+    lines.append("")
+    lines.append(f"{'Fach':30} {'Konten':>6} {'Noten':>6} {'Ø Note':>7} {'Ø Schnitt':>9} {'min':>6} {'max':>6}")
+    for name, values in sorted(cohort_summary(columns).items()):
+        lines.append(
+            f"{name:30} {values['accounts']:6d} {values['grades']:6d} {_format(values['mean_grade']):>7}"
+            f" {_format(values['mean_average']):>9} {_format(values['min_average']):>6} {_format(values['max_average']):>6}"
+        )
+    return lines
+
+
+def _parse_day(value: str | None) -> float | None:
+    return None if not value else datetime.strptime(value, "%Y-%m-%d").timestamp()
+
+
+def main_cli(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("report", help="Trends, gleitende Schnitte und Fachübersicht ausgeben")
+    cmd.add_argument("--dir", default=os.getenv("GRADE_HISTORY_DIR") or grade_history.DEFAULT_DIR)
+    cmd.add_argument("--since", help="JJJJ-MM-TT")
+    cmd.add_argument("--until", help="JJJJ-MM-TT (ausschließlich)")
+    cmd.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    cmd.add_argument("--user")
+    cmd.add_argument("--no-numpy", action="store_true", help="array-Spalten auch mit installiertem NumPy")
+    args = parser.parse_args(argv)
+    columns = load_columns(
+        grade_history.GradeHistory(args.dir),
+        _parse_day(args.since),
+        _parse_day(args.until),
+        use_numpy=not args.no_numpy,
+    )
+    for line in report(columns, args.window, args.user):
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
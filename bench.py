@@ -0,0 +1,393 @@
+"""Messwerkzeuge fuer den Noten-Checker.
+
+Aufruf:
+    python bench.py backends [datei ...]
+    python bench.py suite [--scale 40x12] [--update-baseline]
+    python bench.py encoding [datei ...]
+    python bench.py state [--accounts 300]
+    python bench.py import [--repeat 5]
+"""
+import argparse
+import copy
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import main
+import portal_generator
+import state_store
+from requests.compat import chardet
+
+FIXTURES = ("index.html", "res_example.txt")
+BASELINE_FILE = "bench_baseline.json"
+DEFAULT_SCALES = ("10x5", "40x12", "120x30")
+# Erlaubte Verschlechterung gegenüber der Baseline, bevor der Lauf fehlschlägt
+DEFAULT_THRESHOLD = 0.25
+# Obergrenze für `import main` laut -X importtime (ohne Start des Interpreters)
+IMPORT_BUDGET_SECONDS = 0.1
+
+
+def _read_fixture(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def compare_backends(html: str, backends: list[str] | None = None, repeat: int = 1) -> dict[str, tuple[dict, float]]:
+    """Parse one page with every backend and return result and best parse time."""
+    if backends is None:
+        backends = ["stream"] + main.available_parser_backends()
+    results: dict[str, tuple[dict, float]] = {}
+    for backend in backends:
+        best = None
+        data = None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            data = main.parse_grades(html, backend=backend)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[backend] = (data, best)
+    return results
+
+
+def backend_mismatches(results: dict[str, tuple[dict, float]]) -> list[str]:
+    """Return the backends whose output differs from the html.parser reference."""
+    reference = results.get("html.parser", next(iter(results.values())))[0]
+    return [name for name, (data, _) in results.items() if data != reference]
+
+
+def synthetic_page(subjects: int, grades: int, periods: int = 4) -> str:
+    """Build a portal-like grades page, see portal_generator."""
+    return portal_generator.portal_page(subjects, grades, periods)
+
+
+def _scale(value: str) -> tuple[int, int]:
+    subjects, _, grades = value.partition("x")
+    return int(subjects), int(grades or 1)
+
+
+def _bench_pages(scales) -> dict[str, str]:
+    pages = {path: _read_fixture(path) for path in FIXTURES if os.path.exists(path)}
+    for value in scales:
+        subjects, grades = _scale(value)
+        pages[f"synthetic_{subjects}x{grades}"] = synthetic_page(subjects, grades)
+    return pages
+
+
+def _with_one_grade_less(data: dict) -> dict:
+    """Previous state for the diff benchmarks: every subject lacks its newest grade."""
+    previous = copy.deepcopy(data)
+    for info in previous.get("subjects", {}).values():
+        for key, value in info.items():
+            if key.endswith("Grades") and value:
+                info[key] = value[:-1]
+    return previous
+
+
+def measure(func, repeat: int = 5) -> dict[str, float]:
+    """Time func and record its allocations and peak memory in a separate run.
+
+    allocations/alloc_kb count the blocks that are still alive after the
+    call, i.e. the result and anything cached; peak_kb covers temporaries.
+    """
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()  # noqa: F841 – Ergebnis bleibt bis zum zweiten Snapshot erhalten
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    grown = [stat for stat in after.compare_to(before, "filename") if stat.size_diff > 0]
+    return {
+        "seconds": best,
+        "allocations": sum(stat.count_diff for stat in grown),
+        "alloc_kb": sum(stat.size_diff for stat in grown) / 1024,
+        "peak_kb": peak / 1024,
+    }
+
+
+def run_suite(pages: dict[str, str], repeat: int = 5) -> dict[str, dict[str, float]]:
+    """Measure the steps of one polling cycle for every page."""
+    results: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        state_path = os.path.join(tmp, "old_grades_bench.json")
+        for name, html in pages.items():
+            data = main.parse_grades(html)
+            previous = _with_one_grade_less(data)
+            tables = main._extract_grade_tables(html)
+            messages = main._collect_subject_messages("Bench", data, previous)
+            outbox = main._Outbox(os.path.join(tmp, f"outbox_{name}.jsonl"))
+            cases = {
+                "parse_grades": lambda: main.parse_grades(html),
+                "_has_grade_markup": lambda: main._has_grade_markup(tables),
+                "_collect_subject_messages": lambda: main._collect_subject_messages("Bench", data, previous),
+                "_Outbox.add": lambda: outbox.add("Bench", messages),
+                "_write_json_file": lambda: main._write_json_file(state_path, data),
+            }
+            for case, func in cases.items():
+                results[f"{name}/{case}"] = measure(func, repeat)
+    return results
+
+
+def load_baseline(path: str) -> dict[str, dict[str, float]] | None:
+    """Return the stored baseline, or None if the file is missing or unreadable."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    return baseline if isinstance(baseline, dict) else None
+
+
+def regressions(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> list[str]:
+    """Return the measurements that got worse than baseline * (1 + threshold)."""
+    found = []
+    for key, values in results.items():
+        reference = baseline.get(key)
+        if not reference:
+            continue
+        for metric in ("seconds", "peak_kb"):
+            old = reference.get(metric)
+            if old and values[metric] > old * (1 + threshold):
+                found.append(f"{key} {metric}: {old:.6g} -> {values[metric]:.6g}")
+    return found
+
+
+def _cmd_suite(args) -> int:
+    results = run_suite(_bench_pages(args.scale or DEFAULT_SCALES), repeat=args.repeat)
+    for key, values in results.items():
+        print(
+            f"{key:55} {values['seconds'] * 1000:9.3f} ms"
+            f" {values['allocations']:7d} allocs {values['alloc_kb']:9.1f} KB {values['peak_kb']:9.1f} KB peak"
+        )
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline gespeichert: {args.baseline}")
+        return 0
+    baseline = load_baseline(args.baseline)
+    if baseline is None:
+        # Ohne Vergleichswerte wäre der Lauf immer grün
+        print(f"Keine lesbare Baseline in {args.baseline}; zuerst mit --update-baseline anlegen", file=sys.stderr)
+        return 2
+    unmatched = [key for key in results if key not in baseline]
+    for key in unmatched:
+        print(f"OHNE BASELINE {key}")
+    if len(unmatched) == len(results):
+        print(f"Die Baseline in {args.baseline} enthält keine der gemessenen Seiten", file=sys.stderr)
+        return 2
+    found = regressions(results, baseline, args.threshold)
+    for line in found:
+        print(f"REGRESSION {line}")
+    return 1 if found else 0
+
+
+def compare_decoding(body: bytes, repeat: int = 3) -> dict[str, tuple[str, float]]:
+    """Decode a page with and without charset detection; return text and best time.
+
+    "detect" is what requests does for resp.text when the header carries
+    no charset, "meta" is main._decode_page.
+    """
+    methods = {
+        "detect": lambda: body.decode(chardet.detect(body)["encoding"] or "utf-8", errors="replace"),
+        "meta": lambda: main._decode_page(body),
+    }
+    results: dict[str, tuple[str, float]] = {}
+    for name, func in methods.items():
+        best = None
+        for _ in range(max(1, repeat)):
+            start = time.perf_counter()
+            text = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = (text, best)
+    return results
+
+
+def _written_bytes(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+
+def compare_state_stores(data: dict, accounts: int) -> dict[str, dict[str, float]]:
+    """Store one cycle for many accounts in which only the first account changed.
+
+    Reports the bytes written for that cycle and the time until the
+    first account's state is available after a restart.
+    """
+    changed = _with_one_grade_less(data)
+    results: dict[str, dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"old_grades_U{i}.json") for i in range(accounts)]
+        for path in paths:
+            main._write_json_file(path, data)
+        start = time.perf_counter()
+        main._write_json_file(paths[0], changed)
+        for path in paths[1:]:
+            main._write_json_file(path, data)
+        seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = {path: main._load_json_file(path) for path in paths}
+        results["json"] = {
+            "cycle_seconds": seconds,
+            "cycle_bytes": sum(os.path.getsize(path) for path in paths),
+            "startup_seconds": time.perf_counter() - start,
+        }
+        del loaded
+
+        db = os.path.join(tmp, "grades.sqlite3")
+        store = state_store.StateStore(db)
+        for i in range(accounts):
+            store.stage(f"U{i}", data)
+        store.commit()
+        store._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        before = _written_bytes(db)
+        start = time.perf_counter()
+        store.stage("U0", changed)
+        for i in range(1, accounts):
+            store.stage(f"U{i}", data)
+        store.commit()
+        seconds = time.perf_counter() - start
+        written = _written_bytes(db) - before
+        store.close()
+        start = time.perf_counter()
+        store = state_store.StateStore(db)
+        store.load("U0")
+        results["sqlite"] = {
+            "cycle_seconds": seconds,
+            "cycle_bytes": written,
+            "startup_seconds": time.perf_counter() - start,
+        }
+        store.close()
+    return results
+
+
+def measure_import(module: str = "main", repeat: int = 5) -> tuple[float, dict[str, float]]:
+    """Import module in fresh interpreters with -X importtime.
+
+    Returns the best cumulative import time of module and, from that run,
+    the cumulative time of each module it imports directly. Bytecode goes to a
+    temporary cache so the first run does not count compilation twice.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    best: tuple[float, dict[str, float]] | None = None
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"}
+        env["PYTHONPYCACHEPREFIX"] = tmp
+        for run in range(repeat + 1):
+            proc = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                cwd=here,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            # Kinder stehen vor ihrem Elternmodul, eine Ebene tiefer eingerückt
+            children: dict[str, float] = {}
+            for line in proc.stderr.splitlines():
+                fields = line[len("import time:"):].split("|")
+                if not line.startswith("import time:") or len(fields) != 3 or not fields[1].strip().isdigit():
+                    continue
+                _, cumulative, name = fields
+                depth = (len(name) - len(name.lstrip()) - 1) // 2
+                if depth == 1:
+                    children[name.strip()] = int(cumulative) / 1e6
+                elif depth == 0 and name.strip() == module:
+                    seconds = int(cumulative) / 1e6
+                    # Der erste Lauf füllt nur den Bytecode-Cache
+                    if run and (best is None or seconds < best[0]):
+                        best = (seconds, children)
+                elif depth == 0:
+                    children = {}
+    return best
+
+
+def _cmd_import(args) -> int:
+    seconds, imports = measure_import(repeat=args.repeat)
+    for name, cumulative in sorted(imports.items(), key=lambda item: -item[1])[: args.top]:
+        print(f"  {name:40} {cumulative * 1000:8.1f} ms")
+    within = seconds <= IMPORT_BUDGET_SECONDS
+    print(f"import main {seconds * 1000:8.1f} ms (Budget {IMPORT_BUDGET_SECONDS * 1000:.0f} ms)  {'ok' if within else 'ÜBERSCHRITTEN'}")
+    return 0 if within else 1
+
+
+def _cmd_state(args) -> int:
+    data = json.loads(json.dumps(main.parse_grades(synthetic_page(*_scale(args.scale)))))
+    for name, values in compare_state_stores(data, args.accounts).items():
+        print(
+            f"{name:8} {args.accounts:5d} Konten  Zyklus {values['cycle_seconds'] * 1000:9.1f} ms"
+            f" {values['cycle_bytes'] / 1024:10.1f} KB  Start {values['startup_seconds'] * 1000:8.1f} ms"
+        )
+    return 0
+
+
+def _cmd_encoding(args) -> int:
+    failed = False
+    for path in args.files or FIXTURES:
+        with open(path, "rb") as f:
+            results = compare_decoding(f.read(), repeat=args.repeat)
+        same = results["detect"][0] == results["meta"][0]
+        for name, (_, seconds) in results.items():
+            print(f"{path:20} {name:8} {seconds * 1000:9.2f} ms  {'ok' if same else 'ABWEICHUNG'}")
+        failed = failed or not same
+    return 1 if failed else 0
+
+
+def _cmd_backends(args) -> int:
+    failed = False
+    for path in args.files or FIXTURES:
+        results = compare_backends(_read_fixture(path), repeat=args.repeat)
+        mismatches = backend_mismatches(results)
+        for name, (_, seconds) in results.items():
+            status = "ABWEICHUNG" if name in mismatches else "ok"
+            print(f"{path:20} {name:12} {seconds * 1000:9.1f} ms  {status}")
+        failed = failed or bool(mismatches)
+    return 1 if failed else 0
+
+
+def main_cli(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    backends = sub.add_parser("backends", help="HTML-Parser vergleichen")
+    backends.add_argument("files", nargs="*")
+    backends.add_argument("--repeat", type=int, default=3)
+    backends.set_defaults(func=_cmd_backends)
+    suite = sub.add_parser("suite", help="Zyklus-Schritte messen und mit Baseline vergleichen")
+    suite.add_argument("--scale", action="append", help="Fächer x Noten, z. B. 40x12 (mehrfach möglich)")
+    suite.add_argument("--repeat", type=int, default=5)
+    suite.add_argument("--baseline", default=BASELINE_FILE)
+    suite.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    suite.add_argument("--update-baseline", action="store_true")
+    suite.set_defaults(func=_cmd_suite)
+    encoding = sub.add_parser("encoding", help="Zeichensatz-Erkennung mit <meta charset> vergleichen")
+    encoding.add_argument("files", nargs="*")
+    encoding.add_argument("--repeat", type=int, default=3)
+    encoding.set_defaults(func=_cmd_encoding)
+    state = sub.add_parser("state", help="JSON-Dateien und SQLite-Speicher vergleichen")
+    state.add_argument("--accounts", type=int, default=300)
+    state.add_argument("--scale", default="15x8", help="Fächer x Noten je Konto")
+    state.set_defaults(func=_cmd_state)
+    imports = sub.add_parser("import", help="Importzeit von main.py gegen das Budget prüfen")
+    imports.add_argument("--repeat", type=int, default=5)
+    imports.add_argument("--top", type=int, default=10, help="so viele langsamste Importe anzeigen")
+    imports.set_defaults(func=_cmd_import)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,327 @@
+"""Append-only history of grade changes for the Noten-Checker.
+
+Every change the checker detects becomes one GradeEvent. Events are
+appended as compact binary records to numbered segment files; once a
+segment is full it is sealed and gets an index file that maps each
+(user, subject) to the offsets and timestamps of its records. A query
+only opens the segments overlapping the requested time range and reads
+just the matching records, so a school year of history answers without
+loading the log into memory.
+
+Query from the command line with:
+    python grade_history.py query USER [--subject FACH] [--since 2025-08-01] [--until 2026-07-31]
+"""
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterator, NamedTuple
+
+DEFAULT_DIR = "grade_history"
+# Ab dieser Größe wird ein Segment abgeschlossen und indiziert
+SEGMENT_BYTES = 1024 * 1024
+# So viele Segment-Indizes bleiben zwischen Abfragen im Speicher
+INDEX_CACHE = 16
+
+KINDS = ("grade", "exam", "final", "average")
+
+# Länge, Zeitstempel, Halbjahr, Art, Schnitt vorher/nachher, Längen von Benutzer, Fach, Wert
+_HEADER = struct.Struct("<HdBBddHHH")
+# Indexeintrag: Position im Segment und Zeitstempel
+_INDEX_ENTRY = struct.Struct("<Id")
+_NAN = float("nan")
+
+
+class GradeEvent(NamedTuple):
+    """One detected change; period 0 stands for the current Halbjahr."""
+
+    ts: float
+    user: str
+    subject: str
+    period: int
+    kind: str
+    value: str | None
+    average_before: float | None
+    average_after: float | None
+
+
+def _key(user: str, subject: str) -> str:
+    return f"{user}\0{subject}"
+
+
+def _encode(event: GradeEvent) -> bytes:
+    user = event.user.encode("utf-8")
+    subject = event.subject.encode("utf-8")
+    value = b"\xff" if event.value is None else str(event.value).encode("utf-8")
+    size = _HEADER.size - 2 + len(user) + len(subject) + len(value)
+    return _HEADER.pack(
+        size,
+        event.ts,
+        event.period,
+        KINDS.index(event.kind),
+        _NAN if event.average_before is None else float(event.average_before),
+        _NAN if event.average_after is None else float(event.average_after),
+        len(user),
+        len(subject),
+        len(value),
+    ) + user + subject + value
+
+
+def _decode(buffer: bytes, offset: int = 0) -> tuple[GradeEvent, int] | None:
+    """Decode the record at offset; None for a torn record at the end of a segment."""
+    if offset + _HEADER.size > len(buffer):
+        return None
+    size, ts, period, kind, before, after, user_len, subject_len, value_len = _HEADER.unpack_from(buffer, offset)
+    end = offset + 2 + size
+    if end > len(buffer) or size != _HEADER.size - 2 + user_len + subject_len + value_len:
+        return None
+    pos = offset + _HEADER.size
+    user = buffer[pos:pos + user_len].decode("utf-8")
+    pos += user_len
+    subject = buffer[pos:pos + subject_len].decode("utf-8")
+    pos += subject_len
+    raw_value = buffer[pos:end]
+    event = GradeEvent(
+        ts,
+        user,
+        subject,
+        period,
+        KINDS[kind],
+        None if raw_value == b"\xff" else raw_value.decode("utf-8"),
+        None if math.isnan(before) else before,
+        None if math.isnan(after) else after,
+    )
+    return event, end
+
+
+class GradeHistory:
+    """Segmented event log in one directory."""
+
+    __slots__ = ("directory", "segment_bytes", "_sealed", "_active", "_active_size", "_active_index",
+                 "_active_range", "_index_cache", "_lock")
+
+    def __init__(self, directory: str = DEFAULT_DIR, segment_bytes: int = SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        # Nummer -> (frühester, spätester Zeitstempel) der abgeschlossenen Segmente
+        self._sealed: dict[int, tuple[float, float]] = {}
+        self._active = 1
+        self._active_size = 0
+        self._active_index: dict[str, list[tuple[int, float]]] = {}
+        self._active_range: tuple[float, float] | None = None
+        self._index_cache: OrderedDict[int, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._open()
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:08d}.seg")
+
+    def _index_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:08d}.idx")
+
+    def _open(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".seg"))
+        for number in numbers:
+            if os.path.exists(self._index_path(number)):
+                with open(self._index_path(number), "rb") as f:
+                    header = json.loads(f.readline())
+                self._sealed[number] = (header["min_ts"], header["max_ts"])
+            else:
+                self._active = number
+        if numbers and self._active in self._sealed:
+            self._active = numbers[-1] + 1
+        self._scan_active()
+
+    def _scan_active(self) -> None:
+        """Rebuild the index of the open segment and cut off a torn last record."""
+        path = self._segment_path(self._active)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as f:
+            buffer = f.read()
+        offset = 0
+        while True:
+            decoded = _decode(buffer, offset)
+            if decoded is None:
+                break
+            event, end = decoded
+            self._index_record(event, offset)
+            offset = end
+        if offset < len(buffer):
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        self._active_size = offset
+
+    def _index_record(self, event: GradeEvent, offset: int) -> None:
+        self._active_index.setdefault(_key(event.user, event.subject), []).append((offset, event.ts))
+        if self._active_range is None:
+            self._active_range = (event.ts, event.ts)
+        else:
+            self._active_range = (min(self._active_range[0], event.ts), max(self._active_range[1], event.ts))
+
+    def append(self, events: list[GradeEvent]) -> None:
+        """Append events to the open segment and seal it once it is full."""
+        if not events:
+            return
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            pos = 0
+            while pos < len(events):
+                with open(self._segment_path(self._active), "ab") as f:
+                    while pos < len(events) and self._active_size < self.segment_bytes:
+                        record = _encode(events[pos])
+                        f.write(record)
+                        self._index_record(events[pos], self._active_size)
+                        self._active_size += len(record)
+                        pos += 1
+                if self._active_size >= self.segment_bytes:
+                    self._seal()
+
+    def _seal(self) -> None:
+        """Write the index of the open segment and start a new one.
+
+        Layout: a JSON line with the time range, a JSON line mapping each
+        key to (first entry, count), then the (offset, ts) entries of all
+        keys as packed binary, so a query reads only the entries of its key.
+        """
+        keys = {}
+        entries = bytearray()
+        for key, refs in self._active_index.items():
+            keys[key] = (len(entries) // _INDEX_ENTRY.size, len(refs))
+            for offset, ts in refs:
+                entries += _INDEX_ENTRY.pack(offset, ts)
+        tmp_path = f"{self._index_path(self._active)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps({"min_ts": self._active_range[0], "max_ts": self._active_range[1]}).encode() + b"\n")
+            f.write(json.dumps(keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+            f.write(entries)
+        os.replace(tmp_path, self._index_path(self._active))
+        self._sealed[self._active] = self._active_range
+        self._active += 1
+        self._active_size = 0
+        self._active_index = {}
+        self._active_range = None
+
+    def _sealed_keys(self, number: int) -> tuple[dict, int]:
+        """Key table of a sealed segment and where its binary entries start."""
+        cached = self._index_cache.get(number)
+        if cached is None:
+            with open(self._index_path(number), "rb") as f:
+                f.readline()
+                keys = json.loads(f.readline())
+                cached = (keys, f.tell())
+            self._index_cache[number] = cached
+            if len(self._index_cache) > INDEX_CACHE:
+                self._index_cache.popitem(last=False)
+        else:
+            self._index_cache.move_to_end(number)
+        return cached
+
+    def _sealed_refs(self, number: int, wanted: list[str]) -> list[tuple[int, float]]:
+        keys, data_start = self._sealed_keys(number)
+        spans = [keys[key] for key in wanted if key in keys]
+        refs = []
+        if spans:
+            with open(self._index_path(number), "rb") as f:
+                for first, count in spans:
+                    f.seek(data_start + first * _INDEX_ENTRY.size)
+                    refs.extend(_INDEX_ENTRY.iter_unpack(f.read(count * _INDEX_ENTRY.size)))
+        return refs
+
+    def query(
+        self,
+        user: str,
+        subject: str | None = None,
+        start: float | None = None,
+        end: float | None = None,
+    ) -> Iterator[GradeEvent]:
+        """Yield the events of user (and subject) with start <= ts < end in log order."""
+        low = -math.inf if start is None else start
+        high = math.inf if end is None else end
+        prefix = f"{user}\0"
+        segments = []
+        with self._lock:
+            for number, (min_ts, max_ts) in sorted(self._sealed.items()):
+                if max_ts >= low and min_ts < high:
+                    keys, _ = self._sealed_keys(number)
+                    wanted = [_key(user, subject)] if subject is not None else [k for k in keys if k.startswith(prefix)]
+                    segments.append((number, self._sealed_refs(number, wanted)))
+            if self._active_range is not None and self._active_range[1] >= low and self._active_range[0] < high:
+                wanted = (
+                    [_key(user, subject)]
+                    if subject is not None
+                    else [k for k in self._active_index if k.startswith(prefix)]
+                )
+                segments.append((self._active, [ref for k in wanted for ref in self._active_index.get(k, [])]))
+        for number, refs in segments:
+            offsets = sorted(offset for offset, ts in refs if low <= ts < high)
+            if not offsets:
+                continue
+            with open(self._segment_path(number), "rb") as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    head = f.read(2)
+                    (size,) = struct.unpack("<H", head)
+                    decoded = _decode(head + f.read(size))
+                    if decoded is not None:
+                        yield decoded[0]
+
+    def scan(self, start: float | None = None, end: float | None = None) -> Iterator[GradeEvent]:
+        """Yield all events with start <= ts < end, reading one segment at a time."""
+        low = -math.inf if start is None else start
+        high = math.inf if end is None else end
+        with self._lock:
+            numbers = [n for n, (min_ts, max_ts) in sorted(self._sealed.items()) if max_ts >= low and min_ts < high]
+            if self._active_range is not None and self._active_range[1] >= low and self._active_range[0] < high:
+                numbers.append(self._active)
+            active_size = self._active_size
+        for number in numbers:
+            with open(self._segment_path(number), "rb") as f:
+                buffer = f.read(active_size if number == self._active else -1)
+            offset = 0
+            while True:
+                decoded = _decode(buffer, offset)
+                if decoded is None:
+                    break
+                event, offset = decoded
+                if low <= event.ts < high:
+                    yield event
+
+    def segments(self) -> int:
+        return len(self._sealed) + (1 if self._active_size else 0)
+
+
+def _parse_day(value: str | None) -> float | None:
+    return None if not value else datetime.strptime(value, "%Y-%m-%d").timestamp()
+
+
+def main_cli(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    query = sub.add_parser("query", help="Ereignisse eines Benutzers ausgeben")
+    query.add_argument("user")
+    query.add_argument("--subject")
+    query.add_argument("--since", help="JJJJ-MM-TT")
+    query.add_argument("--until", help="JJJJ-MM-TT (ausschließlich)")
+    query.add_argument("--dir", default=os.getenv("GRADE_HISTORY_DIR") or DEFAULT_DIR)
+    args = parser.parse_args(argv)
+    history = GradeHistory(args.dir)
+    for event in history.query(args.user, args.subject, _parse_day(args.since), _parse_day(args.until)):
+        before = "-" if event.average_before is None else f"{event.average_before:.2f}"
+        after = "-" if event.average_after is None else f"{event.average_after:.2f}"
+        print(
+            f"{datetime.fromtimestamp(event.ts):%d.%m.%Y %H:%M}  {event.subject:30} H{event.period}"
+            f" {event.kind:8} {event.value or '':>4}  {before} -> {after}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
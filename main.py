@@ -1,88 +1,301 @@
+from __future__ import annotations
+
 import os
+import sys
 import time
 import json
+import hashlib
 import logging
 import re
 import math
+import codecs
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from collections import Counter
+from collections import Counter, OrderedDict
+from typing import TYPE_CHECKING, Mapping
+from urllib.parse import urlparse
+from html.parser import HTMLParser
+
+import grade_history
+import scheduler
+import state_store
 
-import requests
-from bs4 import BeautifulSoup, NavigableString
-from dotenv import load_dotenv
+# bs4, requests, aiohttp, asyncio und dotenv werden erst beim ersten Gebrauch
+# importiert: `import main` bleibt so schnell und ohne Nebenwirkungen
+if TYPE_CHECKING:
+    import asyncio
 
-# Konfiguration aus .env laden
+    import requests
+    from bs4 import BeautifulSoup
+    from requests.adapters import HTTPAdapter
 
+# Standardpfad der .env-Datei für load_config()
 env_path = ".env"
 
-# .env-Datei einlesen. Bereits gesetzte Umgebungsvariablen behalten Vorrang,
-# damit Tests und externe Deployments lokale Defaults gezielt ueberschreiben
-# koennen. Nicht gesetzte Werte werden aus der Datei ergaenzt.
-load_dotenv(env_path, override=False)
-
-DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-DISCORD_CHANNEL_ID = os.getenv("DISCORD_CHANNEL_ID")
-INTERVAL_MINUTES = int(os.getenv("INTERVAL_MINUTES", "5"))
-REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "20"))
-SHOW_RES = os.getenv("SHOW_RES", "false").lower() == "true"
-SHOW_HTTPS = os.getenv("SHOW_HTTPS", "false").lower() == "true"
-DEBUG_LOCAL = os.getenv("DEBUG_LOCAL", "false").lower() == "true"
-SHOW_YEAR_AVERAGE = os.getenv("SHOW_YEAR_AVERAGE", "true").lower() == "true"
-STARTUP_MESSAGE_FILE = os.getenv("STARTUP_MESSAGE_FILE", ".send_startup_message")
-
-# Mehrere Benutzer aus der .env-Datei laden
-# Die Indizes müssen nicht lückenlos sein; vorhandene Paare werden gesammelt
-USERS = []
-user_indexes = set()
-for key in os.environ:
-    m = re.match(r"USER(\d+)$", key)
-    if m:
-        user_indexes.add(int(m.group(1)))
-
-for i in sorted(user_indexes):
-    name = os.getenv(f"USER{i}")
-    username = os.getenv(f"USERNAME{i}")
-    password = os.getenv(f"PASSWORD{i}")
-    if not name:
-        continue
-    if not DEBUG_LOCAL and not (username and password):
-        continue
-    USERS.append({"name": name, "username": username, "password": password})
+DISCORD_MESSAGE_LIMIT = 2000
+OUTBOX_MAX_RETRY_SECONDS = 3600
+PORTAL_URL = "https://100308.fuxnoten.online/webinfo"
+GRADES_URL = "https://100308.fuxnoten.online/webinfo/account/"
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _users_from_env(env: Mapping[str, str], debug_local: bool) -> list[dict]:
+    """Collect the USERn/USERNAMEn/PASSWORDn triples; indexes need not be contiguous."""
+    users = []
+    user_indexes = set()
+    for key in env:
+        m = re.match(r"USER(\d+)$", key)
+        if m:
+            user_indexes.add(int(m.group(1)))
+
+    for i in sorted(user_indexes):
+        name = env.get(f"USER{i}")
+        username = env.get(f"USERNAME{i}")
+        password = env.get(f"PASSWORD{i}")
+        if not name:
+            continue
+        if not debug_local and not (username and password):
+            continue
+        users.append({"name": name, "username": username, "password": password})
+    return users
+
+
+class Config:
+    """All settings of the checker, read from environment variables.
+
+    The attribute names are those of the module-level settings; configure()
+    makes a Config the active one. Keyword arguments override single values,
+    e.g. Config({}, USERS=[...], DISCORD_TOKEN="...") for an embedded checker
+    that does not look at the environment at all.
+    """
+
+    __slots__ = (
+        "DISCORD_TOKEN",
+        "DISCORD_CHANNEL_ID",
+        "INTERVAL_MINUTES",
+        "REQUEST_TIMEOUT_SECONDS",
+        "SHOW_RES",
+        "SHOW_HTTPS",
+        "DEBUG_LOCAL",
+        "DEBUG_LOCAL_URL",
+        "SHOW_YEAR_AVERAGE",
+        "STARTUP_MESSAGE_FILE",
+        "HTML_PARSER",
+        "TABLE_CACHE_USERS",
+        "DISCORD_MESSAGE_DELAY_SECONDS",
+        "STATE_BACKEND",
+        "STATE_DB_FILE",
+        "GRADE_HISTORY_DIR",
+        "DISCORD_PACK_MESSAGES",
+        "OUTBOX_FILE",
+        "OUTBOX_RETRY_SECONDS",
+        "POLL_CONCURRENCY",
+        "POLL_ENGINE",
+        "ASYNC_HTTP_CLIENT",
+        "STREAM_GRADES_PAGE",
+        "MAX_PAGE_BYTES",
+        "PAGE_ENCODING",
+        "SCHEDULER",
+        "POLL_MIN_MINUTES",
+        "POLL_MAX_MINUTES",
+        "POLL_JITTER",
+        "POLL_SCHEDULE_FILE",
+        "POLL_RETRY_SECONDS",
+        "MAX_REQUESTS_PER_SECOND",
+        "SESSION_COOKIE_DIR",
+        "USERS",
+    )
+
+    def __init__(self, environ: Mapping[str, str] | None = None, **overrides):
+        env = os.environ if environ is None else environ
+        get = env.get
+        self.DISCORD_TOKEN = get("DISCORD_TOKEN")
+        self.DISCORD_CHANNEL_ID = get("DISCORD_CHANNEL_ID")
+        self.INTERVAL_MINUTES = int(get("INTERVAL_MINUTES", "5"))
+        self.REQUEST_TIMEOUT_SECONDS = float(get("REQUEST_TIMEOUT_SECONDS", "20"))
+        self.SHOW_RES = get("SHOW_RES", "false").lower() == "true"
+        self.SHOW_HTTPS = get("SHOW_HTTPS", "false").lower() == "true"
+        self.DEBUG_LOCAL = get("DEBUG_LOCAL", "false").lower() == "true"
+        self.DEBUG_LOCAL_URL = get("DEBUG_LOCAL_URL", "http://localhost:8000/index.html")
+        self.SHOW_YEAR_AVERAGE = get("SHOW_YEAR_AVERAGE", "true").lower() == "true"
+        self.STARTUP_MESSAGE_FILE = get("STARTUP_MESSAGE_FILE", ".send_startup_message")
+        # HTML-Parser: "auto" liest die bekannten Notentabellen per Streaming-Parser
+        # und greift nur bei unerwartetem Markup auf BeautifulSoup zurück (lxml, falls
+        # installiert, sonst "html.parser"). "stream", "lxml" und "html.parser"
+        # erzwingen den jeweiligen Weg.
+        self.HTML_PARSER = get("HTML_PARSER", "auto").strip().lower() or "auto"
+        # Anzahl Benutzer, deren zuletzt geparste Notentabellen im Speicher bleiben
+        self.TABLE_CACHE_USERS = int(get("TABLE_CACHE_USERS", "256"))
+        # Zusätzliche Pause zwischen zwei Discord-Nachrichten; das Tempo bestimmen
+        # sonst die Rate-Limit-Header von Discord
+        self.DISCORD_MESSAGE_DELAY_SECONDS = float(get("DISCORD_MESSAGE_DELAY_SECONDS", "0"))
+        # Ablage der Notenstände: "json" (Dateien je Benutzer) oder "sqlite"
+        self.STATE_BACKEND = get("STATE_BACKEND", "json").strip().lower()
+        self.STATE_DB_FILE = get("STATE_DB_FILE", state_store.DEFAULT_DB_FILE)
+        # Verzeichnis des Änderungsprotokolls aller erkannten Noten (leer = aus)
+        self.GRADE_HISTORY_DIR = get("GRADE_HISTORY_DIR", grade_history.DEFAULT_DIR)
+        # Mehrere Fach-Meldungen in eine Discord-Nachricht (bis 2000 Zeichen) packen
+        self.DISCORD_PACK_MESSAGES = get("DISCORD_PACK_MESSAGES", "true").lower() == "true"
+        # Journal der noch nicht zugestellten Meldungen; übersteht Abstürze und Neustarts
+        self.OUTBOX_FILE = get("OUTBOX_FILE", "discord_outbox.jsonl")
+        # Erster erneuter Zustellversuch nach einem Fehler (verdoppelt sich bis OUTBOX_MAX_RETRY_SECONDS)
+        self.OUTBOX_RETRY_SECONDS = float(get("OUTBOX_RETRY_SECONDS", "30"))
+        # Höchstens so viele Benutzer werden gleichzeitig beim selben Portal-Host abgefragt
+        self.POLL_CONCURRENCY = int(get("POLL_CONCURRENCY", "4"))
+        # "threads" (Standard) oder "async" für die asyncio-Engine
+        self.POLL_ENGINE = get("POLL_ENGINE", "threads").strip().lower()
+        # HTTP-Client der asyncio-Engine: "auto" nutzt aiohttp, falls installiert,
+        # "executor" führt die blockierenden Abrufe im Thread-Executor aus
+        self.ASYNC_HTTP_CLIENT = get("ASYNC_HTTP_CLIENT", "auto").strip().lower()
+        # Notenseite beim Empfang stückweise auswerten und nach dem Zeugnisbereich
+        # nicht weiterlesen; größere Antworten werden verworfen
+        self.STREAM_GRADES_PAGE = get("STREAM_GRADES_PAGE", "true").lower() == "true"
+        self.MAX_PAGE_BYTES = int(get("MAX_PAGE_BYTES", str(8 * 1024 * 1024)))
+        # Zeichensatz der Portalseiten; leer = Content-Type-Header, sonst <meta charset>
+        self.PAGE_ENCODING = get("PAGE_ENCODING", "").strip()
+        # "fixed" fragt alle Benutzer zu festen Uhrzeit-Slots ab, "staggered" verteilt
+        # sie gleichmäßig über INTERVAL_MINUTES, "adaptive" lernt zusätzlich je
+        # Benutzer, wann neue Noten erscheinen, und fragt dazwischen seltener
+        self.SCHEDULER = get("SCHEDULER", "fixed").strip().lower()
+        # In aktiven Stunden doppelt so oft wie das feste Intervall, aber höchstens minütlich
+        self.POLL_MIN_MINUTES = float(get("POLL_MIN_MINUTES", str(max(1.0, self.INTERVAL_MINUTES / 2))))
+        self.POLL_MAX_MINUTES = float(get("POLL_MAX_MINUTES", "60"))
+        # Zufällige Streuung der Abrufzeitpunkte (Anteil des Intervalls)
+        self.POLL_JITTER = float(get("POLL_JITTER", "0.1"))
+        self.POLL_SCHEDULE_FILE = get("POLL_SCHEDULE_FILE", "poll_schedule.json")
+        # Erster Wiederholungsversuch nach einem fehlgeschlagenen Abruf (verdoppelt sich)
+        self.POLL_RETRY_SECONDS = float(get("POLL_RETRY_SECONDS", "30"))
+        # Obergrenze für Portal-Anfragen pro Sekunde über alle Benutzer (0 = keine)
+        self.MAX_REQUESTS_PER_SECOND = float(get("MAX_REQUESTS_PER_SECOND", "0"))
+        # Optionales Verzeichnis, in dem die Portal-Cookies je Benutzer über
+        # Neustarts hinweg gespeichert werden (leer = nur im Speicher)
+        self.SESSION_COOKIE_DIR = get("SESSION_COOKIE_DIR", "")
+        # Mehrere Benutzer aus der Umgebung laden
+        self.USERS = _users_from_env(env, self.DEBUG_LOCAL)
+        for name, value in overrides.items():
+            if name not in self.__slots__:
+                raise TypeError(f"Unbekannte Einstellung: {name}")
+            setattr(self, name, value)
+
+    def missing(self) -> list[str]:
+        """Names of the required settings that are not set."""
+        missing = []
+        if not self.USERS:
+            missing.append("USERn" if self.DEBUG_LOCAL else "USERn/USERNAMEn/PASSWORDn")
+        if not self.DISCORD_TOKEN:
+            missing.append("DISCORD_TOKEN")
+        if not self.DISCORD_CHANNEL_ID:
+            missing.append("DISCORD_CHANNEL_ID")
+        return missing
+
+
+def load_config(path: str | None = None) -> Config:
+    """Read the .env file into os.environ and return the resulting Config.
+
+    Variables that are already set keep precedence, so tests and external
+    deployments can override local defaults from the file.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv(env_path if path is None else path, override=False)
+    return Config()
+
+
+# Die aktive Konfiguration; ihre Werte stehen zusätzlich als Modulkonstanten bereit
+_config: Config | None = None
+
+
+def configure(config: Config) -> None:
+    """Make config the active configuration of this module.
+
+    Everything built from the previous settings is dropped and recreated
+    on first use: outbox, state store, grade history, schedules, stored
+    states, portal sessions, connection pools, host limits, table cache,
+    page validators and the Discord rate-limit bucket.
+    """
+    global _config, _outbox, _state_store, _grade_history, _schedules, _request_limiter, old_data
+    _reset_connections()
+    _config = config
+    globals().update((name, getattr(config, name)) for name in Config.__slots__)
+    if _state_store is not None:
+        _state_store.close()
+    _outbox = _state_store = _grade_history = _schedules = None
+    old_data = {}
+    # Ein vollständiger Login-Abruf (drei Anfragen) darf immer sofort starten
+    _request_limiter = (
+        scheduler.RateLimiter(config.MAX_REQUESTS_PER_SECOND, burst=max(3.0, config.MAX_REQUESTS_PER_SECOND))
+        if config.MAX_REQUESTS_PER_SECOND > 0
+        else None
+    )
 
 
 def check_env():
     """Ensure all required environment variables are present."""
-    missing = []
-    if not USERS:
-        missing.append("USERn" if DEBUG_LOCAL else "USERn/USERNAMEn/PASSWORDn")
-    if not DISCORD_TOKEN:
-        missing.append("DISCORD_TOKEN")
-    if not DISCORD_CHANNEL_ID:
-        missing.append("DISCORD_CHANNEL_ID")
+    missing = _config.missing()
     if missing:
         logging.error("Fehlende Umgebungsvariablen: " + ", ".join(missing))
         raise SystemExit(1)
 
 
-# Logging einstellen (Schreiben in noten_checker.log mit Zeitstempel und Level)
-logging.basicConfig(
-    filename="noten_checker.log",
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-)
+def setup_logging() -> None:
+    """Log to noten_checker.log with timestamp and level (command-line use only)."""
+    logging.basicConfig(
+        filename="noten_checker.log",
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+    )
+
+
+# Aus der Konfiguration abgeleitet und erst beim ersten Gebrauch angelegt
+_outbox: _Outbox | None = None
+_state_store: state_store.StateStore | None = None
+_grade_history: grade_history.GradeHistory | None = None
+_schedules: dict[str, scheduler.UserSchedule] | None = None
+_request_limiter: scheduler.RateLimiter | None = None
+_lazy_lock = threading.Lock()
+# Gespeicherte Notenstände pro Benutzer, beim ersten Abruf gelesen; im Speicher als GradeReport
+old_data = {}
+
+
+# Bevorzugte Reihenfolge der Tree-Builder, schnellster zuerst.
+PARSER_BACKENDS = ("lxml", "html.parser")
+
 
+def available_parser_backends() -> list[str]:
+    """Return the supported BeautifulSoup tree builders installed here."""
+    from bs4.builder import builder_registry
 
-check_env()
+    return [name for name in PARSER_BACKENDS if builder_registry.lookup(name) is not None]
+
+
+def _resolve_parser_backend(name: str | None = None) -> str:
+    """Map a configured backend name to an installed tree builder."""
+    if name is None:
+        name = HTML_PARSER
+    available = available_parser_backends()
+    if name in ("auto", "stream"):
+        # "stream" nutzt den Baum nur als Rückfallebene.
+        return available[0]
+    if name in available:
+        return name
+    logging.warning("HTML-Parser %s nicht verfügbar, nutze html.parser", name)
+    return "html.parser"
 
 
 def _iter_cells(row):
     """Yield td elements, also converting stray text nodes to td-like objects."""
+    from bs4 import NavigableString, Tag
+
     cells = []
     for child in row.children:
         if isinstance(child, NavigableString):
             text = child.strip()
             if text:
-                dummy = BeautifulSoup(f"<td>{text}</td>", "html.parser").td
+                dummy = Tag(name="td")
+                dummy.string = text
                 cells.append(dummy)
         elif getattr(child, "name", None) == "td":
             cells.append(child)
@@ -113,24 +326,34 @@ def _parse_non_negative_int(text: str) -> int | None:
     return value if value >= 0 else None
 
 
-def _parse_semester_table(table):
-    """Parse a semester table and return structured grade information."""
-    result = {}
+_PERIOD_TABLE_ID_RE = re.compile(r"^student_main_grades_table_(\d+)$")
+
+
+def _row_cells(row) -> list[tuple[str, list[str]]]:
+    """Return the cells of a table row as (text, classes) pairs."""
+    return [(td.get_text(strip=True), td.get("class", [])) for td in _iter_cells(row)]
+
+
+def _table_rows(table) -> list[list[tuple[str, list[str]]]] | None:
+    """Return the tbody rows of a table, or None when it has no body."""
     if not table or not table.tbody:
-        return result
+        return None
+    return [_row_cells(row) for row in table.tbody.find_all("tr")]
+
 
-    for row in table.tbody.find_all("tr"):
-        cells = _iter_cells(row)
+def _parse_semester_rows(rows) -> dict[str, dict[str, object]]:
+    """Turn the body rows of a semester table into structured grade information."""
+    result = {}
+    for cells in rows or []:
         if not cells:
             continue
 
-        subject = cells[0].get_text(strip=True)
+        subject = cells[0][0]
         # Separate final_average cells from regular grade cells
         finals = []
         values = []
-        for td in cells[1:]:
-            text = td.get_text(strip=True)
-            if "final_average" in td.get("class", []):
+        for text, classes in cells[1:]:
+            if "final_average" in classes:
                 finals.append(_parse_non_negative_float(text))
             else:
                 values.append(text)
@@ -166,72 +389,327 @@ def _parse_semester_table(table):
     return result
 
 
-def _extract_period_numbers(period_tables, all_table, final_container) -> list[int]:
-    """Detect available Halbjahre from the rendered portal sections."""
-    if period_tables:
-        return sorted(period_tables.keys())
+def _parse_semester_table(table):
+    """Parse a semester table and return structured grade information."""
+    return _parse_semester_rows(_table_rows(table))
+
+
+def _header_cells(table) -> list[tuple[list[str], str, str | None]]:
+    """Return classes, text and colspan of the th cells in the first header row."""
+    if not table or not table.thead:
+        return []
+    first_header_row = table.thead.find("tr")
+    if not first_header_row:
+        return []
+    return [
+        (th.get("class", []), th.get_text(" ", strip=True), th.get("colspan"))
+        for th in first_header_row.find_all("th")
+    ]
+
+
+def _overview_section(header, rows) -> dict:
+    """Keep the Halbjahr group headers and body rows of the overview table."""
+    return {
+        "header": [(text, colspan) for classes, text, colspan in header if "text-center" in classes],
+        "rows": rows,
+    }
 
-    period_count = 0
-    if all_table and all_table.thead:
-        first_header_row = all_table.thead.find("tr")
-        if first_header_row:
-            period_count = max(period_count, len(first_header_row.find_all("th", class_="text-center")))
 
+def _final_section(header, rows) -> dict:
+    """Keep the number of score columns and body rows of the final-grades table."""
+    count = 0
+    for classes, _, _ in header:
+        if "display_final_grade" in classes or "display_avg" in classes:
+            count += 1
+    return {"header_count": count, "rows": rows}
+
+
+def _soup_grade_tables(soup) -> dict:
+    """Extract the grade sections from a BeautifulSoup document."""
+    periods: dict[int, list | None] = {}
+    for table in soup.find_all("table", id=_PERIOD_TABLE_ID_RE):
+        match = _PERIOD_TABLE_ID_RE.match(table.get("id", ""))
+        if not match:
+            continue
+        periods[int(match.group(1))] = _table_rows(table)
+
+    overview = None
+    all_table = soup.find("table", id="student_main_grades_table_all")
+    if all_table:
+        overview = _overview_section(_header_cells(all_table), _table_rows(all_table))
+
+    final = None
+    final_container = soup.find("div", id=re.compile("student_final_grades_container"))
     if final_container:
         final_table = final_container.find("table")
-        if final_table and final_table.thead:
-            header_row = final_table.thead.find("tr")
-            if header_row:
-                count = 0
-                for th in header_row.find_all("th"):
-                    classes = th.get("class", [])
-                    if "display_final_grade" in classes or "display_avg" in classes:
-                        count += 1
-                if count:
-                    period_count = max(period_count, count // 2)
+        final = _final_section(_header_cells(final_table), _table_rows(final_table))
+
+    return {"periods": periods, "overview": overview, "final": final}
+
+
+class _GradeStreamParser(HTMLParser):
+    """Collect the grade sections from the token stream without building a tree.
+
+    Markup that the BeautifulSoup path could read differently (nested tables
+    or cells, foreign tags inside rows, unclosed sections) marks the result
+    as unusable, so the caller falls back to the tree-based extraction.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = {"periods": {}, "overview": None, "final": None}
+        self.broken = False
+        self._region = None
+        self._period = None
+        self._div_depth = 0
+        self._table = None
+        self._final_table_done = False
+        self._row = None
+        self._cell = None
+        self._text = []
+
+    def result(self) -> dict | None:
+        """Return the extracted sections, or None if the stream was not trustworthy."""
+        if self.broken or self._region is not None:
+            return None
+        return self.tables
+
+    def _new_table(self) -> dict:
+        return {"thead": "pending", "header_row": "pending", "tbody_depth": 0, "header": [], "rows": None}
+
+    def _flush_text(self) -> None:
+        if not self._text:
+            return
+        text = "".join(self._text).strip()
+        self._text = []
+        if not text:
+            return
+        if self._cell is not None:
+            self._cell["parts"].append(text)
+        elif self._row is not None:
+            # Lose Textknoten in einer Zeile zählen wie bei _iter_cells als Zelle.
+            self._row.append((text, []))
+
+    def _close_cell(self) -> None:
+        cell = self._cell
+        if cell is None:
+            return
+        self._cell = None
+        if cell["tag"] == "th":
+            self._table["header"].append((cell["classes"], " ".join(cell["parts"]), cell["colspan"]))
+        else:
+            self._row.append(("".join(cell["parts"]), cell["classes"]))
+
+    def _close_row(self) -> None:
+        self._close_cell()
+        if self._row is not None:
+            self._table["rows"].append(self._row)
+            self._row = None
+
+    def _open_region(self, tag: str, attrs: dict) -> None:
+        element_id = attrs.get("id") or ""
+        if tag == "table":
+            if element_id == "student_main_grades_table_all":
+                if self.tables["overview"] is not None:
+                    return
+                self._region = "all"
+            else:
+                match = _PERIOD_TABLE_ID_RE.match(element_id)
+                if not match:
+                    return
+                self._region = "period"
+                self._period = int(match.group(1))
+            self._table = self._new_table()
+        elif tag == "div" and "student_final_grades_container" in element_id:
+            if self.tables["final"] is not None:
+                return
+            self._region = "final"
+            self._div_depth = 1
+            self._table = None
+            self._final_table_done = False
+            self.tables["final"] = _final_section([], None)
+
+    def _close_table(self) -> None:
+        self._close_row()
+        table = self._table
+        self._table = None
+        if self._region == "period":
+            self.tables["periods"][self._period] = table["rows"]
+            self._region = None
+        elif self._region == "all":
+            self.tables["overview"] = _overview_section(table["header"], table["rows"])
+            self._region = None
+        else:
+            self.tables["final"] = _final_section(table["header"], table["rows"])
+            self._final_table_done = True
+
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if self.broken:
+            return
+        attrs = dict(attrs)
+        if self._region is None:
+            self._open_region(tag, attrs)
+            return
+        if tag in ("script", "style"):
+            self.broken = True
+            return
+        if tag == "div" and self._region == "final":
+            self._div_depth += 1
+            return
+        table = self._table
+        if tag == "table":
+            element_id = attrs.get("id") or ""
+            if table is not None or "student_main_grades_table_" in element_id:
+                self.broken = True
+            elif self._region == "final" and not self._final_table_done:
+                self._table = self._new_table()
+            return
+        if table is None:
+            return
+        if self._row is not None and self._cell is None and tag != "td":
+            # Fremde Elemente direkt in einer Zeile liest BeautifulSoup anders.
+            self.broken = True
+            return
+        if tag == "thead":
+            if table["thead"] == "pending":
+                table["thead"] = "open"
+        elif tag == "tbody":
+            if table["tbody_depth"]:
+                table["tbody_depth"] += 1
+            elif table["rows"] is None:
+                table["rows"] = []
+                table["tbody_depth"] = 1
+        elif tag == "tr":
+            if table["thead"] == "open" and table["header_row"] == "pending":
+                table["header_row"] = "open"
+            elif table["tbody_depth"] and table["header_row"] != "open":
+                self._row = []
+        elif tag in ("td", "th"):
+            if self._cell is not None:
+                self.broken = True
+            elif table["header_row"] == "open":
+                if tag == "th":
+                    self._cell = {
+                        "tag": "th",
+                        "classes": (attrs.get("class") or "").split(),
+                        "colspan": attrs.get("colspan"),
+                        "parts": [],
+                    }
+            elif self._row is not None:
+                self._cell = {"tag": "td", "classes": (attrs.get("class") or "").split(), "parts": []}
+
+    def handle_endtag(self, tag):
+        self._flush_text()
+        if self.broken or self._region is None:
+            return
+        if tag == "div" and self._region == "final":
+            self._div_depth -= 1
+            if self._div_depth == 0:
+                if self._table is not None:
+                    self.broken = True
+                self._region = None
+            return
+        table = self._table
+        if table is None:
+            return
+        if tag in ("td", "th"):
+            if self._cell is not None and self._cell["tag"] == tag:
+                self._close_cell()
+        elif tag == "tr":
+            if table["header_row"] == "open":
+                self._close_cell()
+                table["header_row"] = "done"
+            elif self._row is not None:
+                self._close_row()
+        elif tag == "thead":
+            if table["header_row"] == "open":
+                self._close_cell()
+                table["header_row"] = "done"
+            if table["thead"] == "open":
+                table["thead"] = "done"
+        elif tag == "tbody":
+            if table["tbody_depth"]:
+                self._close_row()
+                table["tbody_depth"] -= 1
+        elif tag == "table":
+            self._close_table()
+
+    def handle_data(self, data):
+        if self._cell is not None or self._row is not None:
+            self._text.append(data)
+
+    def handle_comment(self, data):
+        self._flush_text()
+        if self._cell is None and self._row is not None:
+            # BeautifulSoup führt Kommentare als Textknoten der Zeile.
+            text = data.strip()
+            if text:
+                self._row.append((text, []))
+
+
+def _stream_grade_tables(html: str) -> dict | None:
+    """Extract the grade sections in one pass over the token stream.
+
+    Returns None when the structural checks fail and a tree-based parse is needed.
+    """
+    parser = _GradeStreamParser()
+    parser.feed(html)
+    parser.close()
+    return parser.result()
+
+
+def _extract_period_numbers(tables: dict) -> list[int]:
+    """Detect available Halbjahre from the rendered portal sections."""
+    if tables["periods"]:
+        return sorted(tables["periods"].keys())
+
+    period_count = 0
+    if tables["overview"]:
+        period_count = max(period_count, len(tables["overview"]["header"]))
+
+    if tables["final"]:
+        count = tables["final"]["header_count"]
+        if count:
+            period_count = max(period_count, count // 2)
 
     return list(range(1, period_count + 1))
 
 
-def _parse_overview_period_averages(all_table, period_count: int) -> tuple[dict[str, list[float | None]], list[float | None]]:
+def _parse_overview_period_averages(overview: dict | None, period_count: int) -> tuple[dict[str, list[float | None]], list[float | None]]:
     """Parse the grouped all-period table and return per-subject and top-level averages."""
     per_subject: dict[str, list[float | None]] = {}
     top_level: list[float | None] = []
-    if not all_table:
+    if not overview:
         return per_subject, top_level
 
     group_sizes: list[int] = []
-    if all_table.thead:
-        first_header_row = all_table.thead.find("tr")
-        if first_header_row:
-            for th in first_header_row.find_all("th", class_="text-center"):
-                text = th.get_text(" ", strip=True)
-                matches = re.findall(r"-?[0-9]+,[0-9]+", text)
-                top_level.append(
-                    next(
-                        (
-                            parsed
-                            for parsed in (_parse_non_negative_float(match) for match in matches)
-                            if parsed is not None
-                        ),
-                        None,
-                    )
-                )
-                try:
-                    colspan = int(th.get("colspan") or 0)
-                except ValueError:
-                    colspan = 0
-                if colspan > 0:
-                    group_sizes.append(colspan)
+    for text, colspan in overview["header"]:
+        matches = re.findall(r"-?[0-9]+,[0-9]+", text)
+        top_level.append(
+            next(
+                (
+                    parsed
+                    for parsed in (_parse_non_negative_float(match) for match in matches)
+                    if parsed is not None
+                ),
+                None,
+            )
+        )
+        try:
+            colspan = int(colspan or 0)
+        except ValueError:
+            colspan = 0
+        if colspan > 0:
+            group_sizes.append(colspan)
 
-    if not all_table.tbody:
+    if overview["rows"] is None:
         return per_subject, top_level
 
-    for row in all_table.tbody.find_all("tr"):
-        cells = _iter_cells(row)
+    for cells in overview["rows"]:
         if not cells:
             continue
-        subject = cells[0].get_text(strip=True)
+        subject = cells[0][0]
         row_cells = cells[1:]
         period_averages: list[float | None] = []
 
@@ -241,15 +719,16 @@ def _parse_overview_period_averages(all_table, period_count: int) -> tuple[dict[
                 segment = row_cells[offset : offset + size]
                 offset += size
                 finals = [
-                    _parse_non_negative_float(td.get_text(strip=True))
-                    for td in segment
-                    if "final_average" in td.get("class", [])
+                    _parse_non_negative_float(text)
+                    for text, classes in segment
+                    if "final_average" in classes
                 ]
                 period_averages.append(finals[-1] if finals else None)
         else:
             finals = [
-                _parse_non_negative_float(td.get_text(strip=True))
-                for td in row.find_all("td", class_="final_average")
+                _parse_non_negative_float(text)
+                for text, classes in cells
+                if "final_average" in classes
             ]
             if period_count:
                 period_averages = finals[:period_count]
@@ -261,159 +740,616 @@ def _parse_overview_period_averages(all_table, period_count: int) -> tuple[dict[
     return per_subject, top_level
 
 
-def _subject_has_period_data(subject_info: dict[str, object], label: str) -> bool:
-    return (
-        bool(subject_info.get(f"{label}Exams"))
-        or bool(subject_info.get(f"{label}Grades"))
-        or subject_info.get(f"{label}GradesAverage") is not None
-        or subject_info.get(f"{label}Average") is not None
-        or subject_info.get(f"{label}FinalGrade") is not None
-    )
+class PeriodGrades:
+    """Grades of one subject in one Halbjahr."""
 
+    __slots__ = ("exams", "grades", "grades_average", "average", "final_grade")
 
-def _derive_year_average(subject_info: dict[str, object], period_labels: list[str]) -> float | None:
-    """Use the current active Halbjahr average, but never fall back across periods."""
-    latest_active_label = None
-    for label in period_labels:
-        if _subject_has_period_data(subject_info, label):
-            latest_active_label = label
-    if not latest_active_label:
-        return None
-    value = subject_info.get(f"{latest_active_label}Average")
-    if isinstance(value, (int, float)):
-        return float(value)
-    return None
+    def __init__(self, exams=None, grades=None, grades_average=None, average=None, final_grade=None):
+        self.exams: list[str] = exams if exams is not None else []
+        self.grades: list[str] = grades if grades is not None else []
+        self.grades_average: float | None = grades_average
+        self.average: float | None = average
+        self.final_grade: int | None = final_grade
+
+    def fingerprint(self) -> int:
+        """Hash of the period contents.
+
+        Computed on every call: the lists stay mutable, so a cached value
+        could hide a later change.
+        """
+        return hash((tuple(self.exams), tuple(self.grades), self.grades_average, self.average, self.final_grade))
+
+    def has_data(self) -> bool:
+        return (
+            bool(self.exams)
+            or bool(self.grades)
+            or self.grades_average is not None
+            or self.average is not None
+            or self.final_grade is not None
+        )
+
+
+class SubjectGrades:
+    """All Halbjahre of one subject, indexed by period number."""
+
+    __slots__ = ("periods", "current_period_average", "final_grade", "extra")
+
+    def __init__(self):
+        self.periods: dict[int, PeriodGrades] = {}
+        self.current_period_average: float | None = None
+        self.final_grade: int | None = None
+        # Unbekannte Schlüssel aus Statusdateien, damit nichts verloren geht
+        self.extra: dict[str, object] | None = None
 
+    def fingerprint(self) -> int:
+        """Hash over all periods and averages, computed on every call like PeriodGrades.fingerprint."""
+        return hash(
+            (
+                self.current_period_average,
+                self.final_grade,
+                tuple((number, self.periods[number].fingerprint()) for number in sorted(self.periods)),
+            )
+        )
+
+    def period(self, number: int) -> PeriodGrades:
+        """Return the period, creating an empty one on first access."""
+        period = self.periods.get(number)
+        if period is None:
+            period = self.periods[number] = PeriodGrades()
+        return period
+
+    def latest_period_average(self, period_numbers: list[int]) -> float | None:
+        """Use the current active Halbjahr average, but never fall back across periods."""
+        latest = None
+        for number in period_numbers:
+            period = self.periods.get(number)
+            if period is not None and period.has_data():
+                latest = period
+        if latest is None:
+            return None
+        if isinstance(latest.average, (int, float)):
+            return float(latest.average)
+        return None
 
-def _has_grade_markup(soup: BeautifulSoup) -> bool:
-    """Return True when the response contains the expected grade UI."""
+    def to_dict(self, period_numbers: list[int]) -> dict[str, object]:
+        info: dict[str, object] = {}
+        listed = set(period_numbers)
+        for number in sorted(self.periods):
+            period = self.periods[number]
+            label = f"H{number}"
+            if number in listed:
+                info[f"{label}Exams"] = period.exams
+                info[f"{label}Grades"] = period.grades
+                info[f"{label}GradesAverage"] = period.grades_average
+                info[f"{label}Average"] = period.average
+            elif period.average is not None:
+                # Halbjahre, die nur im Zeugnisbereich auftauchen
+                info[f"{label}Average"] = period.average
+            info[f"{label}FinalGrade"] = period.final_grade
+        info["YearAverage"] = self.current_period_average
+        info["CurrentPeriodAverage"] = self.current_period_average
+        info["FinalGrade"] = self.final_grade
+        if self.extra:
+            info.update(self.extra)
+        return info
+
+    @classmethod
+    def from_dict(cls, info: dict) -> "SubjectGrades":
+        subject = cls()
+        for key, value in info.items():
+            match = _PERIOD_KEY_RE.match(key)
+            if match:
+                period = subject.period(int(match.group(1)))
+                field = _PERIOD_KEY_FIELDS[match.group(2)]
+                if field in ("exams", "grades"):
+                    value = list(value or [])
+                setattr(period, field, value)
+            elif key == "FinalGrade":
+                subject.final_grade = value
+            elif key not in ("CurrentPeriodAverage", "YearAverage"):
+                if subject.extra is None:
+                    subject.extra = {}
+                subject.extra[key] = value
+        subject.current_period_average = info.get("CurrentPeriodAverage", info.get("YearAverage"))
+        return subject
+
+
+_PERIOD_KEY_RE = re.compile(r"^H(\d+)(Exams|Grades|GradesAverage|Average|FinalGrade)$")
+_PERIOD_KEY_FIELDS = {
+    "Exams": "exams",
+    "Grades": "grades",
+    "GradesAverage": "grades_average",
+    "Average": "average",
+    "FinalGrade": "final_grade",
+}
+
+
+class GradeReport:
+    """Parsed grade overview of one user.
+
+    The JSON status files keep the flat string-keyed layout of parse_grades;
+    from_dict/to_dict convert between both representations.
+    """
+
+    __slots__ = ("subjects", "period_numbers", "final_average", "period_averages", "fingerprint", "extra")
+
+    def __init__(self, subjects=None, period_numbers=None, final_average=None, period_averages=None):
+        self.subjects: dict[str, SubjectGrades] = subjects if subjects is not None else {}
+        self.period_numbers: list[int] = period_numbers if period_numbers is not None else []
+        self.final_average: float | None = final_average
+        self.period_averages: dict[int, float] = period_averages if period_averages is not None else {}
+        self.fingerprint: str | None = None
+        self.extra: dict[str, object] | None = None
+
+    def known_period_numbers(self) -> list[int]:
+        """Return the listed Halbjahre, or those found in the subjects for old state files."""
+        if self.period_numbers:
+            return self.period_numbers
+        found = set()
+        for subject in self.subjects.values():
+            found.update(subject.periods)
+        return sorted(found)
+
+    def to_dict(self) -> dict[str, object]:
+        data: dict[str, object] = {
+            "subjects": {
+                name: subject.to_dict(self.period_numbers) for name, subject in self.subjects.items()
+            },
+            "FinalAverage": self.final_average,
+            "PeriodLabels": [f"H{number}" for number in self.period_numbers],
+        }
+        for number in sorted(self.period_averages):
+            data[f"N{number}"] = self.period_averages[number]
+        if self.fingerprint is not None:
+            data["Fingerprint"] = self.fingerprint
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> "GradeReport":
+        report = cls()
+        if not isinstance(data, dict):
+            return report
+        for key, value in data.items():
+            if key == "subjects":
+                report.subjects = {
+                    name: SubjectGrades.from_dict(info or {}) for name, info in (value or {}).items()
+                }
+            elif key == "PeriodLabels":
+                report.period_numbers = [
+                    int(label[1:]) for label in value or [] if re.fullmatch(r"H\d+", str(label))
+                ]
+            elif key == "FinalAverage":
+                report.final_average = value
+            elif key == "Fingerprint":
+                report.fingerprint = value
+            elif re.fullmatch(r"N\d+", key):
+                report.period_averages[int(key[1:])] = value
+            else:
+                if report.extra is None:
+                    report.extra = {}
+                report.extra[key] = value
+        return report
+
+
+def _as_report(data) -> GradeReport:
+    """Accept a GradeReport or its dict form (status files, tests)."""
+    if isinstance(data, GradeReport):
+        return data
+    return GradeReport.from_dict(data)
+
+
+def _has_grade_markup(document) -> bool:
+    """Return True when a parsed document or extracted sections contain the grade UI."""
+    if isinstance(document, dict):
+        return bool(
+            document["periods"]
+            or document["overview"] is not None
+            or document["final"] is not None
+        )
     return bool(
-        soup.find("table", id=re.compile(r"^student_main_grades_table_(all|\d+)$"))
-        or soup.find("div", id=re.compile("student_final_grades_container"))
+        document.find("table", id=re.compile(r"^student_main_grades_table_(all|\d+)$"))
+        or document.find("div", id=re.compile("student_final_grades_container"))
     )
 
 
-def parse_grades(html):
-    """Parse grades tables from HTML and return structured data."""
-    soup = BeautifulSoup(html, "html.parser")
+# Start-Tags der Bereiche, die parse_grades tatsächlich liest. Der Rest der
+# Portalseite (Skripte, Navigation, Kalender) wird gar nicht erst geparst.
+_GRADE_REGION_START_RE = re.compile(
+    r"<script\b[^>]*>.*?</script\s*>|<!--.*?-->"
+    r"|<(table)\b[^>]*?\bid\s*=\s*[\"'](student_main_grades_table_(?:all|\d+))[\"'][^>]*>"
+    r"|<(div)\b[^>]*?\bid\s*=\s*[\"']([^\"']*student_final_grades_container[^\"']*)[\"'][^>]*>",
+    re.IGNORECASE | re.DOTALL,
+)
+_REGION_TAG_RES = {
+    "table": re.compile(r"<!--.*?-->|<(/?)table\b[^>]*>", re.IGNORECASE | re.DOTALL),
+    "div": re.compile(r"<!--.*?-->|<(/?)div\b[^>]*>", re.IGNORECASE | re.DOTALL),
+}
+_GRADE_REGION_HINTS = ("student_main_grades_table_", "student_final_grades_container")
+# Die Tabellen bestehen großteils aus Einrückung zwischen Tags; diese Text-
+# knoten ignoriert die Auswertung ohnehin und sie blähen nur den Baum auf.
+_INTER_TAG_WHITESPACE_RE = re.compile(r">\s+<")
+
+
+def _region_end(html: str, tag: str, start: int) -> int | None:
+    """Return the end offset of the element opened at start, or None if unbalanced."""
+    depth = 0
+    for match in _REGION_TAG_RES[tag].finditer(html, start):
+        closing = match.group(1)
+        if closing is None:
+            # Kommentar, z. B. auskommentierte Container im Portal
+            continue
+        depth += -1 if closing else 1
+        if depth == 0:
+            return match.end()
+    return None
+
+
+def _grade_regions(html: str) -> list[tuple[str, str]] | None:
+    """Cut the grade tables and the final-grades container out of a portal page.
 
-    period_tables: dict[int, dict[str, dict[str, object]]] = {}
-    for table in soup.find_all("table", id=re.compile(r"^student_main_grades_table_(\d+)$")):
-        match = re.match(r"^student_main_grades_table_(\d+)$", table.get("id", ""))
-        if not match:
+    Returns (element id, region HTML) pairs in document order, an empty list
+    when the page has no grade markup and None when the markup cannot be
+    sliced reliably and needs a full parse.
+    """
+    regions = []
+    last_end = 0
+    for match in _GRADE_REGION_START_RE.finditer(html):
+        tag = match.group(1) or match.group(3)
+        if tag is None or match.start() < last_end:
+            # Skripte und Kommentare dürfen keine Bereiche eröffnen.
             continue
-        idx = int(match.group(1))
-        period_tables[idx] = _parse_semester_table(table)
+        end = _region_end(html, tag.lower(), match.start())
+        if end is None:
+            return None
+        region_html = _INTER_TAG_WHITESPACE_RE.sub("><", html[match.start():end])
+        regions.append((match.group(2) or match.group(4), region_html))
+        last_end = end
+    if not regions and any(hint in html for hint in _GRADE_REGION_HINTS):
+        # Ungewöhnlich notierte ids: lieber das ganze Dokument parsen.
+        return None
+    return regions
 
-    all_table = soup.find("table", id="student_main_grades_table_all")
-    final_container = soup.find("div", id=re.compile("student_final_grades_container"))
-    period_numbers = _extract_period_numbers(period_tables, all_table, final_container)
-    period_labels = [f"H{num}" for num in period_numbers]
-    label_map = {num: f"H{num}" for num in period_numbers}
 
-    finals_by_subject, num_values = _parse_overview_period_averages(all_table, len(period_numbers))
+def _join_regions(regions: list[tuple[str, str]]) -> str:
+    return "\n".join(region_html for _, region_html in regions)
+
+
+def _slice_grade_regions(html: str) -> str | None:
+    """Return the grade regions of a page as one string (see _grade_regions)."""
+    regions = _grade_regions(html)
+    if regions is None:
+        return None
+    return _join_regions(regions)
+
+
+_OPEN_SCRIPT_OR_COMMENT_RE = re.compile(r"<script\b|<!--", re.IGNORECASE)
+
+
+class _GradeRegionScanner:
+    """Cut the grade regions out of a page that arrives in chunks.
+
+    Text outside the regions is dropped as soon as it has been scanned, so
+    only the regions and an unfinished tail stay in memory. done becomes
+    True once the final-grades container has been closed.
+    """
+
+    def __init__(self):
+        self.regions: list[tuple[str, str]] = []
+        self.done = False
+        self.chars = 0
+        self.bytes = 0
+        self._buffer = ""
+        self._seen_hint = False
+
+    def feed(self, text: str) -> None:
+        self.chars += len(text)
+        self._buffer += text
+        pos = 0
+        while not self.done:
+            match = _GRADE_REGION_START_RE.search(self._buffer, pos)
+            if match is None:
+                break
+            if _OPEN_SCRIPT_OR_COMMENT_RE.search(self._buffer, pos, match.start()):
+                # Ein noch offenes Skript oder Kommentar: erst weiterlesen
+                break
+            tag = match.group(1) or match.group(3)
+            if tag is None:
+                pos = match.end()
+                continue
+            end = _region_end(self._buffer, tag.lower(), match.start())
+            if end is None:
+                break
+            region_html = _INTER_TAG_WHITESPACE_RE.sub("><", self._buffer[match.start():end])
+            self.regions.append((match.group(2) or match.group(4), region_html))
+            pos = end
+            if tag.lower() == "div":
+                self.done = True
+        self._discard(pos)
+
+    def _note_hints(self, text: str) -> None:
+        if not self._seen_hint and any(hint in text for hint in _GRADE_REGION_HINTS):
+            self._seen_hint = True
+
+    def _discard(self, pos: int) -> None:
+        """Drop scanned text but keep anything a later chunk could complete."""
+        keep = pos
+        tail = self._buffer[pos:]
+        opened = _OPEN_SCRIPT_OR_COMMENT_RE.search(tail)
+        region = _GRADE_REGION_START_RE.search(tail)
+        if opened is not None:
+            keep = pos + opened.start()
+        elif region is not None:
+            keep = pos + region.start()
+        else:
+            last_tag = tail.rfind("<")
+            if last_tag != -1:
+                keep = pos + last_tag
+            else:
+                keep = len(self._buffer)
+        self._note_hints(self._buffer[:keep])
+        self._buffer = self._buffer[keep:]
+
+    def result(self) -> tuple[list[tuple[str, str]] | None, str]:
+        """Return (regions, fallback text) like _grade_regions after the last chunk.
+
+        regions is None when a region stayed open; the fallback text then
+        holds everything that may still contain grade markup.
+        """
+        fallback = _join_regions(self.regions + [("", self._buffer)])
+        if not self.done and _GRADE_REGION_START_RE.search(self._buffer) and any(
+            hint in self._buffer for hint in _GRADE_REGION_HINTS
+        ):
+            return None, fallback
+        if not self.regions and (self._seen_hint or any(hint in self._buffer for hint in _GRADE_REGION_HINTS)):
+            return None, fallback
+        return self.regions, fallback
+
+
+# Formular-Token ändern sich bei jedem Abruf, gehören aber nicht zum Notenstand.
+_FINGERPRINT_NOISE_RE = re.compile(
+    r"<input\b[^>]*\bname\s*=\s*[\"'](?:_nonce|_f_secure|_?csrf[\w-]*)[\"'][^>]*>"
+    r"|\b(?:data-)?nonce\s*=\s*(?:\"[^\"]*\"|'[^']*')",
+    re.IGNORECASE,
+)
+
+
+class _Unchanged:
+    """Marker for a grades page whose grade regions match the stored fingerprint."""
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return "UNCHANGED"
+
+
+UNCHANGED = _Unchanged()
+
+
+def _fingerprint_regions(regions: str | None) -> str | None:
+    """Hash sliced grade regions, ignoring per-request form tokens."""
+    if not regions:
+        return None
+    normalized = _FINGERPRINT_NOISE_RE.sub("", regions)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _grade_fingerprint(html: str) -> str | None:
+    """Return the fingerprint of the grade-relevant part of a portal page."""
+    return _fingerprint_regions(_slice_grade_regions(html))
+
+
+def _grade_document(html, backend: str | None = None, presliced: bool = False) -> BeautifulSoup:
+    """Return a parsed document, reusing an already built BeautifulSoup tree.
+
+    Raw HTML is reduced to the grade regions before the tree is built.
+    """
+    if not isinstance(html, (str, bytes)):
+        return html
+    if isinstance(html, str) and not presliced:
+        regions = _slice_grade_regions(html)
+        if regions is not None:
+            html = regions
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, _resolve_parser_backend(backend))
+
+
+# Pro Benutzer die zuletzt gesehene Fassung jeder Notentabelle:
+# {cache_key: {element_id: {"hash", "section", "semester", "overview"}}}.
+# Die Benutzer bilden eine LRU-Liste, damit der Cache begrenzt bleibt.
+_table_cache: OrderedDict[str, dict[str, dict]] = OrderedDict()
+table_cache_stats = Counter()
+# Benutzer werden parallel abgefragt; das LRU selbst ist nicht threadsicher
+_table_cache_lock = threading.Lock()
+
+
+def _cached_grade_tables(regions: list[tuple[str, str]], cache_key: str) -> dict | None:
+    """Extract the grade sections, re-reading only tables whose HTML hash changed."""
+    with _table_cache_lock:
+        user_cache = _table_cache.pop(cache_key, {})
+        _table_cache[cache_key] = user_cache
+        while len(_table_cache) > TABLE_CACHE_USERS:
+            _table_cache.popitem(last=False)
+
+    tables = {"periods": {}, "overview": None, "final": None, "semesters": {}}
+    current: dict[str, dict] = {}
+    stats = Counter()
+    for element_id, region_html in regions:
+        digest = hashlib.sha1(region_html.encode("utf-8")).hexdigest()
+        entry = user_cache.get(element_id)
+        if entry is not None and entry["hash"] == digest:
+            stats["hits"] += 1
+        else:
+            section = _stream_grade_tables(region_html)
+            if section is None:
+                return None
+            stats["misses"] += 1
+            entry = {"hash": digest, "section": section, "semester": {}, "overview": {}}
+            for idx, rows in section["periods"].items():
+                entry["semester"][idx] = _parse_semester_rows(rows)
+        current[element_id] = entry
+
+        section = entry["section"]
+        for idx, rows in section["periods"].items():
+            tables["periods"][idx] = rows
+            tables["semesters"][idx] = entry["semester"][idx]
+        if tables["overview"] is None and section["overview"] is not None:
+            tables["overview"] = section["overview"]
+            tables["overview_cache"] = entry["overview"]
+        if tables["final"] is None and section["final"] is not None:
+            tables["final"] = section["final"]
+
+    with _table_cache_lock:
+        table_cache_stats.update(stats)
+        # Tabellen, die nicht mehr auf der Seite stehen, fliegen aus dem Cache.
+        if cache_key in _table_cache:
+            _table_cache[cache_key] = current
+    return tables
+
+
+def _extract_grade_tables(document, backend: str | None = None, cache_key: str | None = None) -> dict:
+    """Extract the grade sections from raw HTML, sliced regions or a parsed document.
+
+    Raw HTML and regions are streamed when the backend allows it; with a
+    cache_key unchanged tables are taken from the per-user table cache.
+    """
+    if backend is None:
+        backend = HTML_PARSER
+    if isinstance(document, str):
+        regions = _grade_regions(document)
+        if regions is not None:
+            document = regions
+    if isinstance(document, list):
+        if backend in ("auto", "stream"):
+            tables = None
+            if cache_key is not None:
+                tables = _cached_grade_tables(document, cache_key)
+            if tables is None:
+                tables = _stream_grade_tables(_join_regions(document))
+            if tables is not None:
+                return tables
+            logging.info("Streaming-Parser nicht anwendbar, nutze BeautifulSoup")
+        document = _join_regions(document)
+    elif isinstance(document, str) and backend in ("auto", "stream"):
+        tables = _stream_grade_tables(document)
+        if tables is not None:
+            return tables
+        logging.info("Streaming-Parser nicht anwendbar, nutze BeautifulSoup")
+    return _soup_grade_tables(_grade_document(document, backend, presliced=True))
+
+
+def parse_grades(html, backend: str | None = None, cache_key: str | None = None):
+    """Parse grades tables from HTML or a parsed document and return structured data.
+
+    With a cache_key, tables unchanged since the last call for that key are
+    not parsed again.
+    """
+    return _assemble_grades(_extract_grade_tables(html, backend, cache_key))
+
+
+def parse_grade_report(html, backend: str | None = None, cache_key: str | None = None) -> GradeReport:
+    """Like parse_grades, but return the typed GradeReport."""
+    return _assemble_report(_extract_grade_tables(html, backend, cache_key))
+
+
+def _assemble_grades(tables: dict) -> dict:
+    """Combine the extracted grade sections into the structure of parse_grades."""
+    return _assemble_report(tables).to_dict()
+
+
+def _assemble_report(tables: dict) -> GradeReport:
+    """Combine the extracted grade sections into a GradeReport."""
+    if "semesters" in tables:
+        period_tables: dict[int, dict[str, dict[str, object]]] = tables["semesters"]
+    else:
+        period_tables = {idx: _parse_semester_rows(rows) for idx, rows in tables["periods"].items()}
+    period_numbers = _extract_period_numbers(tables)
+
+    overview_cache = tables.get("overview_cache")
+    if overview_cache is not None and len(period_numbers) in overview_cache:
+        finals_by_subject, num_values = overview_cache[len(period_numbers)]
+    else:
+        finals_by_subject, num_values = _parse_overview_period_averages(tables["overview"], len(period_numbers))
+        if overview_cache is not None:
+            overview_cache[len(period_numbers)] = (finals_by_subject, num_values)
 
     all_subjects: set[str] = set(finals_by_subject)
     for pdata in period_tables.values():
         all_subjects.update(pdata.keys())
 
-    subjects: dict[str, dict[str, object]] = {}
+    subjects: dict[str, SubjectGrades] = {}
     for subject in sorted(all_subjects):
-        subject_info: dict[str, object] = {}
-        for idx, period_num in enumerate(period_numbers):
-            label = label_map[period_num]
+        info = SubjectGrades()
+        for period_num in period_numbers:
             sem_data = period_tables.get(period_num, {}).get(subject, {})
-            subject_info[f"{label}Exams"] = sem_data.get("tests", [])
-            subject_info[f"{label}Grades"] = sem_data.get("grades", [])
-            subject_info[f"{label}GradesAverage"] = sem_data.get("grades_average")
-            subject_info[f"{label}Average"] = sem_data.get("average")
+            # Kopien, damit Aufrufer keine gecachten Listen verändern
+            info.periods[period_num] = PeriodGrades(
+                list(sem_data.get("tests", [])),
+                list(sem_data.get("grades", [])),
+                sem_data.get("grades_average"),
+                sem_data.get("average"),
+            )
 
         finals = finals_by_subject.get(subject, [])
         if finals and period_numbers:
-            for idx, label in enumerate(period_labels):
-                avg_key = f"{label}Average"
-                if subject_info.get(avg_key) is None and idx < len(finals):
+            for idx, period_num in enumerate(period_numbers):
+                period = info.periods[period_num]
+                if period.average is None and idx < len(finals):
                     value = finals[idx]
                     if value is not None:
-                        subject_info[avg_key] = value
-        subject_info["YearAverage"] = None
-        subjects[subject] = subject_info
-
-    if final_container:
-        ftbl = final_container.find("table")
-        if ftbl and ftbl.tbody:
-            for row in ftbl.tbody.find_all("tr"):
-                cells = _iter_cells(row)
-                if not cells:
-                    continue
-                subject = cells[0].get_text(strip=True)
-                score_cells = []
-                for td in cells[1:]:
-                    classes = td.get("class", [])
-                    if (
-                        "score_display" in classes
-                        or "display_avg" in classes
-                        or "display_final_grade" in classes
-                    ):
-                        score_cells.append(td)
-
-                def parse_int_cell(td):
-                    return _parse_non_negative_int(td.get_text(strip=True))
-
-                def parse_float_cell(td):
-                    return _parse_non_negative_float(td.get_text(strip=True))
-
-                avg_values: list[float | None] = []
-                final_values: list[int | None] = []
-                for td in score_cells:
-                    classes = td.get("class", [])
-                    if "display_avg" in classes:
-                        avg_values.append(parse_float_cell(td))
-                    if "display_final_grade" in classes:
-                        final_values.append(parse_int_cell(td))
-                if subject not in subjects:
-                    subjects[subject] = {}
-                subject_info = subjects[subject]
-                last_final = None
-                for idx, value in enumerate(avg_values):
-                    label = period_labels[idx] if idx < len(period_labels) else f"H{idx + 1}"
-                    key = f"{label}Average"
-                    if value is not None:
-                        subject_info[key] = value
-                for idx, value in enumerate(final_values):
-                    label = period_labels[idx] if idx < len(period_labels) else f"H{idx + 1}"
-                    subject_info[f"{label}FinalGrade"] = value
-                    if value is not None:
-                        last_final = value
-                subject_info["FinalGrade"] = last_final
-
-    for subject_info in subjects.values():
-        for idx, label in enumerate(period_labels, start=1):
-            subject_info.setdefault(f"{label}Exams", [])
-            subject_info.setdefault(f"{label}Grades", [])
-            subject_info.setdefault(f"{label}GradesAverage", None)
-            subject_info.setdefault(f"{label}Average", None)
-            subject_info.setdefault(f"{label}FinalGrade", None)
-        current_period_average = _derive_year_average(subject_info, period_labels)
-        subject_info["CurrentPeriodAverage"] = current_period_average
-        # Backwards-compatible key for existing status files and tests.
-        subject_info["YearAverage"] = current_period_average
-        subject_info.setdefault("FinalGrade", None)
-
-    result: dict[str, object] = {
-        "subjects": subjects,
-        "FinalAverage": next((value for value in reversed(num_values) if value is not None), None),
-        "PeriodLabels": period_labels,
-    }
-    for idx, value in enumerate(num_values, start=1):
-        if value is not None:
-            result[f"N{idx}"] = value
+                        period.average = value
+        subjects[subject] = info
 
-    return result
+    if tables["final"]:
+        for cells in tables["final"]["rows"] or []:
+            if not cells:
+                continue
+            subject = cells[0][0]
+            avg_values: list[float | None] = []
+            final_values: list[int | None] = []
+            for text, classes in cells[1:]:
+                if "display_avg" in classes:
+                    avg_values.append(_parse_non_negative_float(text))
+                if "display_final_grade" in classes:
+                    final_values.append(_parse_non_negative_int(text))
+            info = subjects.get(subject)
+            if info is None:
+                info = subjects[subject] = SubjectGrades()
+            last_final = None
+            for idx, value in enumerate(avg_values):
+                period_num = period_numbers[idx] if idx < len(period_numbers) else idx + 1
+                if value is not None:
+                    info.period(period_num).average = value
+            for idx, value in enumerate(final_values):
+                period_num = period_numbers[idx] if idx < len(period_numbers) else idx + 1
+                info.period(period_num).final_grade = value
+                if value is not None:
+                    last_final = value
+            info.final_grade = last_final
+
+    for info in subjects.values():
+        for period_num in period_numbers:
+            info.period(period_num)
+        info.current_period_average = info.latest_period_average(period_numbers)
+
+    return GradeReport(
+        subjects,
+        period_numbers,
+        final_average=next((value for value in reversed(num_values) if value is not None), None),
+        period_averages={idx: value for idx, value in enumerate(num_values, start=1) if value is not None},
+    )
 
 
 def _list_diff(old_list, new_list):
     """Return items that are new or changed compared to the previous list."""
+    old_list = old_list or []
+    new_list = new_list or []
+    # Üblicher Fall: Noten werden nur angehängt
+    if new_list[: len(old_list)] == old_list:
+        return list(new_list[len(old_list):])
     diff = []
     counter = Counter(old_list or [])
     for item in new_list or []:
@@ -446,73 +1382,96 @@ def _value_changed(old: object, new: object, *, abs_tol: float = 1e-4) -> bool:
     return old != new
 
 
-def _collect_subject_messages(user_name, new_data, old_data, show_year_average=True):
-    """Create Discord messages and keep the owning subject for state updates."""
-    period_labels = new_data.get("PeriodLabels") or []
-    subjects = new_data.get("subjects", {})
-    old_subjects = (old_data or {}).get("subjects", {}) if isinstance(old_data, dict) else {}
-
-    if not period_labels and subjects:
-        detected = set()
-        for info in subjects.values():
-            for key in info.keys():
-                match = re.match(r"^(H\d+)Grades$", key)
-                if match:
-                    detected.add(match.group(1))
-        period_labels = sorted(
-            detected,
-            key=lambda label: int(re.search(r"\d+", label).group(0)) if re.search(r"\d+", label) else label,
+class SubjectChange:
+    """What changed in one subject between two reports."""
+
+    __slots__ = ("subject", "added_grades", "added_exams", "final_grades", "old_average", "new_average")
+
+    def __init__(self, subject: str, old_average: float | None, new_average: float | None):
+        self.subject = subject
+        # Listen von (Halbjahr, Wert) in Reihenfolge der Halbjahre
+        self.added_grades: list[tuple[int, str]] = []
+        self.added_exams: list[tuple[int, str]] = []
+        self.final_grades: list[tuple[int, int]] = []
+        self.old_average = old_average
+        self.new_average = new_average
+
+    @property
+    def average_changed(self) -> bool:
+        return _value_changed(self.old_average, self.new_average)
+
+    @property
+    def grade_related(self) -> bool:
+        return bool(self.added_grades or self.added_exams)
+
+    def __bool__(self) -> bool:
+        return bool(self.added_grades or self.added_exams or self.final_grades or self.average_changed)
+
+    def __repr__(self) -> str:
+        return (
+            f"SubjectChange({self.subject!r}, grades={self.added_grades}, exams={self.added_exams}, "
+            f"finals={self.final_grades}, average={self.old_average!r}->{self.new_average!r})"
         )
 
+
+def diff_reports(new_data, old_data) -> list[SubjectChange]:
+    """Return the changed subjects of new_data compared to old_data.
+
+    Subjects and periods whose fingerprints match are skipped without
+    looking at their grade lists.
+    """
+    new_report = _as_report(new_data)
+    old_subjects = _as_report(old_data).subjects
+    period_numbers = new_report.known_period_numbers()
+    empty_period = PeriodGrades()
+    empty_subject = SubjectGrades()
+
+    changes = []
+    for subject, info in new_report.subjects.items():
+        old_info = old_subjects.get(subject, empty_subject)
+        if old_info.fingerprint() == info.fingerprint():
+            continue
+        change = SubjectChange(subject, old_info.current_period_average, info.current_period_average)
+        for number in period_numbers:
+            period = info.periods.get(number, empty_period)
+            old_period = old_info.periods.get(number, empty_period)
+            if period.fingerprint() == old_period.fingerprint():
+                continue
+            change.added_grades.extend((number, grade) for grade in _list_diff(old_period.grades, period.grades))
+            change.added_exams.extend((number, grade) for grade in _list_diff(old_period.exams, period.exams))
+            if period.final_grade is not None and period.final_grade != old_period.final_grade:
+                change.final_grades.append((number, period.final_grade))
+        if change:
+            changes.append(change)
+    return changes
+
+
+def render_changes(user_name, changes: list[SubjectChange], show_year_average=True) -> list[tuple[str, str]]:
+    """Turn a change-set into one Discord message per subject."""
     messages = []
-    for subject, info in subjects.items():
+    for change in changes:
+        subject = change.subject
         parts = []
-        old_info = old_subjects.get(subject, {})
-        current_average_formatted = _format_average(
-            info.get("CurrentPeriodAverage", info.get("YearAverage"))
-        )
-        grade_related_change = False
-        for label in period_labels:
-            grade_key = f"{label}Grades"
-            exam_key = f"{label}Exams"
-            for grade in _list_diff(old_info.get(grade_key, []), info.get(grade_key, [])):
-                msg = f"[{user_name}] Neue Note in {subject} ({label}): {grade}"
-                if show_year_average:
-                    if current_average_formatted:
-                        msg += f" Damit stehst du aktuell bei {current_average_formatted}"
-                parts.append(msg)
-                grade_related_change = True
-            for grade in _list_diff(old_info.get(exam_key, []), info.get(exam_key, [])):
-                msg = f"[{user_name}] Neue Klassenarbeitsnote in {subject} ({label}): {grade}"
-                if show_year_average:
-                    if current_average_formatted:
-                        msg += f" Damit stehst du aktuell bei {current_average_formatted}"
-                parts.append(msg)
-                grade_related_change = True
-
-        for label in period_labels:
-            key = f"{label}FinalGrade"
-            new_final = info.get(key)
-            if new_final is not None and new_final != old_info.get(key):
-                match = re.search(r"\d+", label)
-                period_number = match.group(0) if match else label
-                parts.append(
-                    f"[{user_name}] Zeugnisnote (HJ{period_number}) in {subject} steht fest: {new_final}"
-                )
-
-        if (
-            show_year_average
-            and _value_changed(
-                old_info.get("CurrentPeriodAverage", old_info.get("YearAverage")),
-                info.get("CurrentPeriodAverage", info.get("YearAverage")),
-            )
-            and not grade_related_change
-        ):
-            new_avg = _format_average(info.get("CurrentPeriodAverage", info.get("YearAverage")))
+        current_average_formatted = _format_average(change.new_average)
+        suffix = ""
+        if show_year_average and current_average_formatted:
+            suffix = f" Damit stehst du aktuell bei {current_average_formatted}"
+        # Reihenfolge wie bisher: je Halbjahr erst Noten, dann Klassenarbeiten
+        for number in sorted({number for number, _ in change.added_grades + change.added_exams}):
+            for period, grade in change.added_grades:
+                if period == number:
+                    parts.append(f"[{user_name}] Neue Note in {subject} (H{number}): {grade}{suffix}")
+            for period, grade in change.added_exams:
+                if period == number:
+                    parts.append(f"[{user_name}] Neue Klassenarbeitsnote in {subject} (H{number}): {grade}{suffix}")
+
+        for number, final_grade in change.final_grades:
+            parts.append(f"[{user_name}] Zeugnisnote (HJ{number}) in {subject} steht fest: {final_grade}")
+
+        if show_year_average and change.average_changed and not change.grade_related:
+            new_avg = _format_average(change.new_average)
             if new_avg:
-                prev_avg = _format_average(
-                    old_info.get("CurrentPeriodAverage", old_info.get("YearAverage"))
-                )
+                prev_avg = _format_average(change.old_average)
                 message = f"[{user_name}] Aktueller Halbjahresschnitt in {subject} ist jetzt {new_avg}"
                 if prev_avg:
                     message += f" (vorher {prev_avg})"
@@ -524,6 +1483,24 @@ def _collect_subject_messages(user_name, new_data, old_data, show_year_average=T
     return messages
 
 
+def history_events(user_name: str, changes: list[SubjectChange], ts: float) -> list[grade_history.GradeEvent]:
+    """Turn a change-set into history events; average-only changes get period 0."""
+    events = []
+    for change in changes:
+        before, after = change.old_average, change.new_average
+        for kind, entries in (("grade", change.added_grades), ("exam", change.added_exams), ("final", change.final_grades)):
+            for number, value in entries:
+                events.append(grade_history.GradeEvent(ts, user_name, change.subject, number, kind, str(value), before, after))
+        if change.average_changed and not change.grade_related:
+            events.append(grade_history.GradeEvent(ts, user_name, change.subject, 0, "average", None, before, after))
+    return events
+
+
+def _collect_subject_messages(user_name, new_data, old_data, show_year_average=True):
+    """Create Discord messages and keep the owning subject for state updates."""
+    return render_changes(user_name, diff_reports(new_data, old_data), show_year_average=show_year_average)
+
+
 def collect_messages(user_name, new_data, old_data, show_year_average=True):
     """Create Discord messages for all new grades of a user."""
     return [
@@ -534,6 +1511,11 @@ def collect_messages(user_name, new_data, old_data, show_year_average=True):
     ]
 
 
+def _state_key(user_name: str) -> str:
+    """File-safe account key used for the status files and the state store."""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", user_name)
+
+
 def _load_json_file(path: str) -> dict:
     """Load stored grades defensively so a truncated file does not crash the bot."""
     if not os.path.exists(path):
@@ -565,22 +1547,165 @@ def _write_json_file(path: str, data: dict) -> None:
                 pass
 
 
+def _write_json_lines(path: str, records: list[dict]) -> None:
+    """Atomically replace path with one JSON object per line, synced to disk."""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+# Ein gemeinsamer Verbindungspool für Portal und Discord: Keep-Alive-
+# Verbindungen überleben so Benutzer- und Zykluswechsel.
+_transport: HTTPAdapter | None = None
+_transport_lock = threading.Lock()
+_discord_session: requests.Session | None = None
+
+
+def _shared_adapter() -> HTTPAdapter:
+    """Return the process-wide adapter, sized for the poll workers plus the Discord sender."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            from requests.adapters import HTTPAdapter
+
+            _transport = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, POLL_CONCURRENCY) + 1)
+        return _transport
+
+
+def _pooled_session() -> requests.Session:
+    """Create a session with its own cookies that uses the shared connection pool."""
+    import requests
+
+    adapter = _shared_adapter()
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _discord_http() -> requests.Session:
+    global _discord_session
+    if _discord_session is None:
+        _discord_session = _pooled_session()
+    return _discord_session
+
+
+def transport_stats() -> dict[str, float]:
+    """Return request, connection and reuse counters of the shared pool."""
+    stats = {"pools": 0, "requests": 0, "connections": 0, "idle": 0, "reuse_ratio": 0.0}
+    adapter = _transport
+    if adapter is None:
+        return stats
+    manager = adapter.poolmanager
+    for key in manager.pools.keys():
+        pool = manager.pools.get(key)
+        if pool is None:
+            continue
+        stats["pools"] += 1
+        stats["requests"] += pool.num_requests
+        stats["connections"] += pool.num_connections
+        stats["idle"] += sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+    if stats["requests"]:
+        stats["reuse_ratio"] = 1 - stats["connections"] / stats["requests"]
+    return stats
+
+
 def _single_line_log_text(text: object) -> str:
     """Keep log messages on one line even if Discord payloads contain newlines."""
     return str(text).replace("\r", "\\r").replace("\n", " | ")
 
 
+class _DiscordBucket:
+    """Rate-limit state from Discord's X-RateLimit-* response headers."""
+
+    __slots__ = ("name", "remaining", "reset_at", "_lock")
+
+    def __init__(self):
+        self.name = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, headers, now: float) -> None:
+        if not headers:
+            return
+        with self._lock:
+            self.name = headers.get("X-RateLimit-Bucket", self.name)
+            remaining = headers.get("X-RateLimit-Remaining")
+            reset_after = headers.get("X-RateLimit-Reset-After")
+            try:
+                if remaining is not None:
+                    self.remaining = int(remaining)
+                if reset_after is not None:
+                    self.reset_at = now + float(reset_after)
+            except ValueError:
+                pass
+
+    def block(self, seconds: float, now: float) -> None:
+        """Hold all sends for seconds, e.g. after a 429."""
+        with self._lock:
+            self.remaining = 0
+            self.reset_at = max(self.reset_at, now + seconds)
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait before the next send; books one request of the bucket."""
+        with self._lock:
+            if now >= self.reset_at:
+                self.remaining = None
+            if self.remaining is None:
+                return 0.0
+            if self.remaining > 0:
+                self.remaining -= 1
+                return 0.0
+            return self.reset_at - now
+
+
+_discord_bucket = _DiscordBucket()
+# So oft wird eine Nachricht nach einem 429 erneut versucht
+DISCORD_RATE_LIMIT_RETRIES = 3
+
+
+def _retry_after(headers, body) -> float:
+    retry_after = 1.0
+    try:
+        retry_after = float(json.loads(body).get("retry_after", retry_after))
+    except Exception:
+        try:
+            retry_after = float(headers.get("Retry-After", retry_after))
+        except Exception:
+            pass
+    return max(0.0, min(retry_after, 60.0))
+
+
 def _send_discord_message(content: str) -> bool:
-    """Send one Discord message and report whether it was accepted."""
+    """Send one Discord message and report whether it was accepted.
+
+    Waits as long as the X-RateLimit-* headers of earlier responses demand
+    and retries after a 429 up to DISCORD_RATE_LIMIT_RETRIES times.
+    """
     url = f"https://discord.com/api/channels/{DISCORD_CHANNEL_ID}/messages"
     headers = {
         "Authorization": f"Bot {DISCORD_TOKEN}",
         "Content-Type": "application/json",
     }
     payload = {"content": content}
-    for attempt in range(2):
+    for attempt in range(DISCORD_RATE_LIMIT_RETRIES + 1):
+        wait = _discord_bucket.delay(time.time())
+        if wait > 0:
+            time.sleep(wait)
         try:
-            res = requests.post(
+            res = _discord_http().post(
                 url,
                 headers=headers,
                 json=payload,
@@ -589,6 +1714,7 @@ def _send_discord_message(content: str) -> bool:
         except Exception as e:
             logging.error(f"Fehler beim Senden an Discord: {e}")
             return False
+        _discord_bucket.update(getattr(res, "headers", None), time.time())
 
         if 200 <= res.status_code < 300:
             logging.info(
@@ -597,14 +1723,10 @@ def _send_discord_message(content: str) -> bool:
             )
             return True
 
-        if res.status_code == 429 and attempt == 0:
-            retry_after = 1.0
-            try:
-                retry_after = float(res.json().get("retry_after", retry_after))
-            except Exception:
-                pass
+        if res.status_code == 429 and attempt < DISCORD_RATE_LIMIT_RETRIES:
+            retry_after = _retry_after(getattr(res, "headers", {}), res.text)
             logging.warning("Discord Rate Limit, retry in %.2fs", retry_after)
-            time.sleep(max(0.0, min(retry_after, 30.0)))
+            _discord_bucket.block(retry_after, time.time())
             continue
 
         logging.error("Discord-API-Fehler (%s): %s", res.status_code, res.text)
@@ -613,6 +1735,305 @@ def _send_discord_message(content: str) -> bool:
     return False
 
 
+def _split_message(text: str, limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """Split text at line breaks into parts of at most limit characters."""
+    parts = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            parts.append(current)
+            candidate = line
+        current = candidate
+    if current or not parts:
+        parts.append(current)
+    return parts
+
+
+def pack_messages(items: list[tuple[object, str]], limit: int = DISCORD_MESSAGE_LIMIT) -> list[tuple[str, set]]:
+    """Combine (key, text) notifications into Discord messages of at most limit characters.
+
+    Returns (content, keys) pairs in order; a key is delivered once all
+    messages carrying a part of its text went out. Without
+    DISCORD_PACK_MESSAGES every text keeps its own message(s).
+    """
+    packed: list[tuple[str, set]] = []
+    for key, text in items:
+        for part in _split_message(text, limit):
+            if packed and DISCORD_PACK_MESSAGES and len(packed[-1][0]) + 2 + len(part) <= limit:
+                content, keys = packed[-1]
+                packed[-1] = (f"{content}\n\n{part}", keys | {key})
+            else:
+                packed.append((part, {key}))
+    return packed
+
+
+def _deliver(items: list[tuple[object, str]]) -> set:
+    """Send packed notifications; return the keys that were delivered completely."""
+    failed = set()
+    for content, keys in pack_messages(items):
+        if not _send_discord_message(content):
+            failed |= keys
+        if DISCORD_MESSAGE_DELAY_SECONDS:
+            time.sleep(DISCORD_MESSAGE_DELAY_SECONDS)
+    return {key for key, _ in items} - failed
+
+
+class _Outbox:
+    """Append-only journal of the Discord notifications that still have to go out.
+
+    Each notification is an "add" line and each delivery a "done" line,
+    flushed to disk before the call returns; replaying the file after a
+    crash yields exactly the undelivered notifications. Failed entries get
+    an exponential back-off in memory and are claimed by one sender at a time.
+    """
+
+    __slots__ = ("path", "_entries", "_next_id", "_lines", "_lock")
+
+    # Ab so vielen Zeilen wird die Datei auf die offenen Einträge verkürzt
+    COMPACT_LINES = 1000
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._next_id = 1
+        self._lines = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Beim Absturz halb geschriebene letzte Zeile
+                        continue
+                    self._lines += 1
+                    entry_id = int(record.get("id", 0))
+                    self._next_id = max(self._next_id, entry_id + 1)
+                    if record.get("op") == "add":
+                        self._entries[entry_id] = self._entry(record)
+                    elif record.get("op") == "done":
+                        self._entries.pop(entry_id, None)
+        except OSError as e:
+            logging.error("Outbox %s konnte nicht gelesen werden: %s", self.path, e)
+        if self._entries:
+            logging.info("%d offene Meldungen aus %s übernommen", len(self._entries), self.path)
+
+    @staticmethod
+    def _entry(record: dict) -> dict:
+        return {
+            "id": int(record["id"]),
+            "user": record.get("user"),
+            "subject": record.get("subject"),
+            "text": record.get("text", ""),
+            "failures": 0,
+            "due": 0.0,
+            "claimed": False,
+        }
+
+    def _append(self, records: list[dict]) -> None:
+        if not self.path:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._lines += len(records)
+
+    def _rewrite(self) -> None:
+        if not self._entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._lines = 0
+            return
+        records = [
+            {"op": "add", "id": e["id"], "user": e["user"], "subject": e["subject"], "text": e["text"]}
+            for e in self._entries.values()
+        ]
+        _write_json_lines(self.path, records)
+        self._lines = len(records)
+
+    def add(self, user_name: str, messages: list[tuple[str, str]]) -> list[int]:
+        """Journal the (subject, text) notifications of one user and return their ids."""
+        with self._lock:
+            records = []
+            for subject, text in messages:
+                records.append({"op": "add", "id": self._next_id, "user": user_name, "subject": subject, "text": text})
+                self._next_id += 1
+            self._append(records)
+            for record in records:
+                self._entries[record["id"]] = self._entry(record)
+        return [record["id"] for record in records]
+
+    def claim(self, now: float, ids=None) -> list[dict]:
+        """Reserve the due entries (optionally only ids) for one delivery attempt."""
+        with self._lock:
+            wanted = self._entries.values() if ids is None else (self._entries.get(i) for i in ids)
+            claimed = [e for e in wanted if e is not None and not e["claimed"] and e["due"] <= now]
+            for entry in claimed:
+                entry["claimed"] = True
+        return claimed
+
+    def done(self, ids) -> None:
+        with self._lock:
+            ids = [i for i in ids if self._entries.pop(i, None) is not None]
+            if not ids:
+                return
+            if self.path and (not self._entries or self._lines + len(ids) >= self.COMPACT_LINES):
+                self._rewrite()
+            else:
+                self._append([{"op": "done", "id": i} for i in ids])
+
+    def retry(self, ids, now: float) -> None:
+        """Release failed entries with an exponential back-off."""
+        with self._lock:
+            for entry_id in ids:
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                entry["failures"] += 1
+                entry["due"] = now + scheduler.retry_delay(
+                    entry["failures"], OUTBOX_RETRY_SECONDS, OUTBOX_MAX_RETRY_SECONDS
+                )
+                entry["claimed"] = False
+
+    def next_due(self) -> float | None:
+        with self._lock:
+            return min((e["due"] for e in self._entries.values() if not e["claimed"]), default=None)
+
+    def untried(self) -> int:
+        """Number of entries that did not have their first delivery attempt yet."""
+        with self._lock:
+            return sum(1 for e in self._entries.values() if not e["failures"])
+
+    def pending(self, user_name: str | None = None) -> list[dict]:
+        with self._lock:
+            return [dict(e) for e in self._entries.values() if user_name is None or e["user"] == user_name]
+
+
+def _settle(entries: list[dict], delivered: set) -> None:
+    """Mark delivered entries done and schedule the rest for a retry."""
+    _discord_outbox().done([e["id"] for e in entries if e["id"] in delivered])
+    failed = [e for e in entries if e["id"] not in delivered]
+    if failed:
+        _discord_outbox().retry([e["id"] for e in failed], time.time())
+        logging.error(
+            "Zustellung fehlgeschlagen, erneuter Versuch später: %s",
+            ", ".join(f"{e['user']}/{e['subject']}" for e in failed),
+        )
+
+
+def _release(entries: list[dict]) -> None:
+    """After an aborted delivery, put the claimed entries back with a back-off."""
+    logging.exception("Zustellung an Discord abgebrochen")
+    try:
+        _discord_outbox().retry([e["id"] for e in entries], time.time())
+    except Exception:
+        logging.exception("Outbox-Einträge konnten nicht freigegeben werden")
+
+
+def _outbox_items(entries: list[dict]) -> list[tuple[int, str]]:
+    return [(e["id"], e["text"]) for e in entries]
+
+
+class _DiscordDispatcher:
+    """Background thread that delivers the outbox while polling continues.
+
+    Due notifications are packed into shared messages; failed ones stay in
+    the outbox and come back after their back-off, without a portal request
+    or a rewrite of the grade state.
+    """
+
+    # So oft prüft flush(), ob der Versand-Thread noch läuft
+    POLL_SECONDS = 1.0
+
+    def __init__(self):
+        self._thread = None
+        self._wakeup = threading.Condition()
+
+    def notify(self) -> None:
+        """Start the thread if needed and let it look at the outbox."""
+        with self._wakeup:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="discord", daemon=True)
+                self._thread.start()
+            self._wakeup.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until every notification had its first delivery attempt.
+
+        Returns False if the dispatcher thread died or timeout ran out first.
+        """
+        if not _discord_outbox().untried():
+            return True
+        self.notify()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._wakeup:
+            while _discord_outbox().untried():
+                if not self._thread.is_alive():
+                    logging.error("Discord-Versand beendet, %d Meldungen bleiben in der Outbox", len(_discord_outbox()))
+                    return False
+                wait = self.POLL_SECONDS if deadline is None else min(self.POLL_SECONDS, deadline - time.monotonic())
+                if wait <= 0:
+                    logging.warning(
+                        "Discord-Versand nach %.0f s nicht abgeschlossen, %d Meldungen bleiben in der Outbox",
+                        timeout,
+                        len(_discord_outbox()),
+                    )
+                    return False
+                self._wakeup.wait(wait)
+        return True
+
+    def deliver_due(self, now: float | None = None) -> int:
+        """Deliver every due entry once; return how many were attempted."""
+        entries = _discord_outbox().claim(time.time() if now is None else now)
+        if entries:
+            try:
+                _settle(entries, _deliver(_outbox_items(entries)))
+            except Exception:
+                _release(entries)
+        return len(entries)
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                next_due = _discord_outbox().next_due()
+                now = time.time()
+                if next_due is None or next_due > now:
+                    self._wakeup.wait(None if next_due is None else next_due - now)
+                    continue
+            self.deliver_due()
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+
+def _discord_outbox() -> _Outbox:
+    """The outbox of OUTBOX_FILE, replayed from disk on first use."""
+    global _outbox
+    with _lazy_lock:
+        if _outbox is None:
+            _outbox = _Outbox(OUTBOX_FILE)
+        return _outbox
+
+
+_discord_dispatcher = _DiscordDispatcher()
+
+
 def _send_startup_message(now: datetime | None = None) -> bool:
     """Announce a fresh bot process start in Discord."""
     if now is None:
@@ -636,20 +2057,6 @@ def _consume_startup_message_request(path: str | None = None) -> bool:
     return True
 
 
-def _advance_stored_subjects(old_info_all: dict, new_data: dict, successful_subjects: set[str]) -> dict:
-    """Advance stored state only for subjects whose notifications were delivered."""
-    updated = json.loads(json.dumps(old_info_all or {}, ensure_ascii=False))
-    new_subjects = new_data.get("subjects", {}) if isinstance(new_data, dict) else {}
-    old_subjects = updated.setdefault("subjects", {})
-    for subject in successful_subjects:
-        if subject in new_subjects:
-            old_subjects[subject] = new_subjects[subject]
-    for key, value in new_data.items():
-        if key != "subjects":
-            updated[key] = value
-    return updated
-
-
 def _seconds_until_next_interval(
     now: datetime | None = None,
     interval_minutes: int | None = None,
@@ -701,6 +2108,111 @@ def _should_run_now_on_startup(
     )
 
 
+_clock = scheduler.SystemClock()
+
+
+def _user_schedules() -> dict[str, scheduler.UserSchedule]:
+    """Per-user schedules, loaded from POLL_SCHEDULE_FILE on first use."""
+    global _schedules
+    if _schedules is None:
+        _schedules = scheduler.load_schedules(_load_json_file(POLL_SCHEDULE_FILE))
+    return _schedules
+
+
+def _poll_interval_seconds(schedule: scheduler.UserSchedule, now: float) -> float:
+    if SCHEDULER != "adaptive":
+        return INTERVAL_MINUTES * 60
+    return scheduler.next_interval(
+        schedule,
+        now,
+        POLL_MIN_MINUTES * 60,
+        POLL_MAX_MINUTES * 60,
+        jitter=POLL_JITTER,
+    )
+
+
+def _note_poll_outcome(user: dict, changed: bool | None, now: float | None = None) -> None:
+    """Set the next deadline of a user; changed=None marks a failed poll."""
+    if SCHEDULER not in ("staggered", "adaptive"):
+        return
+    if now is None:
+        now = _clock.time()
+    schedule = _user_schedules().setdefault(user["name"], scheduler.UserSchedule())
+    if changed is None:
+        # Fehlschläge zählen nicht zur Historie, werden aber bald wiederholt
+        schedule.failures += 1
+        schedule.next_run = now + scheduler.retry_delay(
+            schedule.failures, POLL_RETRY_SECONDS, _poll_interval_seconds(schedule, now)
+        )
+        return
+    schedule.record(now, changed)
+    if SCHEDULER == "staggered" and schedule.next_run:
+        # Vom geplanten Termin aus weiterzählen, sonst wandert jeder Abruf um
+        # seine eigene Dauer nach hinten
+        interval = INTERVAL_MINUTES * 60
+        schedule.next_run += interval * (1 + max(0, int((now - schedule.next_run) // interval)))
+        return
+    schedule.next_run = now + _poll_interval_seconds(schedule, now)
+
+
+def _wait_for_request_budget(cost: int) -> None:
+    """Block until cost portal requests fit under MAX_REQUESTS_PER_SECOND."""
+    if _request_limiter is not None:
+        _clock.sleep(_request_limiter.reserve(cost, _clock.time()))
+
+
+def _poll_cost(entry: dict) -> int:
+    # Mit gültiger Sitzung genügt ein GET, sonst Login-Seite, Login-POST und GET
+    return 1 if entry["logged_in"] or DEBUG_LOCAL else 3
+
+
+def _base_interval_seconds() -> float:
+    return POLL_MIN_MINUTES * 60 if SCHEDULER == "adaptive" else INTERVAL_MINUTES * 60
+
+
+def _initial_queue(now: float) -> scheduler.PollQueue:
+    """Queue every user; those without a known deadline are spread over one interval."""
+    queue = scheduler.PollQueue()
+    schedules = _user_schedules()
+    fresh = []
+    for user in USERS:
+        schedule = schedules.get(user["name"])
+        if schedule is not None and schedule.next_run > now:
+            queue.push(user["name"], schedule.next_run)
+        else:
+            fresh.append(user["name"])
+    queue.stagger(fresh, now, _base_interval_seconds())
+    return queue
+
+
+def run_scheduled(until: float | None = None) -> None:
+    """Poll every user at its own deadline instead of all users per slot.
+
+    Used for SCHEDULER=staggered and adaptive; runs until _clock reaches
+    until, or forever.
+    """
+    users = {user["name"]: user for user in USERS}
+
+    def poll(due: dict[str, float]) -> dict[str, float]:
+        schedules = _user_schedules()
+        for name, deadline in due.items():
+            schedules.setdefault(name, scheduler.UserSchedule()).next_run = deadline
+        run_once([users[name] for name in due])
+        if SCHEDULER == "adaptive":
+            _write_json_file(POLL_SCHEDULE_FILE, scheduler.dump_schedules(schedules))
+        return {name: schedules[name].next_run for name in due}
+
+    scheduler.run_queue(
+        _initial_queue(_clock.time()),
+        _clock,
+        poll,
+        until=until,
+        batch_window=1.0,
+        retry_seconds=POLL_RETRY_SECONDS,
+        retry_max_seconds=_base_interval_seconds(),
+    )
+
+
 def _sleep_until_next_interval(interval_minutes: int | None = None) -> None:
     """Sleep until the next aligned run slot."""
     seconds = _seconds_until_next_interval(interval_minutes=interval_minutes)
@@ -708,93 +2220,1256 @@ def _sleep_until_next_interval(interval_minutes: int | None = None) -> None:
         time.sleep(seconds)
 
 
-def run_once():
-    """Run one complete grade polling cycle for all configured users."""
-    global old_data
-    for user in USERS:
-        # Neue Session pro Benutzer, um unabhängige Logins zu gewährleisten
-        with requests.Session() as session:
-            data = fetch_html(user["username"], user["password"], session=session)
-        if data is None:
+_host_slots: dict[str, threading.BoundedSemaphore] = {}
+_host_slots_lock = threading.Lock()
+
+
+def _poll_host() -> str:
+    """Return the host that fetch_html talks to."""
+    return urlparse(DEBUG_LOCAL_URL if DEBUG_LOCAL else PORTAL_URL).netloc
+
+
+def _host_slot(host: str) -> threading.BoundedSemaphore:
+    """Return the semaphore that caps concurrent polls of one host."""
+    with _host_slots_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = _host_slots[host] = threading.BoundedSemaphore(max(1, POLL_CONCURRENCY))
+        return slot
+
+
+# Portal-Sitzungen je Benutzer, die über Zyklen hinweg angemeldet bleiben
+_sessions: dict[str, dict] = {}
+_sessions_lock = threading.Lock()
+session_stats = Counter()
+
+
+# Übertragene (ggf. komprimierte) und dekodierte Bytes; poll_traffic sammelt
+# je Konto (Anzeigename, ohne Angabe der Benutzername) die Werte des laufenden Abrufs
+traffic_stats = Counter()
+poll_traffic: dict[str, Counter] = {}
+_traffic_lock = threading.Lock()
+# ETag/Last-Modified der Notenseite je Konto mit dem Fingerprint der Seite,
+# zu der sie gehören
+_page_validators: dict[str, tuple[str, dict[str, str]]] = {}
+
+
+def _body_size(resp) -> int:
+    content = getattr(resp, "content", None)
+    return len(content) if isinstance(content, bytes) else 0
+
+
+def _wire_bytes(resp) -> int:
+    """Body bytes read from the socket for resp and its redirects, before decompression."""
+    total = 0
+    for hop in [*getattr(resp, "history", []), resp]:
+        tell = getattr(getattr(hop, "raw", None), "tell", None)
+        if tell is not None:
+            try:
+                total += tell()
+            except Exception:
+                pass
+    return total
+
+
+def _record_traffic(account: str | None, status: int, wire: int, decoded: int) -> None:
+    with _traffic_lock:
+        for counter in (traffic_stats, poll_traffic.setdefault(account or "", Counter())):
+            counter["requests"] += 1
+            counter["wire_bytes"] += wire
+            counter["decoded_bytes"] += decoded
+            if status == 304:
+                counter["not_modified"] += 1
+
+
+def _conditional_headers(account: str | None, previous_fingerprint: str | None) -> dict[str, str]:
+    """If-None-Match/If-Modified-Since for a page whose stored state is previous_fingerprint."""
+    fingerprint, validators = _page_validators.get(account or "", (None, {}))
+    if previous_fingerprint is None or fingerprint != previous_fingerprint:
+        return {}
+    headers = {}
+    if "ETag" in validators:
+        headers["If-None-Match"] = validators["ETag"]
+    if "Last-Modified" in validators:
+        headers["If-Modified-Since"] = validators["Last-Modified"]
+    return headers
+
+
+def _remember_validators(account: str | None, headers, data, previous_fingerprint: str | None) -> None:
+    if data is UNCHANGED:
+        fingerprint = previous_fingerprint
+    else:
+        fingerprint = data.get("Fingerprint") if isinstance(data, dict) else None
+    validators = {name: headers[name] for name in ("ETag", "Last-Modified") if headers and headers.get(name)}
+    if fingerprint and validators:
+        _page_validators[account or ""] = (fingerprint, validators)
+    else:
+        _page_validators.pop(account or "", None)
+
+
+def _cookie_file(user_name: str) -> str:
+    return os.path.join(SESSION_COOKIE_DIR, f"cookies_{_state_key(user_name)}.json")
+
+
+def _dump_cookies(session: requests.Session) -> list[dict]:
+    return [
+        {
+            "name": cookie.name,
+            "value": cookie.value,
+            "domain": cookie.domain,
+            "path": cookie.path,
+            "expires": cookie.expires,
+            "secure": cookie.secure,
+        }
+        for cookie in session.cookies
+    ]
+
+
+def _dump_aiohttp_cookies(session) -> list[dict]:
+    """The cookies of an aiohttp portal session in the format of _dump_cookies."""
+    from email.utils import parsedate_to_datetime
+
+    host = urlparse(GRADES_URL).hostname
+    cookies = []
+    for morsel in session.cookie_jar:
+        # Die Sitzung spricht nur mit dem Portal: dessen Host schreibt requests
+        # ohne Punkt, Cookies übergeordneter Domains mit
+        domain = morsel["domain"] or host
+        expires = None
+        if morsel["expires"]:
+            try:
+                expires = int(parsedate_to_datetime(morsel["expires"]).timestamp())
+            except (TypeError, ValueError):
+                pass
+        cookies.append(
+            {
+                "name": morsel.key,
+                "value": morsel.value,
+                # Wie bei requests: Host-Cookies ohne, Domain-Cookies mit Punkt
+                "domain": domain if domain == host else f".{domain}",
+                "path": morsel["path"] or "/",
+                "expires": expires,
+                "secure": bool(morsel["secure"]),
+            }
+        )
+    return cookies
+
+
+def _load_aiohttp_cookies(session, user_name: str) -> bool:
+    """Restore stored cookies into an aiohttp session; True if there were any to try."""
+    from email.utils import formatdate
+    from http.cookies import SimpleCookie
+
+    from yarl import URL
+
+    cookies = _read_cookie_file(user_name)
+    if not cookies:
+        return False
+    try:
+        for cookie in cookies:
+            jar = SimpleCookie()
+            jar[cookie["name"]] = cookie["value"]
+            morsel = jar[cookie["name"]]
+            domain = cookie.get("domain") or urlparse(GRADES_URL).hostname
+            if domain.startswith("."):
+                morsel["domain"] = domain
+            morsel["path"] = cookie.get("path") or "/"
+            if cookie.get("expires"):
+                morsel["expires"] = formatdate(cookie["expires"], usegmt=True)
+            if cookie.get("secure"):
+                morsel["secure"] = True
+            session.cookie_jar.update_cookies(jar, URL(f"https://{domain.lstrip('.')}/"))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        logging.warning("Cookie-Datei %s wird ignoriert: %s", _cookie_file(user_name), e)
+        session.cookie_jar.clear()
+        return False
+    return True
+
+
+def _read_cookie_file(user_name: str) -> list[dict] | None:
+    """The stored cookies of a user, or None without SESSION_COOKIE_DIR or a readable file."""
+    if not SESSION_COOKIE_DIR:
+        return None
+    path = _cookie_file(user_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cookies = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning("Cookie-Datei %s wird ignoriert: %s", path, e)
+        return None
+    return cookies if isinstance(cookies, list) else None
+
+
+def _load_session_cookies(session: requests.Session, user_name: str) -> bool:
+    """Restore stored cookies; True if there were any to try."""
+    cookies = _read_cookie_file(user_name)
+    if not cookies:
+        return False
+    path = _cookie_file(user_name)
+    try:
+        for cookie in cookies:
+            session.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain"),
+                path=cookie.get("path") or "/",
+                expires=cookie.get("expires"),
+                secure=bool(cookie.get("secure")),
+            )
+    except (ValueError, KeyError, TypeError) as e:
+        logging.warning("Cookie-Datei %s wird ignoriert: %s", path, e)
+        session.cookies.clear()
+        return False
+    return True
+
+
+def _save_session_cookies(entry: dict, user_name: str, cookies: list[dict] | None = None) -> None:
+    """Persist the cookies of a session if they changed since the last save.
+
+    cookies defaults to the cookies of the requests session in entry.
+    """
+    if not SESSION_COOKIE_DIR:
+        return
+    if cookies is None:
+        cookies = _dump_cookies(entry["session"])
+    if cookies == entry.get("saved_cookies"):
+        return
+    path = _cookie_file(user_name)
+    try:
+        os.makedirs(SESSION_COOKIE_DIR, exist_ok=True)
+        _write_json_file(path, cookies)
+        # Die Cookies sind so viel wert wie das Passwort
+        os.chmod(path, 0o600)
+    except OSError as e:
+        logging.error("Cookie-Datei %s konnte nicht geschrieben werden: %s", path, e)
+        return
+    entry["saved_cookies"] = cookies
+
+
+def _user_session(user: dict) -> dict:
+    """Return the long-lived session entry of a user, creating it on first use."""
+    with _sessions_lock:
+        entry = _sessions.get(user["name"])
+        if entry is None:
+            session = _pooled_session()
+            session.headers.update({"User-Agent": "Mozilla/5.0", "Referer": PORTAL_URL})
+            logged_in = _load_session_cookies(session, user["name"])
+            entry = _sessions[user["name"]] = {
+                "session": session,
+                "logged_in": logged_in,
+                "saved_cookies": _dump_cookies(session) if logged_in else None,
+            }
+        return entry
+
+
+def _poll_user(user: dict, previous_fingerprint: str | None):
+    """Fetch and parse one user while holding a slot for the portal host."""
+    entry = _user_session(user)
+    with _host_slot(_poll_host()):
+        _wait_for_request_budget(_poll_cost(entry))
+        data = fetch_html(
+            user["username"],
+            user["password"],
+            session=entry["session"],
+            previous_fingerprint=previous_fingerprint,
+            logged_in=entry["logged_in"],
+            account=user["name"],
+        )
+    # Ein fehlgeschlagener Abruf erzwingt beim nächsten Mal einen frischen Login
+    entry["logged_in"] = data is not None and not DEBUG_LOCAL
+    if entry["logged_in"]:
+        _save_session_cookies(entry, user["name"])
+    return data
+
+
+def _prepare_poll_result(user: dict, old_report: GradeReport, data, metrics: Counter):
+    """Count the poll outcome and return the subject messages, or None if there is nothing to store."""
+    traffic = poll_traffic.pop(user["name"], None)
+    if traffic:
+        metrics.update(traffic)
+        logging.info(
+            "Datenvolumen für %s: %d Anfragen, %d Bytes übertragen, %d Bytes dekodiert",
+            user["name"],
+            traffic["requests"],
+            traffic["wire_bytes"],
+            traffic["decoded_bytes"],
+        )
+    if data is None:
+        metrics["failed"] += 1
+        _note_poll_outcome(user, changed=None)
+        return None
+    if data is UNCHANGED:
+        metrics["unchanged"] += 1
+        logging.info("Notenbereich für %s unverändert.", user["name"])
+        _note_poll_outcome(user, changed=False)
+        return None
+    metrics["parsed"] += 1
+    changes = diff_reports(data, old_report)
+    messages = render_changes(user["name"], changes, show_year_average=SHOW_YEAR_AVERAGE)
+    # Der erste Abruf eines Benutzers meldet alle Noten, das ist keine Änderung
+    # und gehört weder in den Verlauf noch in den Zeitplan
+    first_poll = not old_report.subjects
+    history = _history_log()
+    if history is not None and changes and not first_poll:
+        try:
+            history.append(history_events(user["name"], changes, time.time()))
+        except OSError as e:
+            logging.error("Notenverlauf konnte nicht geschrieben werden: %s", e)
+    _note_poll_outcome(user, changed=bool(messages) and not first_poll)
+    return messages
+
+
+def _store_poll_result(user: dict, data: dict, subject_messages: list) -> list[int]:
+    """Journal the notifications of one user, then advance the stored grade state.
+
+    The state moves on right away; undelivered notifications live on in
+    the outbox, so a failed send never has to be rediscovered from the portal.
+    Returns the outbox ids of the notifications.
+    """
+    ids = []
+    if subject_messages:
+        # Erst ins Journal, dann den Stand schreiben: ein Absturz dazwischen
+        # meldet schlimmstenfalls doppelt, verliert aber nichts
+        ids = _discord_outbox().add(user["name"], subject_messages)
+    else:
+        logging.info(f"Keine neuen Noten gefunden für {user['name']}.")
+
+    old_data[user["name"]] = GradeReport.from_dict(data)
+    store = _state_db()
+    if store is not None:
+        # Geschrieben wird gesammelt am Ende des Zyklus
+        store.stage(_state_key(user["name"]), data)
+        return ids
+    safe_name = _state_key(user["name"])
+    _write_json_file(f"grades_{safe_name}.json", data)
+    _write_json_file(f"old_grades_{safe_name}.json", data)
+    return ids
+
+
+def _record_poll_result(user: dict, old_report: GradeReport, data, metrics: Counter) -> list[int]:
+    """Evaluate and store the result of one user; return the outbox ids of its notifications."""
+    subject_messages = _prepare_poll_result(user, old_report, data, metrics)
+    if subject_messages is None:
+        return []
+    return _store_poll_result(user, data, subject_messages)
+
+
+def _handle_poll_result(user: dict, old_report: GradeReport, data, metrics: Counter) -> None:
+    """Store the result of one user and wake the dispatcher for its notifications."""
+    if _record_poll_result(user, old_report, data, metrics):
+        _discord_dispatcher.notify()
+
+
+def _finish_cycle(metrics: Counter) -> Counter:
+    store = _state_db()
+    if store is not None:
+        try:
+            metrics["state_rows"] = store.commit()
+            logging.info("Notenstände: %d geänderte Zeilen geschrieben", metrics["state_rows"])
+        except Exception as e:
+            logging.error("Notenstände konnten nicht gespeichert werden: %s", e)
+    cycle_metrics.update(metrics)
+    logging.info(
+        "Zyklus beendet: %d Benutzer, %d unverändert, %d ausgewertet, %d fehlgeschlagen",
+        metrics["users"],
+        metrics["unchanged"],
+        metrics["parsed"],
+        metrics["failed"],
+    )
+    logging.info(
+        "Datenvolumen: %d Anfragen, %.1f KB übertragen, %.1f KB dekodiert, %d nicht geändert (304)",
+        metrics["requests"],
+        metrics["wire_bytes"] / 1024,
+        metrics["decoded_bytes"] / 1024,
+        metrics["not_modified"],
+    )
+    pending = len(_discord_outbox())
+    if pending:
+        logging.warning("%d Meldungen warten in der Outbox auf Zustellung", pending)
+    pool = transport_stats()
+    logging.info(
+        "Verbindungen: %d Anfragen über %d Verbindungen (%.0f %% wiederverwendet), %d offen",
+        pool["requests"],
+        pool["connections"],
+        pool["reuse_ratio"] * 100,
+        pool["idle"],
+    )
+    return metrics
+
+
+def run_once(users: list[dict] | None = None):
+    """Run one complete grade polling cycle for all configured users.
+
+    Users are fetched and parsed in parallel, at most POLL_CONCURRENCY per
+    portal host. Results are diffed on this thread in the order the fetches
+    finish and each user's state is written at once; the Discord dispatcher
+    delivers the journaled notifications meanwhile. With
+    POLL_ENGINE=async the cycle runs on the asyncio engine instead.
+    users restricts the cycle to the given entries of USERS.
+    """
+    if POLL_ENGINE == "async":
+        import asyncio
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return _engine_loop().run_until_complete(run_once_async(users))
+        raise RuntimeError(
+            "run_once() mit POLL_ENGINE=async kann nicht innerhalb einer laufenden Event-Loop "
+            "aufgerufen werden; dort run_once_async() bzw. GradeChecker.run_once_async() verwenden"
+        )
+    metrics = Counter()
+    users = list(USERS if users is None else users)
+    metrics["users"] = len(users)
+    if users:
+        old_reports = [_old_report(user["name"]) for user in users]
+        with ThreadPoolExecutor(
+            max_workers=min(len(users), max(1, POLL_CONCURRENCY)),
+            thread_name_prefix="poll",
+        ) as pool:
+            futures = {
+                pool.submit(_poll_user, user, old_report.fingerprint): idx
+                for idx, (user, old_report) in enumerate(zip(users, old_reports))
+            }
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    data = future.result()
+                except Exception:
+                    # Ein Fehler bei einem Benutzer darf den Zyklus der anderen nicht abbrechen
+                    logging.exception("Abruf für %s fehlgeschlagen", users[idx]["name"])
+                    data = None
+                _handle_poll_result(users[idx], old_reports[idx], data, metrics)
+        # Zustellung läuft schon während der Abrufe; der Zyklus endet erst,
+        # wenn jede neue Meldung einmal versucht wurde, höchstens aber nach
+        # einem Intervall. Was dann noch fehlt, bleibt in der Outbox.
+        _discord_dispatcher.flush(timeout=_base_interval_seconds())
+    return _finish_cycle(metrics)
+
+
+# --- asyncio-Engine -------------------------------------------------------
+# Mit aiohttp warten alle Benutzer gleichzeitig auf das Netz, ohne einen
+# Thread pro Konto; das Parsen läuft im Executor. Ohne aiohttp laufen die
+# blockierenden Abrufe im Executor und die Engine bleibt nutzbar.
+
+_loop: asyncio.AbstractEventLoop | None = None
+_async_sessions: dict[str, dict] = {}
+# Eigene Sitzung für die Discord-API, getrennt vom Portal-Connector
+_async_discord_session = None
+# Schleife, zu der _async_sessions, _async_connector und _async_discord_session gehören
+_async_loop: asyncio.AbstractEventLoop | None = None
+_async_connector = None
+_async_discord_session = None
+
+
+@functools.lru_cache(maxsize=None)
+def _aiohttp():
+    """Return the aiohttp module, imported on first use; None if it is not installed."""
+    try:
+        import aiohttp
+    except ImportError:  # optional; die asyncio-Engine nutzt dann den Executor
+        return None
+    return aiohttp
+
+
+def _use_aiohttp() -> bool:
+    return ASYNC_HTTP_CLIENT != "executor" and _aiohttp() is not None
+
+
+def _engine_loop() -> asyncio.AbstractEventLoop:
+    """Return the long-lived event loop; aiohttp sessions are bound to it."""
+    import asyncio
+
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+
+def _aiohttp_session():
+    """Create a client session with its own cookies on the shared connector."""
+    aiohttp = _aiohttp()
+    global _async_connector
+    if _async_connector is None or _async_connector.closed:
+        _async_connector = aiohttp.TCPConnector(limit_per_host=max(1, POLL_CONCURRENCY) + 1)
+    return aiohttp.ClientSession(
+        connector=_async_connector,
+        connector_owner=False,
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS),
+        headers={"User-Agent": "Mozilla/5.0", "Referer": PORTAL_URL},
+    )
+
+
+def _aiohttp_wire_bytes(resp, decoded: int, complete: bool) -> int:
+    # aiohttp dekomprimiert vor dem Lesen; die übertragene Größe kennt nur Content-Length
+    length = resp.headers.get("Content-Length")
+    if complete and length and length.isdigit():
+        return int(length)
+    return decoded
+
+
+async def _aiohttp_get(session, url: str, label: str, account: str | None = None):
+    """GET url and return (status, text, final url), or None on network errors."""
+    try:
+        if SHOW_HTTPS:
+            logging.info("HTTP GET %s (%s)", url, label)
+        async with session.get(url) as resp:
+            body = await resp.read()
+            _record_traffic(account, resp.status, _aiohttp_wire_bytes(resp, len(body), True), len(body))
+            text = _decode_page(body, resp.headers.get("Content-Type"))
+            return resp.status, text, str(resp.url)
+    except Exception as e:
+        logging.error(f"Abruf von {url} fehlgeschlagen: {e}")
+        return None
+
+
+async def _aiohttp_get_grade_page(
+    session,
+    url: str,
+    label: str,
+    account: str | None = None,
+    previous_fingerprint: str | None = None,
+):
+    """GET a grades page, conditionally if validators are known, and scan it while it arrives.
+
+    Returns (status, scanner or None, final url, headers), or None on
+    network errors and oversized pages; like _stream_grade_page the body
+    is abandoned once the final-grades container is closed.
+    """
+    try:
+        if SHOW_HTTPS:
+            logging.info("HTTP GET %s (%s)", url, label)
+        async with session.get(url, headers=_conditional_headers(account, previous_fingerprint)) as resp:
+            if resp.status != 200:
+                _record_traffic(account, resp.status, 0, 0)
+                return resp.status, None, str(resp.url), resp.headers
+            scanner = _GradeRegionScanner()
+            if not STREAM_GRADES_PAGE:
+                body = await resp.read()
+                scanner.feed(_decode_page(body, resp.headers.get("Content-Type")))
+                scanner.bytes = len(body)
+                _record_traffic(account, resp.status, _aiohttp_wire_bytes(resp, len(body), True), len(body))
+                return resp.status, scanner, str(resp.url), resp.headers
+            decoder = _PageDecoder(resp.headers.get("Content-Type"))
+            received = 0
+            async for chunk in resp.content.iter_chunked(STREAM_CHUNK_BYTES):
+                received += len(chunk)
+                if received > MAX_PAGE_BYTES:
+                    _record_traffic(account, resp.status, received, received)
+                    logging.error("%s größer als %d Bytes, Abruf verworfen", url, MAX_PAGE_BYTES)
+                    resp.close()
+                    return None
+                scanner.feed(decoder.decode(chunk))
+                if scanner.done:
+                    resp.close()
+                    break
+            else:
+                scanner.feed(decoder.decode(b"", final=True))
+            scanner.bytes = received
+            wire = _aiohttp_wire_bytes(resp, received, not scanner.done)
+            _record_traffic(account, resp.status, wire, received)
+            return resp.status, scanner, str(resp.url), resp.headers
+    except Exception as e:
+        logging.error(f"Abruf von {url} fehlgeschlagen: {e}")
+        return None
+
+
+async def _portal_login_async(session, username: str, password: str, account: str | None = None) -> bool:
+    import asyncio
+
+    login_page = await _aiohttp_get(session, PORTAL_URL, f"username={username}", account or username)
+    if login_page is None:
+        return False
+    logging.info("Login-Seite Response (%s)", login_page[0])
+    # BeautifulSoup ist CPU-Arbeit wie das Parsen der Notenseite
+    payload = await asyncio.get_running_loop().run_in_executor(
+        None, _login_payload, login_page[1], username, password
+    )
+    try:
+        if SHOW_HTTPS:
+            logging.info("HTTP POST %s (username=%s)", PORTAL_URL, username)
+        async with session.post(PORTAL_URL, data=payload, allow_redirects=True) as resp:
+            body = await resp.read()
+            status, final_url = resp.status, str(resp.url)
+            _record_traffic(account or username, status, _aiohttp_wire_bytes(resp, len(body), True), len(body))
+    except Exception as e:
+        logging.error(f"Login-Request fehlgeschlagen: {e}")
+        return False
+    logging.info("Login-POST Response (%s)", status)
+    if status != 200 or "/account" not in final_url:
+        logging.error("Login fehlgeschlagen – Status %s, URL %s", status, final_url)
+        return False
+    return True
+
+
+async def fetch_html_async(
+    username: str,
+    password: str,
+    session=None,
+    previous_fingerprint: str | None = None,
+    logged_in: bool = False,
+    account: str | None = None,
+):
+    """Async counterpart of fetch_html with the same results.
+
+    session is an aiohttp.ClientSession. Without aiohttp, or without a
+    session, the synchronous fetch_html runs in the default executor.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    if session is None or not _use_aiohttp():
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                fetch_html,
+                username,
+                password,
+                previous_fingerprint=previous_fingerprint,
+                logged_in=logged_in,
+                account=account,
+            ),
+        )
+
+    account = account or username
+    get_page = functools.partial(
+        _aiohttp_get_grade_page,
+        session,
+        account=account,
+        previous_fingerprint=previous_fingerprint,
+    )
+    if DEBUG_LOCAL:
+        page = await get_page(DEBUG_LOCAL_URL, "debug local")
+        if page is None or page[0] not in (200, 304):
+            logging.error("Lokaler Abruf fehlgeschlagen – Status %s", page and page[0])
+            return None
+        label = "Lokale"
+    else:
+        page = None
+        if logged_in:
+            page = await get_page(GRADES_URL, f"username={username}")
+            if page is None:
+                return None
+            if "/account" not in page[2]:
+                session_stats["expired"] += 1
+                logging.info("Sitzung für %s abgelaufen, melde neu an", username)
+                page = None
+            else:
+                session_stats["reused"] += 1
+        if page is None:
+            if not await _portal_login_async(session, username, password, account):
+                return None
+            session_stats["logins"] += 1
+            page = await get_page(GRADES_URL, f"username={username}")
+            if page is None:
+                return None
+        if page[0] not in (200, 304):
+            logging.info("Notenübersicht Response (%s)", page[0])
+            logging.error("Notenübersicht fehlgeschlagen – Status %s", page[0])
+            return None
+        label = "Notenübersicht"
+    status, scanner, final_url, headers = page
+    if status == 304:
+        logging.info("%s Response (304), Notenseite nicht geändert", label)
+        return UNCHANGED
+    _log_scanned_response(label, status, scanner)
+
+    # Parsen ist CPU-Arbeit und blockiert sonst die Schleife
+    regions, fallback = scanner.result()
+    data = await loop.run_in_executor(
+        None,
+        functools.partial(_evaluate_grade_regions, regions, fallback, previous_fingerprint, cache_key=account),
+    )
+    _remember_validators(account, headers, data, previous_fingerprint)
+    if data is None:
+        logging.error("Notenübersicht enthält keine erwartete Notenansicht – URL %s", final_url)
+    return data
+
+
+async def _send_discord_message_async(content: str) -> bool:
+    """Async counterpart of _send_discord_message."""
+    import asyncio
+
+    if not _use_aiohttp():
+        return await asyncio.get_running_loop().run_in_executor(None, _send_discord_message, content)
+    url = f"https://discord.com/api/channels/{DISCORD_CHANNEL_ID}/messages"
+    session = _async_discord_api()
+    for attempt in range(DISCORD_RATE_LIMIT_RETRIES + 1):
+        wait = _discord_bucket.delay(time.time())
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            async with session.post(url, json={"content": content}) as res:
+                status = res.status
+                body = await res.text()
+                response_headers = res.headers
+        except Exception as e:
+            logging.error(f"Fehler beim Senden an Discord: {e}")
+            return False
+        _discord_bucket.update(response_headers, time.time())
+        if 200 <= status < 300:
+            logging.info("Nachricht an Discord gesendet: %s", _single_line_log_text(content))
+            return True
+        if status == 429 and attempt < DISCORD_RATE_LIMIT_RETRIES:
+            retry_after = _retry_after(response_headers, body)
+            logging.warning("Discord Rate Limit, retry in %.2fs", retry_after)
+            _discord_bucket.block(retry_after, time.time())
             continue
+        logging.error("Discord-API-Fehler (%s): %s", status, body)
+        return False
+    return False
+
+
+def _reset_connections() -> None:
+    """Close all sessions and pools and forget per-account caches (see configure())."""
+    global _transport, _discord_session, _discord_bucket, _async_connector
+    with _sessions_lock:
+        sessions = [entry["session"] for entry in _sessions.values()]
+        _sessions.clear()
+    if _discord_session is not None:
+        sessions.append(_discord_session)
+    for session in sessions:
+        session.close()
+    with _transport_lock:
+        if _transport is not None:
+            _transport.close()
+        _transport = _discord_session = None
+    with _host_slots_lock:
+        _host_slots.clear()
+    with _table_cache_lock:
+        _table_cache.clear()
+    with _traffic_lock:
+        poll_traffic.clear()
+        _page_validators.clear()
+    _discord_bucket = _DiscordBucket()
+    _reset_async_sessions()
+
+
+def _reset_async_sessions() -> None:
+    """Close the aiohttp sessions on the loop they were created on, as far as possible."""
+    global _async_connector, _async_loop, _async_discord_session
+    async_sessions = [entry["session"] for entry in _async_sessions.values()]
+    if _async_discord_session is not None:
+        async_sessions.append(_async_discord_session)
+        _async_discord_session = None
+    connector, _async_connector = _async_connector, None
+    loop, _async_loop = _async_loop, None
+    _async_sessions.clear()
+    if loop is None or loop.is_closed() or not (async_sessions or connector):
+        return
+
+    async def close() -> None:
+        for session in async_sessions:
+            await session.close()
+        if connector is not None:
+            closing = connector.close()
+            if hasattr(closing, "__await__"):
+                await closing
+
+    import asyncio
 
-        old_info_all = old_data.get(user["name"], {})
-        subject_messages = _collect_subject_messages(
-            user["name"], data, old_info_all, show_year_average=SHOW_YEAR_AVERAGE
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        loop.create_task(close())
+    elif running is None and not loop.is_running():
+        loop.run_until_complete(close())
+    else:
+        # Ihre Schleife lässt sich gerade nicht antreiben: Sitzungen nur vom
+        # gemeinsamen Connector lösen, offene Verbindungen räumt der GC ab
+        close().close()
+        for session in async_sessions:
+            session.detach()
+
+
+def _bind_async_loop() -> None:
+    import asyncio
+
+    global _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_loop is not loop:
+        # aiohttp-Sitzungen sind an die Schleife gebunden, auf der sie entstanden
+        _reset_async_sessions()
+        _async_loop = loop
+
+
+def _async_user_session(user: dict) -> dict:
+    _bind_async_loop()
+    entry = _async_sessions.get(user["name"])
+    if entry is None:
+        session = _aiohttp_session()
+        logged_in = _load_aiohttp_cookies(session, user["name"])
+        entry = _async_sessions[user["name"]] = {
+            "session": session,
+            "logged_in": logged_in,
+            "saved_cookies": _dump_aiohttp_cookies(session) if logged_in else None,
+        }
+    return entry
+
+
+def _async_discord_api():
+    """aiohttp session for the Discord API with its own connector and only the bot headers."""
+    global _async_discord_session
+    _bind_async_loop()
+    if _async_discord_session is None:
+        aiohttp = _aiohttp()
+        _async_discord_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT_SECONDS),
+            headers={"Authorization": f"Bot {DISCORD_TOKEN}"},
         )
+    return _async_discord_session
 
-        safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", user["name"])
-        if subject_messages:
-            successful_subjects = set()
-            failed_subjects = set()
-            for subject, msg in subject_messages:
-                if _send_discord_message(msg):
-                    successful_subjects.add(subject)
-                else:
-                    failed_subjects.add(subject)
-                time.sleep(1)
-
-            if failed_subjects:
-                advanced = _advance_stored_subjects(
-                    old_info_all,
-                    data,
-                    successful_subjects,
-                )
-                old_data[user["name"]] = advanced
-                _write_json_file(f"old_grades_{safe_name}.json", advanced)
-                _write_json_file(f"grades_{safe_name}.json", data)
-                logging.error(
-                    "Notenstand für %s nur teilweise fortgeschrieben; fehlgeschlagene Fächer: %s",
-                    user["name"],
-                    ", ".join(sorted(failed_subjects)),
-                )
-                continue
-        else:
-            logging.info(f"Keine neuen Noten gefunden für {user['name']}.")
 
-        _write_json_file(f"grades_{safe_name}.json", data)
-        old_data[user["name"]] = data
-        _write_json_file(f"old_grades_{safe_name}.json", data)
+async def _poll_user_async(user: dict, previous_fingerprint: str | None, slot: asyncio.Semaphore):
+    import asyncio
+
+    async with slot:
+        if not _use_aiohttp():
+            # Rückfall: der synchrone Abruf samt Sitzungsverwaltung im Executor
+            return await asyncio.get_running_loop().run_in_executor(
+                None, _poll_user, user, previous_fingerprint
+            )
+        entry = _async_user_session(user)
+        if _request_limiter is not None:
+            await asyncio.sleep(_request_limiter.reserve(_poll_cost(entry), _clock.time()))
+        data = await fetch_html_async(
+            user["username"],
+            user["password"],
+            session=entry["session"],
+            previous_fingerprint=previous_fingerprint,
+            logged_in=entry["logged_in"],
+            account=user["name"],
+        )
+        entry["logged_in"] = data is not None and not DEBUG_LOCAL
+        if entry["logged_in"] and SESSION_COOKIE_DIR:
+            cookies = _dump_aiohttp_cookies(entry["session"])
+            await asyncio.get_running_loop().run_in_executor(
+                None, _save_session_cookies, entry, user["name"], cookies
+            )
+        return data
+
+
+async def _handle_poll_result_async(
+    user: dict,
+    old_report: GradeReport,
+    data,
+    metrics: Counter,
+    delivery_lock: asyncio.Lock,
+) -> asyncio.Task | None:
+    """Store one user and start delivering its notifications; returns the delivery task."""
+    import asyncio
+
+    # Journal, Statusdateien und Notenverlauf schreiben mit fsync; das blockiert
+    # sonst die Schleife und damit alle übrigen Abrufe
+    ids = await asyncio.get_running_loop().run_in_executor(
+        None, _record_poll_result, user, old_report, data, metrics
+    )
+    if not ids:
+        return None
+    # Die Zustellung läuft neben den weiteren Abrufen
+    return asyncio.create_task(_deliver_outbox_async(delivery_lock, ids))
+
 
+async def _deliver_outbox_async(delivery_lock: asyncio.Lock, ids: list[int] | None = None) -> None:
+    """Deliver the due outbox entries (only ids, if given) on the event loop.
 
+    The journal is read and written in the default executor.
+    """
+    import asyncio
 
-# Dateien für gespeicherte Notenstände pro Benutzer
-old_data = {}
-for u in USERS:
-    safe_name = re.sub(r"[^A-Za-z0-9_-]", "_", u["name"])
-    file = f"old_grades_{safe_name}.json"
-    old_data[u["name"]] = _load_json_file(file)
+    loop = asyncio.get_running_loop()
+    async with delivery_lock:
+        now = time.time()
+        entries = await loop.run_in_executor(None, lambda: _discord_outbox().claim(now, ids))
+        if not entries:
+            return
+        try:
+            failed = await _deliver_async(_outbox_items(entries))
+            await loop.run_in_executor(None, _settle, entries, failed)
+        except Exception:
+            await loop.run_in_executor(None, _release, entries)
+
+
+async def _deliver_async(items: list[tuple[object, str]]) -> set:
+    """Async counterpart of _deliver."""
+    import asyncio
+
+    failed = set()
+    for content, keys in pack_messages(items):
+        if not await _send_discord_message_async(content):
+            failed |= keys
+        if DISCORD_MESSAGE_DELAY_SECONDS:
+            await asyncio.sleep(DISCORD_MESSAGE_DELAY_SECONDS)
+    return {key for key, _ in items} - failed
+
+
+async def run_once_async(users: list[dict] | None = None):
+    """Run one polling cycle on the event loop; same results as run_once.
+
+    Notifications are delivered by one task per user, one user at a time,
+    while the remaining polls continue; outbox entries whose back-off has
+    expired go out at the end of the cycle.
+    """
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    metrics = Counter()
+    users = list(USERS if users is None else users)
+    metrics["users"] = len(users)
+    if users:
+        slot = asyncio.Semaphore(max(1, POLL_CONCURRENCY))
+        old_reports = await loop.run_in_executor(None, lambda: [_old_report(user["name"]) for user in users])
+
+        async def poll(idx):
+            try:
+                return idx, await _poll_user_async(users[idx], old_reports[idx].fingerprint, slot)
+            except Exception:
+                logging.exception("Abruf für %s fehlgeschlagen", users[idx]["name"])
+                return idx, None
+
+        delivery_lock = asyncio.Lock()
+        deliveries = []
+        for next_done in asyncio.as_completed([poll(idx) for idx in range(len(users))]):
+            idx, data = await next_done
+            task = await _handle_poll_result_async(users[idx], old_reports[idx], data, metrics, delivery_lock)
+            if task is not None:
+                deliveries.append(task)
+        await asyncio.gather(*deliveries)
+        await _deliver_outbox_async(delivery_lock)
+    # Der SQLite-Commit am Zyklusende blockiert ebenfalls
+    return await loop.run_in_executor(None, _finish_cycle, metrics)
+
+
+# Laufende Summen aller Zyklen, z. B. wie oft der Fingerprint-Abkürzungsweg griff
+cycle_metrics = Counter()
+
+def _history_log() -> grade_history.GradeHistory | None:
+    """The grade history in GRADE_HISTORY_DIR, opened on first use; None if disabled."""
+    global _grade_history
+    with _lazy_lock:
+        if _grade_history is None and GRADE_HISTORY_DIR:
+            _grade_history = grade_history.GradeHistory(GRADE_HISTORY_DIR)
+        return _grade_history
+
+
+def _state_db() -> state_store.StateStore | None:
+    """The SQLite state store, opened on first use; None with STATE_BACKEND=json."""
+    global _state_store
+    with _lazy_lock:
+        if _state_store is None and STATE_BACKEND == "sqlite":
+            _state_store = state_store.StateStore(STATE_DB_FILE)
+        return _state_store
+
+
+def _old_report(user_name: str) -> GradeReport:
+    """Return the stored state of one user, reading it on first use.
+
+    With SQLite the state comes from the store; otherwise, or if the
+    account was not imported yet, from its old_grades_*.json file.
+    """
+    report = old_data.get(user_name)
+    if report is None:
+        key = _state_key(user_name)
+        store = _state_db()
+        data = store.load(key) if store is not None else None
+        if data is None:
+            data = _load_json_file(f"old_grades_{key}.json")
+        report = old_data[user_name] = GradeReport.from_dict(data)
+    return _as_report(report)
+
+
+def _evaluate_grade_page(
+    text: str,
+    previous_fingerprint: str | None = None,
+    cache_key: str | None = None,
+):
+    """Parse a fetched grades page unless its grade regions are unchanged.
+
+    Returns the parsed data including its "Fingerprint", UNCHANGED, or None
+    when the page does not contain the grade view.
+    """
+    return _evaluate_grade_regions(_grade_regions(text), text, previous_fingerprint, cache_key)
+
+
+def _evaluate_grade_regions(
+    regions: list[tuple[str, str]] | None,
+    fallback_text: str,
+    previous_fingerprint: str | None = None,
+    cache_key: str | None = None,
+):
+    """Like _evaluate_grade_page for already sliced regions; fallback_text is parsed when regions is None."""
+    fingerprint = _fingerprint_regions(None if regions is None else _join_regions(regions))
+    if fingerprint is not None and fingerprint == previous_fingerprint:
+        return UNCHANGED
+    tables = _extract_grade_tables(fallback_text if regions is None else regions, cache_key=cache_key)
+    if not _has_grade_markup(tables):
+        return None
+    data = _assemble_grades(tables)
+    if fingerprint is not None:
+        data["Fingerprint"] = fingerprint
+    return data
+
+
+def _close_response(resp) -> None:
+    """Release a response whose body is not going to be read."""
+    close = getattr(resp, "close", None)
+    if close is not None:
+        close()
+
+
+_HEADER_CHARSET_RE = re.compile(r"charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb"<meta\b[^>]*?charset\s*=\s*[\"']?([\w.:-]+)", re.IGNORECASE)
+# Das <meta charset> steht laut HTML-Standard in den ersten 1024 Bytes
+_META_CHARSET_BYTES = 1024
+
+
+def _known_encoding(name: str | None) -> str | None:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+class _PageDecoder:
+    """Incremental page decoder without charset detection.
+
+    The encoding is PAGE_ENCODING, else the charset of the Content-Type
+    header, else the page's <meta charset>, else UTF-8.
+    """
+
+    def __init__(self, content_type: str | None = None):
+        self.encoding = _known_encoding(PAGE_ENCODING)
+        if self.encoding is None and content_type:
+            match = _HEADER_CHARSET_RE.search(content_type)
+            self.encoding = _known_encoding(match and match.group(1))
+        self._decoder = None
+        self._head = b""
+
+    def decode(self, chunk: bytes, final: bool = False) -> str:
+        if self._decoder is None:
+            self._head += chunk
+            if len(self._head) < _META_CHARSET_BYTES and not final:
+                return ""
+            if self.encoding is None:
+                match = _META_CHARSET_RE.search(self._head, 0, _META_CHARSET_BYTES)
+                self.encoding = _known_encoding(match and match.group(1).decode("ascii")) or "utf-8"
+            self._decoder = codecs.getincrementaldecoder(self.encoding)(errors="replace")
+            chunk, self._head = self._head, b""
+        return self._decoder.decode(chunk, final)
+
+
+def _decode_page(body: bytes, content_type: str | None = None) -> str:
+    """Decode a complete response body, see _PageDecoder."""
+    return _PageDecoder(content_type).decode(body, final=True)
+
+
+def _response_text(resp) -> str:
+    """Text of a requests response without requests' charset detection."""
+    content = getattr(resp, "content", None)
+    if not isinstance(content, bytes):
+        return resp.text
+    return _decode_page(content, getattr(resp, "headers", {}).get("Content-Type"))
+
+
+class _PageTooLarge(Exception):
+    pass
+
+
+def _stream_grade_page(resp) -> _GradeRegionScanner:
+    """Feed a streamed response into a region scanner.
+
+    Reading stops once the final-grades container is closed; more than
+    MAX_PAGE_BYTES raise _PageTooLarge.
+    """
+    scanner = _GradeRegionScanner()
+    decoder = _PageDecoder(getattr(resp, "headers", {}).get("Content-Type"))
+    received = 0
+    chunks = resp.iter_content(chunk_size=STREAM_CHUNK_BYTES)
+    try:
+        for chunk in chunks:
+            received += len(chunk)
+            if received > MAX_PAGE_BYTES:
+                raise _PageTooLarge(received)
+            scanner.feed(decoder.decode(chunk))
+            if scanner.done:
+                break
+        else:
+            scanner.feed(decoder.decode(b"", final=True))
+        remaining = getattr(getattr(resp, "raw", None), "length_remaining", None)
+        if scanner.done and remaining is not None and remaining <= STREAM_CHUNK_BYTES:
+            # Ein kleiner Rest wird noch gelesen, damit die Verbindung im Pool bleibt
+            for chunk in chunks:
+                received += len(chunk)
+    finally:
+        # Sonst folgt nach dem Zeugnisbereich nichts Relevantes mehr
+        resp.close()
+    scanner.bytes = received
+    return scanner
+
+
+def _log_scanned_response(label: str, status: int, scanner: _GradeRegionScanner) -> None:
+    logging.info(
+        "%s Response (%s), %d Bytes gelesen%s",
+        label,
+        status,
+        scanner.bytes,
+        " (nach dem Zeugnisbereich abgebrochen)" if scanner.done else "",
+    )
+
+
+def _evaluate_response(resp, previous_fingerprint: str | None, cache_key: str | None, label: str):
+    """Evaluate a grades page response, streamed when possible.
 
+    A 304 answer to a conditional request counts as UNCHANGED. The
+    response's validators are kept for the next request of cache_key.
+    """
+    if resp.status_code == 304:
+        _record_traffic(cache_key, 304, _wire_bytes(resp), 0)
+        logging.info("%s Response (304), Notenseite nicht geändert", label)
+        return UNCHANGED
+    data = _read_grade_response(resp, previous_fingerprint, cache_key, label)
+    _remember_validators(cache_key, getattr(resp, "headers", None), data, previous_fingerprint)
+    return data
 
-def fetch_html(username: str, password: str, session: requests.Session | None = None):
-    """Meldet sich im Elternportal an oder liest lokale Daten im Debug-Modus."""
+
+def _read_grade_response(resp, previous_fingerprint: str | None, cache_key: str | None, label: str):
+    if not STREAM_GRADES_PAGE or not hasattr(resp, "iter_content"):
+        text = _response_text(resp)
+        _record_traffic(cache_key, resp.status_code, _wire_bytes(resp), _body_size(resp))
+        if SHOW_RES:
+            logging.info("%s Response (%s): %s", label, resp.status_code, text)
+        else:
+            logging.info("%s Response (%s)", label, resp.status_code)
+        return _evaluate_grade_page(text, previous_fingerprint, cache_key=cache_key)
+    try:
+        scanner = _stream_grade_page(resp)
+    except _PageTooLarge as e:
+        _record_traffic(cache_key, resp.status_code, _wire_bytes(resp), e.args[0])
+        logging.error("%s größer als %d Bytes (%s gelesen), Abruf verworfen", label, MAX_PAGE_BYTES, e)
+        return None
+    except Exception as e:
+        logging.error(f"{label} konnte nicht gelesen werden: {e}")
+        return None
+    _record_traffic(cache_key, resp.status_code, _wire_bytes(resp), scanner.bytes)
+    _log_scanned_response(label, resp.status_code, scanner)
+    regions, fallback = scanner.result()
+    return _evaluate_grade_regions(regions, fallback, previous_fingerprint, cache_key)
+
+
+def fetch_html(
+    username: str,
+    password: str,
+    session: requests.Session | None = None,
+    previous_fingerprint: str | None = None,
+    logged_in: bool = False,
+    account: str | None = None,
+):
+    """Meldet sich im Elternportal an oder liest lokale Daten im Debug-Modus.
+
+    Stimmt der Fingerprint des Notenbereichs mit previous_fingerprint
+    überein, wird UNCHANGED statt der geparsten Daten zurückgegeben. Mit
+    logged_in=True wird die Sitzung direkt weiterverwendet und nur bei
+    einer Umleitung zur Login-Seite neu angemeldet. Datenvolumen,
+    Validatoren und Tabellen-Cache werden unter account geführt
+    (Standard: username).
+    """
     if session is None:
-        session = requests.Session()
+        session = _pooled_session()
+    account = account or username
 
     if DEBUG_LOCAL:
-        url = "http://localhost:8000/index.html"
+        url = DEBUG_LOCAL_URL
         try:
             if SHOW_HTTPS:
                 logging.info("HTTP GET %s (debug local)", url)
-            resp = session.get(url, timeout=REQUEST_TIMEOUT_SECONDS)
+            resp = session.get(
+                url,
+                timeout=REQUEST_TIMEOUT_SECONDS,
+                stream=STREAM_GRADES_PAGE,
+                headers=_conditional_headers(account, previous_fingerprint),
+            )
         except Exception as e:
             logging.error(f"Lokaler Abruf fehlgeschlagen: {e}")
             return None
-        if resp.status_code != 200:
+        if resp.status_code not in (200, 304):
             logging.error("Lokaler Abruf fehlgeschlagen – Status %s", resp.status_code)
+            _close_response(resp)
             return None
-        if SHOW_RES:
-            logging.info("Lokale Response (%s): %s", resp.status_code, resp.text)
-        else:
-            logging.info("Lokale Response (%s)", resp.status_code)
-        soup = BeautifulSoup(resp.text, "html.parser")
-        if not _has_grade_markup(soup):
+        # Das Dokument wird nur einmal geparst und für Prüfung und Auswertung
+        # gemeinsam genutzt.
+        data = _evaluate_response(resp, previous_fingerprint, account, "Lokale")
+        if data is None:
             logging.error("Lokale Response enthält keine erwartete Notenansicht")
+        return data
+
+    grades_page = None
+    if logged_in:
+        # Bestehende Sitzung: ein einzelner GET genügt, solange das Portal
+        # nicht zurück auf die Login-Seite umleitet.
+        grades_page = _get_grades_page(session, username, previous_fingerprint, account)
+        if grades_page is None:
+            return None
+        if "/account" not in grades_page.url:
+            _close_response(grades_page)
+            _record_traffic(account, grades_page.status_code, _wire_bytes(grades_page), 0)
+            session_stats["expired"] += 1
+            logging.info("Sitzung für %s abgelaufen, melde neu an", username)
+            grades_page = None
+        else:
+            session_stats["reused"] += 1
+    if grades_page is None:
+        if not _portal_login(session, username, password, account):
             return None
-        return parse_grades(resp.text)
+        session_stats["logins"] += 1
+        grades_page = _get_grades_page(session, username, previous_fingerprint, account)
+        if grades_page is None:
+            return None
+
+    if grades_page.status_code not in (200, 304):
+        logging.error("Notenübersicht fehlgeschlagen – Status %s", grades_page.status_code)
+        _close_response(grades_page)
+        return None
+
+    data = _evaluate_response(grades_page, previous_fingerprint, account, "Notenübersicht")
+    if data is None:
+        logging.error(
+            "Notenübersicht enthält keine erwartete Notenansicht – URL %s",
+            grades_page.url,
+        )
+    return data
+
+
+def _login_payload(login_html: str, username: str, password: str) -> dict[str, str]:
+    """Build the login form data including the hidden _nonce and _f_secure fields."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(login_html, "html.parser")
+    nonce_field = soup.find("input", {"name": "_nonce"})
+    f_secure_field = soup.find("input", {"name": "_f_secure"})
+    nonce = nonce_field["value"] if nonce_field else ""
+    f_secure = f_secure_field["value"] if f_secure_field else ""
+
+    return {
+        "user": username,
+        "password": password,
+        "fuxnoten_post_controller": "\\Objects\\Webinfo_Object",
+        "acount_action": "login",
+        "_referrer": "https://100308.fuxnoten.online/webinfo/",
+        "_nonce": nonce,
+        "_f_secure": f_secure,
+    }
+
 
+def _portal_login(session: requests.Session, username: str, password: str, account: str | None = None) -> bool:
+    """Log in to the portal; the session keeps the resulting cookies."""
     # Schritt 1: Login-Seite abrufen, um Nonce und versteckte Felder zu erhalten
-    login_url = "https://100308.fuxnoten.online/webinfo"
+    login_url = PORTAL_URL
     session.headers.update(
         {
             "User-Agent": "Mozilla/5.0",
@@ -807,32 +3482,19 @@ def fetch_html(username: str, password: str, session: requests.Session | None =
         login_page = session.get(login_url, timeout=REQUEST_TIMEOUT_SECONDS)
     except Exception as e:
         logging.error(f"Login-Seite nicht erreichbar: {e}")
-        return None
+        return False
+    login_html = _response_text(login_page)
+    _record_traffic(account or username, login_page.status_code, _wire_bytes(login_page), _body_size(login_page))
     if SHOW_RES:
         logging.info(
             "Login-Seite Response (%s): %s",
             login_page.status_code,
-            login_page.text,
+            login_html,
         )
-        
     else:
         logging.info("Login-Seite Response (%s)", login_page.status_code)
 
-    soup = BeautifulSoup(login_page.text, "html.parser")
-    nonce_field = soup.find("input", {"name": "_nonce"})
-    f_secure_field = soup.find("input", {"name": "_f_secure"})
-    nonce = nonce_field["value"] if nonce_field else ""
-    f_secure = f_secure_field["value"] if f_secure_field else ""
-
-    payload = {
-        "user": username,
-        "password": password,
-        "fuxnoten_post_controller": "\\Objects\\Webinfo_Object",
-        "acount_action": "login",
-        "_referrer": "https://100308.fuxnoten.online/webinfo/",
-        "_nonce": nonce,
-        "_f_secure": f_secure,
-    }
+    payload = _login_payload(login_html, username, password)
 
     # Schritt 2: Login-POST mit allen erforderlichen Feldern
     try:
@@ -850,12 +3512,13 @@ def fetch_html(username: str, password: str, session: requests.Session | None =
         )
     except Exception as e:
         logging.error(f"Login-Request fehlgeschlagen: {e}")
-        return None
+        return False
+    _record_traffic(account or username, resp.status_code, _wire_bytes(resp), _body_size(resp))
     if SHOW_RES:
         logging.info(
             "Login-POST Response (%s): %s",
             resp.status_code,
-            resp.text,
+            _response_text(resp),
         )
     else:
         logging.info("Login-POST Response (%s)", resp.status_code)
@@ -868,50 +3531,108 @@ def fetch_html(username: str, password: str, session: requests.Session | None =
         logging.error(
             "Login fehlgeschlagen – Status %s, URL %s", resp.status_code, resp.url
         )
-        return None
+        return False
+
+    return True
 
-    # Notenübersicht abrufen (nach erfolgreichem Login)
+
+def _get_grades_page(
+    session: requests.Session,
+    username: str,
+    previous_fingerprint: str | None = None,
+    account: str | None = None,
+):
+    """Fetch the grade overview, conditionally if validators are known; return None on network errors."""
     try:
-        grades_url = "https://100308.fuxnoten.online/webinfo/account/"
         if SHOW_HTTPS:
             logging.info(
                 "HTTP GET %s (username=%s)",
-                grades_url,
+                GRADES_URL,
                 username,
             )
-        grades_page = session.get(grades_url, timeout=REQUEST_TIMEOUT_SECONDS)
+        grades_page = session.get(
+            GRADES_URL,
+            timeout=REQUEST_TIMEOUT_SECONDS,
+            stream=STREAM_GRADES_PAGE,
+            headers=_conditional_headers(account or username, previous_fingerprint),
+        )
     except Exception as e:
         logging.error(f"Fehler beim Abrufen der Notenübersicht: {e}")
         return None
-    if SHOW_RES:
-        logging.info(
-            "Notenübersicht Response (%s): %s",
-            grades_page.status_code,
-            grades_page.text,
-        )
-    else:
-        logging.info("Notenübersicht Response (%s)", grades_page.status_code)
+    # Der Body wird erst in _evaluate_response gelesen und protokolliert
+    return grades_page
+
+
+class GradeChecker:
+    """Grade poller for embedding in another process.
+
+    The configuration is read on first use: the given Config, or else the
+    environment plus the .env file. All checkers share this module's
+    sessions, caches and outbox, so each call first makes the checker's
+    configuration the active one.
+    """
+
+    __slots__ = ("_config", "env_file")
+
+    def __init__(self, config: Config | None = None, env_file: str | None = None):
+        self._config = config
+        self.env_file = env_file
+
+    @property
+    def config(self) -> Config:
+        if self._config is None:
+            self._config = load_config(self.env_file)
+        return self._config
+
+    def _activate(self) -> None:
+        config = self.config
+        missing = config.missing()
+        if missing:
+            raise ValueError("Fehlende Umgebungsvariablen: " + ", ".join(missing))
+        if _config is not config:
+            configure(config)
+
+    def run_once(self, users: list[dict] | None = None) -> Counter:
+        """Run one polling cycle, see the module-level run_once().
+
+        Blocks the calling thread; inside a running event loop use
+        run_once_async() instead.
+        """
+        self._activate()
+        return run_once(users)
+
+    async def run_once_async(self, users: list[dict] | None = None) -> Counter:
+        """Run one polling cycle on the caller's event loop (asyncio engine)."""
+        self._activate()
+        return await run_once_async(users)
+
+    def run_forever(self) -> None:
+        """Poll until the process ends, per time slot or per user as SCHEDULER says."""
+        self._activate()
+        logging.info("Noten-Checker gestartet. Erster Abruf läuft sofort.")
+        if _consume_startup_message_request() and not _send_startup_message():
+            logging.error("Startmeldung konnte nicht an Discord gesendet werden.")
+        if SCHEDULER in ("staggered", "adaptive"):
+            run_scheduled()
+        else:
+            # Regelmäßige Prüfung zu festen Uhrzeit-Slots
+            while True:
+                run_once()
+                _sleep_until_next_interval()
 
-    if grades_page.status_code != 200:
-        logging.error("Notenübersicht fehlgeschlagen – Status %s", grades_page.status_code)
-        return None
 
-    grades_soup = BeautifulSoup(grades_page.text, "html.parser")
-    if not _has_grade_markup(grades_soup):
-        logging.error(
-            "Notenübersicht enthält keine erwartete Notenansicht – URL %s",
-            grades_page.url,
-        )
-        return None
+def main_cli() -> int:
+    """Entry point of `python main.py`: read .env, log to noten_checker.log, poll forever."""
+    configure(load_config())
+    setup_logging()
+    check_env()
+    GradeChecker(_config).run_forever()
+    return 0
+
 
-    return parse_grades(grades_page.text)
+# Beim Import nur die Umgebung lesen; .env lädt erst load_config()
+configure(Config())
 
 
 if __name__ == "__main__":
-    # Hauptschleife: regelmäßige Prüfung zu festen Uhrzeit-Slots
-    logging.info("Noten-Checker gestartet. Erster Abruf läuft sofort.")
-    if _consume_startup_message_request() and not _send_startup_message():
-        logging.error("Startmeldung konnte nicht an Discord gesendet werden.")
-    while True:
-        run_once()
-        _sleep_until_next_interval()
+    sys.exit(main_cli())
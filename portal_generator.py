@@ -0,0 +1,560 @@
+"""Synthetische Notenseiten im Aufbau des Fux-Elternportals.
+
+Aufruf:
+    python portal_generator.py page --subjects 14 --grades 8 > index.html
+    python portal_generator.py serve --port 8000 --mutate-every 3
+    python portal_generator.py soak --users 50 --cycles 20
+"""
+import argparse
+import gzip
+import http.server
+import importlib
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+SUBJECT_NAMES = (
+    "Deutsch",
+    "Mathematik",
+    "Englisch",
+    "Chemie",
+    "Physik",
+    "Biologie",
+    "Geschichte",
+    "Geographie",
+    "Ethik",
+    "Informatik",
+    "Kunst",
+    "Musik",
+    "Sport",
+    "Franzoesisch",
+    "Latein",
+    "Sozialkunde",
+)
+LEVELS = ("erh. Niveau", "grundl. Niveau")
+FINAL_CONTAINER_ID = 610
+
+
+def _subject_name(idx: int) -> str:
+    base = SUBJECT_NAMES[idx % len(SUBJECT_NAMES)]
+    course = idx // len(SUBJECT_NAMES) + 1
+    return f"{base} Kurs {course} ({LEVELS[idx % 2]})"
+
+
+def _points(rng: random.Random) -> str:
+    return str(rng.randint(3, 15))
+
+
+def new_portal(
+    subjects: int = 14,
+    grades: int = 8,
+    periods: int = 4,
+    current_period: int | None = None,
+    seed: int = 0,
+    stray_text: float = 0.0,
+    padding_kb: int = 0,
+) -> dict:
+    """Create the grade state of one student.
+
+    Halbjahre up to current_period (default: all) carry grades; earlier ones
+    already have a Zeugnisnote. stray_text is the share of grades that the
+    portal renders as bare text between the cells instead of inside a td.
+    """
+    rng = random.Random(seed)
+    if current_period is None:
+        current_period = periods
+    state = {
+        "periods": periods,
+        "current_period": current_period,
+        "stray_text": stray_text,
+        "padding_kb": padding_kb,
+        "rng": rng,
+        "subjects": [],
+    }
+    for idx in range(subjects):
+        subject = {"name": _subject_name(idx), "periods": {}}
+        for period in range(1, periods + 1):
+            filled = period <= current_period
+            subject["periods"][period] = {
+                "exams": [_points(rng)] if filled and rng.random() < 0.7 else [],
+                "grades": [_points(rng) for _ in range(rng.randint(max(1, grades // 2), grades))] if filled else [],
+                "stray": set(),
+            }
+            if stray_text:
+                period_data = subject["periods"][period]
+                for pos in range(len(period_data["grades"])):
+                    if _may_be_stray(period_data, pos) and rng.random() < stray_text:
+                        period_data["stray"].add(pos)
+        state["subjects"].append(subject)
+    return state
+
+
+def _may_be_stray(period_data: dict, pos: int) -> bool:
+    # Zwei Textknoten direkt hintereinander verschmelzen zu einem Wert
+    return pos - 1 not in period_data["stray"]
+
+
+def mutate(state: dict, additions: int = 1) -> list[tuple[str, int, str]]:
+    """Add grades to the current Halbjahr and return (subject, period, grade)."""
+    rng = state["rng"]
+    period = state["current_period"]
+    added = []
+    for _ in range(additions):
+        subject = rng.choice(state["subjects"])
+        period_data = subject["periods"][period]
+        grade = _points(rng)
+        if not period_data["exams"] and rng.random() < 0.2:
+            period_data["exams"].append(grade)
+        else:
+            pos = len(period_data["grades"])
+            if state["stray_text"] and _may_be_stray(period_data, pos) and rng.random() < state["stray_text"]:
+                period_data["stray"].add(pos)
+            period_data["grades"].append(grade)
+        added.append((subject["name"], period, grade))
+    state["version"] = state.get("version", 0) + 1
+    return added
+
+
+def expected_grades(state: dict) -> dict[str, dict[int, dict[str, list[str]]]]:
+    """Return what parse_grades must find for every subject and period."""
+    return {
+        subject["name"]: {
+            period: {"exams": list(data["exams"]), "grades": list(data["grades"])}
+            for period, data in subject["periods"].items()
+        }
+        for subject in state["subjects"]
+    }
+
+
+def _format(value: float | None) -> str:
+    return "" if value is None else f"{value:.2f}".replace(".", ",")
+
+
+def _mean(values: list[str]) -> float | None:
+    return sum(int(v) for v in values) / len(values) if values else None
+
+
+def _period_average(data: dict) -> float | None:
+    grades_avg = _mean(data["grades"])
+    exam_avg = _mean(data["exams"])
+    if grades_avg is None:
+        return exam_avg
+    if exam_avg is None:
+        return grades_avg
+    return (grades_avg + exam_avg) / 2
+
+
+def _final_average_cell(value: float | None, overview: bool = False) -> str:
+    title = ' title="Gesamtdurchschnitt"' if overview else ""
+    if value is None:
+        return f'<td{title} class="final_average"></td>'
+    # Das Portal rendert die Schnitte mit viel Leerraum um den Wert
+    return (
+        f'<td{title} class="final_average">\n'
+        f"                                                        {_format(value)}"
+        "                                                    </td>"
+    )
+
+
+def _grade_cells(data: dict, columns: int) -> str:
+    cells = []
+    for pos, grade in enumerate(data["grades"]):
+        if pos in data["stray"]:
+            cells.append(grade)
+        else:
+            cells.append(f"<td>{grade}</td>")
+    cells.extend("<td></td>" for _ in range(columns - len(data["grades"])))
+    return "".join(cells)
+
+
+def _period_cells(state: dict, subject: dict, period: int, columns: int, overview: bool = False) -> str:
+    data = subject["periods"][period]
+    exam = data["exams"][0] if data["exams"] else ""
+    exam_avg = _format(_mean(data["exams"]))
+    finals = "".join(
+        _final_average_cell(_period_average(subject["periods"][p]), overview) for p in range(1, period + 1)
+    )
+    return (
+        f"<td>{exam}</td><td>{exam_avg}</td>"
+        + _grade_cells(data, columns)
+        + f"<td>{_format(_mean(data['grades']))}</td>"
+        + finals
+    )
+
+
+def _columns(state: dict, period: int) -> int:
+    return max((len(s["periods"][period]["grades"]) for s in state["subjects"]), default=0) or 1
+
+
+def _n_average(state: dict, period: int) -> str:
+    values = [_period_average(s["periods"][period]) for s in state["subjects"]]
+    values = [v for v in values if v is not None]
+    return _format(sum(values) / len(values)) if values else ""
+
+
+def _period_title(state: dict, period: int) -> str:
+    return (
+        f"\n                                    {period}. Halbjahr"
+        f"                                                                            "
+        f"| N{period} Ø {_n_average(state, period)}"
+        "                                                                        \n                                "
+    )
+
+
+def _sub_headers(columns: int, period: int) -> tuple[str, str]:
+    groups = (
+        f'<th colspan="2">Klausuren</th><th colspan="{columns}">sonstige Leistungen</th>'
+        f'<th colspan="{period}"></th>'
+    )
+    numbers = (
+        "<th>1</th><th>Ø</th>"
+        + "".join(f"<th>{n}</th>" for n in range(1, columns + 1))
+        + "<th>Ø</th>"
+        + "".join(
+            f'<th title="Gesamtdurchschnitt" class="final_average">Ø{p}</th>' for p in range(1, period + 1)
+        )
+    )
+    return groups, numbers
+
+
+def _subject_cell(subject: dict) -> str:
+    return f"<td class='fixed_1'\t\t\t\t\t\t\t\t\t\t\t\t\t>{subject['name']}</td>"
+
+
+def render_period_table(state: dict, period: int) -> str:
+    columns = _columns(state, period)
+    groups, numbers = _sub_headers(columns, period)
+    rows = "\n".join(
+        f"<tr>{_subject_cell(s)}{_period_cells(state, s, period, columns)}</tr>" for s in state["subjects"]
+    )
+    return (
+        f'<table id="student_main_grades_table_{period}" data-period="{period}" '
+        'class="scoring-panel-table table view_element" style="display:none;"><thead>'
+        f'<tr><th class="fixed_1">&nbsp;</th><th colspan="{3 + columns + period}" class="text-center" '
+        f'style="text-transform: uppercase">{_period_title(state, period)}</th></tr>'
+        f'<tr><th class="fixed_1">Unterrichtseinheit</th>{groups}</tr>'
+        f'<tr><th class="fixed_1">&nbsp;</th>{numbers}</tr></thead>'
+        f"<tbody>{rows}</tbody></table>"
+    )
+
+
+def render_overview_table(state: dict) -> str:
+    periods = range(1, state["periods"] + 1)
+    columns = {p: _columns(state, p) for p in periods}
+    titles = "".join(
+        f'<th colspan="{3 + columns[p] + p}" class="text-center">{_period_title(state, p)}</th>' for p in periods
+    )
+    sub = [_sub_headers(columns[p], p) for p in periods]
+    rows = "\n".join(
+        f"<tr>{_subject_cell(s)}"
+        + "".join(_period_cells(state, s, p, columns[p], overview=True) for p in periods)
+        + "</tr>"
+        for s in state["subjects"]
+    )
+    return (
+        '<table id="student_main_grades_table_all" data-period="all" '
+        'class="scoring-panel-table table view_element" style="display:none" ><thead>'
+        f'<tr><th class="fixed_1">&nbsp;</th>{titles}</tr>'
+        f'<tr><th class="fixed_1">Unterrichtseinheit</th>{"".join(g for g, _ in sub)}</tr>'
+        f'<tr><th class="fixed_1">&nbsp;</th>{"".join(n for _, n in sub)}</tr></thead>'
+        f"<tbody>{rows}</tbody></table>"
+    )
+
+
+def render_final_container(state: dict) -> str:
+    periods = range(1, state["periods"] + 1)
+    header = "".join(
+        f'<th class="score_display display_avg" style="display:none">\n                                    {p}'
+        f'                                </th><th class="score_display display_final_grade">{p}</th>'
+        for p in periods
+    )
+    rows = []
+    for subject in sorted(state["subjects"], key=lambda s: s["name"]):
+        cells = [f"<tr><td>\n                                    {subject['name']}                                </td>"]
+        for p in periods:
+            average = _period_average(subject["periods"][p])
+            closed = p < state["current_period"] and average is not None
+            if average is None:
+                shown = "-1" if p <= state["current_period"] else ""
+            else:
+                shown = _format(average)
+            cells.append(
+                '<td class="score_display display_avg" style="display:none">'
+                + (f"\n                                        {shown}                                    " if shown else "")
+                + "</td>"
+                + f'<td class="score_display display_final_grade">{round(average) if closed else ""}</td>'
+            )
+        rows.append("".join(cells) + "</tr>")
+    # Wie im Portal endet der Tabellenkörper mit einem zweiten <tbody> statt </tbody>
+    return (
+        f'<div id="student_final_grades_container_{FINAL_CONTAINER_ID}" class=" student_info_{FINAL_CONTAINER_ID}" '
+        'style="display:none"><div class="scoring-table-students"><div class="overflow_hidden">'
+        f'<table class="scoring-panel-table" ><thead><tr><th>Fach</th>{header}</tr></thead>'
+        f'<tbody>{"".join(rows)}<tbody></table></div></div><div class="clear clearfix"></div></div>'
+    )
+
+
+def _padding(state: dict) -> str:
+    """Navigation, scripts and hidden views that make up most of a real page."""
+    target = state["padding_kb"] * 1024
+    if target <= 0:
+        return ""
+    block = (
+        '<div class="view_element menu-entry" style="display:none"><ul class="nav">'
+        + "".join(f'<li><a href="/webinfo/account/?view={i}">Eintrag {i}</a></li>' for i in range(20))
+        + "</ul></div>\n"
+    )
+    return block * max(1, target // len(block))
+
+
+def render_page(state: dict) -> str:
+    """Render the full account page with all grade sections."""
+    rng = state["rng"]
+    sections = "\n".join(
+        [render_period_table(state, p) for p in range(1, state["periods"] + 1)]
+        + [render_overview_table(state), render_final_container(state)]
+    )
+    return (
+        "<!DOCTYPE html><html lang='de'><head><meta charset='utf-8'><title>Webinfo</title>"
+        "<style>.view_element{display:none}</style>"
+        "<script>function showPeriod(p){jQuery('.view_element').hide();"
+        "jQuery('#student_main_grades_table_' + p).show();}</script></head><body>"
+        "<form method='post' action='/webinfo/account/'>"
+        f"<input type='hidden' name='_nonce' value='{rng.getrandbits(64):016x}'>"
+        f"<input type='hidden' name='_f_secure' value='{rng.getrandbits(64):016x}'></form>"
+        f"{_padding(state)}<div class='scoring-panel'>\n{sections}\n</div>"
+        "<!-- student_main_grades_table_1 wird per JavaScript umgeschaltet -->"
+        "</body></html>"
+    )
+
+
+def portal_page(subjects: int = 14, grades: int = 8, periods: int = 4, **kwargs) -> str:
+    """Shortcut: render one page of a fresh state."""
+    return render_page(new_portal(subjects, grades, periods, **kwargs))
+
+
+def make_server(
+    state: dict,
+    host: str = "localhost",
+    port: int = 8000,
+    mutate_every: int = 0,
+    additions: int = 1,
+    latency: float = 0.0,
+    validators: bool = False,
+    compress: bool = False,
+):
+    """HTTP server for DEBUG_LOCAL that renders the current state on every GET.
+
+    With mutate_every > 0 the state gains grades after every n-th page;
+    latency (seconds) delays each response like a slow portal. validators
+    adds an ETag per grade state and answers If-None-Match with 304,
+    compress gzips the page for clients that accept it.
+    """
+    lock = threading.Lock()
+    served = [0]
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        # Keep-Alive wie beim echten Portal
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            with lock:
+                etag = f'"v{state.get("version", 0)}"'
+                if validators and self.headers.get("If-None-Match") == etag:
+                    body = None
+                else:
+                    body = render_page(state).encode("utf-8")
+                served[0] += 1
+                if mutate_every and served[0] % mutate_every == 0:
+                    mutate(state, additions)
+            if body is None:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            if validators:
+                self.send_header("ETag", etag)
+            if compress and "gzip" in self.headers.get("Accept-Encoding", ""):
+                body = gzip.compress(body, compresslevel=6)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.state_lock = lock
+    return server
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def soak(users: int = 20, cycles: int = 10, additions: int = 2, latency: float = 0.0, **portal_kwargs) -> list[dict]:
+    """Run run_once against a generated portal and check every added grade is reported.
+
+    Discord delivery is replaced by a counter; state files go to a temporary
+    directory. Returns one dict per cycle.
+    """
+    state = new_portal(**portal_kwargs)
+    port = _free_port()
+    server = make_server(state, port=port, latency=latency)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    env = {
+        "DEBUG_LOCAL": "true",
+        "DEBUG_LOCAL_URL": f"http://localhost:{port}/index.html",
+        "DISCORD_TOKEN": os.getenv("DISCORD_TOKEN") or "soak",
+        "DISCORD_CHANNEL_ID": os.getenv("DISCORD_CHANNEL_ID") or "0",
+        "DISCORD_MESSAGE_DELAY_SECONDS": "0",
+    }
+    for idx in range(1, users + 1):
+        env[f"USER{idx}"] = f"Soak{idx}"
+        # Eigener Benutzername je Konto, damit jeder seinen eigenen Tabellencache hat
+        env[f"USERNAME{idx}"] = f"soak{idx}"
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            import main
+
+            main = importlib.reload(main)
+            # Eigene Konfiguration statt os.environ zu verändern
+            checker = main.GradeChecker(main.Config({**os.environ, **env}))
+            sent = []
+            main._send_discord_message = lambda content: sent.append(content) or True
+            for cycle in range(cycles):
+                added = [] if cycle == 0 else mutate(state, additions)
+                sent.clear()
+                start = time.perf_counter()
+                metrics = checker.run_once()
+                elapsed = time.perf_counter() - start
+                reported = sum(
+                    line.count("Neue Note") + line.count("Neue Klassenarbeitsnote") for line in sent
+                )
+                results.append(
+                    {
+                        "cycle": cycle,
+                        "seconds": elapsed,
+                        "parsed": metrics["parsed"],
+                        "unchanged": metrics["unchanged"],
+                        "failed": metrics["failed"],
+                        "added": len(added),
+                        "reported": reported,
+                        # Im ersten Zyklus ist alles neu, danach muss jede Note genau einmal gemeldet werden
+                        "ok": metrics["failed"] == 0 and (cycle == 0 or reported == len(added) * users),
+                    }
+                )
+            os.chdir(cwd)
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(cwd)
+        server.shutdown()
+        thread.join()
+    return results
+
+
+def _portal_args(parser) -> None:
+    parser.add_argument("--subjects", type=int, default=14)
+    parser.add_argument("--grades", type=int, default=8)
+    parser.add_argument("--periods", type=int, default=4)
+    parser.add_argument("--current-period", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stray-text", type=float, default=0.0)
+    parser.add_argument("--padding-kb", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Antwortverzögerung des Servers")
+
+
+def _portal_kwargs(args) -> dict:
+    return {
+        "subjects": args.subjects,
+        "grades": args.grades,
+        "periods": args.periods,
+        "current_period": args.current_period,
+        "seed": args.seed,
+        "stray_text": args.stray_text,
+        "padding_kb": args.padding_kb,
+    }
+
+
+def _cmd_page(args) -> int:
+    sys.stdout.write(render_page(new_portal(**_portal_kwargs(args))))
+    return 0
+
+
+def _cmd_serve(args) -> int:
+    server = make_server(
+        new_portal(**_portal_kwargs(args)),
+        port=args.port,
+        mutate_every=args.mutate_every,
+        additions=args.additions,
+        latency=args.latency_ms / 1000,
+        validators=args.validators,
+        compress=args.gzip,
+    )
+    print(f"Portal unter http://localhost:{args.port}/index.html")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _cmd_soak(args) -> int:
+    results = soak(
+        users=args.users,
+        cycles=args.cycles,
+        additions=args.additions,
+        latency=args.latency_ms / 1000,
+        **_portal_kwargs(args),
+    )
+    for row in results:
+        print(
+            f"Zyklus {row['cycle']:3d} {row['seconds'] * 1000:9.1f} ms  ausgewertet {row['parsed']:4d}"
+            f"  unverändert {row['unchanged']:4d}  Noten {row['added']:3d}  gemeldet {row['reported']:5d}"
+            f"  {'ok' if row['ok'] else 'FEHLER'}"
+        )
+    return 0 if all(row["ok"] for row in results) else 1
+
+
+def main_cli(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    page = sub.add_parser("page", help="Eine Seite auf stdout ausgeben")
+    _portal_args(page)
+    page.set_defaults(func=_cmd_page)
+    serve = sub.add_parser("serve", help="Seite für DEBUG_LOCAL ausliefern")
+    _portal_args(serve)
+    serve.add_argument("--port", type=int, default=8000)
+    serve.add_argument("--mutate-every", type=int, default=0)
+    serve.add_argument("--additions", type=int, default=1)
+    serve.add_argument("--validators", action="store_true", help="ETag senden und mit 304 antworten")
+    serve.add_argument("--gzip", action="store_true", help="Seite gzip-komprimiert ausliefern")
+    serve.set_defaults(func=_cmd_serve)
+    soak_cmd = sub.add_parser("soak", help="run_once gegen das generierte Portal laufen lassen")
+    _portal_args(soak_cmd)
+    soak_cmd.add_argument("--users", type=int, default=20)
+    soak_cmd.add_argument("--cycles", type=int, default=10)
+    soak_cmd.add_argument("--additions", type=int, default=2)
+    soak_cmd.set_defaults(func=_cmd_soak)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,273 @@
+"""Per-user poll scheduling for the Noten-Checker.
+
+Each account keeps the timestamps at which new grades showed up. From
+them the scheduler learns the hours of the week in which grades are
+usually entered, polls often there and backs off exponentially in
+between. PollQueue and run_queue poll every account at its own deadline;
+with SimulatedClock a week of scheduling replays in well under a second.
+"""
+import heapq
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+HOURS_PER_WEEK = 7 * 24
+# Nur die jüngsten Änderungen zählen, ältere Schuljahre verblassen so
+DEFAULT_HISTORY = 200
+# Unterhalb dieser Anzahl Änderungen gibt es noch kein verlässliches Muster
+MIN_HISTORY = 5
+# Eine Stunde gilt als aktiv, wenn sie so viel Gewicht hat wie der Durchschnitt mal HOT_FACTOR
+HOT_FACTOR = 2.0
+
+
+def hour_of_week(ts: float) -> int:
+    """Return 0..167 for the local hour of the week (Monday 0:00 is 0)."""
+    moment = datetime.fromtimestamp(ts)
+    return moment.weekday() * 24 + moment.hour
+
+
+def _next_hour_start(ts: float) -> float:
+    moment = datetime.fromtimestamp(ts).replace(minute=0, second=0, microsecond=0)
+    return (moment + timedelta(hours=1)).timestamp()
+
+
+class UserSchedule:
+    """Change history and back-off state of one account."""
+
+    __slots__ = ("changes", "quiet", "failures", "next_run", "_weights")
+
+    def __init__(self, changes: list[float] | None = None, quiet: int = 0, next_run: float = 0.0):
+        self.changes = list(changes or [])
+        self.quiet = quiet
+        self.failures = 0
+        self.next_run = next_run
+        self._weights = None
+
+    def record(self, ts: float, changed: bool, history: int = DEFAULT_HISTORY) -> None:
+        """Note the outcome of a successful poll at ts."""
+        self.failures = 0
+        if changed:
+            self.changes.append(ts)
+            del self.changes[:-history]
+            self.quiet = 0
+            self._weights = None
+        else:
+            self.quiet += 1
+
+    def weights(self) -> list[float]:
+        """Change counts per hour of the week, spread half onto the neighbouring hours."""
+        if self._weights is None:
+            weights = [0.0] * HOURS_PER_WEEK
+            for ts in self.changes:
+                hour = hour_of_week(ts)
+                weights[hour] += 1.0
+                weights[(hour - 1) % HOURS_PER_WEEK] += 0.5
+                weights[(hour + 1) % HOURS_PER_WEEK] += 0.5
+            self._weights = weights
+        return self._weights
+
+    def is_hot(self, ts: float) -> bool:
+        """Return whether grades usually appear in the hour of ts."""
+        if len(self.changes) < MIN_HISTORY:
+            return False
+        expected = 2.0 * len(self.changes) / HOURS_PER_WEEK
+        return self.weights()[hour_of_week(ts)] >= HOT_FACTOR * expected
+
+    def next_hot_start(self, now: float, horizon: float) -> float | None:
+        """Return the start of the next active hour within horizon seconds after now."""
+        if len(self.changes) < MIN_HISTORY:
+            return None
+        start = _next_hour_start(now)
+        while start < now + horizon:
+            if self.is_hot(start):
+                return start
+            start = _next_hour_start(start)
+        return None
+
+    def to_dict(self) -> dict:
+        return {"changes": self.changes, "quiet": self.quiet, "next_run": self.next_run}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserSchedule":
+        return cls(
+            changes=[float(ts) for ts in data.get("changes", [])],
+            quiet=int(data.get("quiet", 0)),
+            next_run=float(data.get("next_run", 0.0)),
+        )
+
+
+def next_interval(
+    schedule: UserSchedule,
+    now: float,
+    min_seconds: float,
+    max_seconds: float,
+    jitter: float = 0.0,
+    rng: random.Random | None = None,
+) -> float:
+    """Seconds until the next poll of one account.
+
+    Active hours use min_seconds. Otherwise every unchanged poll doubles
+    the interval up to max_seconds, but never sleeps past the start of
+    the next active hour. jitter spreads the result by +/- that fraction.
+    """
+    hot = schedule.is_hot(now)
+    if hot:
+        interval = min_seconds
+    else:
+        interval = min(max_seconds, min_seconds * 2 ** min(schedule.quiet, 32))
+    if jitter:
+        interval *= 1 + (rng or random).uniform(-jitter, jitter)
+    if not hot:
+        # Erst nach dem Jitter begrenzen, sonst rutscht der Abruf hinter den Beginn
+        hot_start = schedule.next_hot_start(now, interval)
+        if hot_start is not None:
+            interval = min(interval, hot_start - now)
+    return max(1.0, interval)
+
+
+def retry_delay(failures: int, base_seconds: float, max_seconds: float) -> float:
+    """Delay before retrying after the given number of consecutive failures."""
+    return min(max_seconds, base_seconds * 2 ** min(max(failures - 1, 0), 32))
+
+
+def load_schedules(data: dict) -> dict[str, UserSchedule]:
+    return {name: UserSchedule.from_dict(entry) for name, entry in data.get("users", {}).items()}
+
+
+def dump_schedules(schedules: dict[str, UserSchedule]) -> dict:
+    return {"users": {name: schedule.to_dict() for name, schedule in schedules.items()}}
+
+
+class SystemClock:
+    """Wall-clock time."""
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedClock:
+    """Clock whose sleep() only advances the time; for replaying schedules."""
+
+    __slots__ = ("now", "_lock")
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+        self._lock = threading.Lock()
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            with self._lock:
+                self.now += seconds
+
+
+class RateLimiter:
+    """Token bucket shared by all polls: at most rate requests per second on average.
+
+    reserve() never blocks; it books the tokens and returns how long the
+    caller has to wait, so threads and coroutines can share one limiter.
+    """
+
+    __slots__ = ("rate", "burst", "_tokens", "_stamp", "_lock")
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.burst = max(1.0, burst if burst is not None else rate)
+        self._tokens = self.burst
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: float, now: float) -> float:
+        with self._lock:
+            if self._stamp is not None:
+                self._tokens = min(self.burst, self._tokens + max(0.0, now - self._stamp) * self.rate)
+            self._stamp = now if self._stamp is None else max(self._stamp, now)
+            self._tokens -= cost
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class PollQueue:
+    """Heap of (deadline, account name)."""
+
+    __slots__ = ("_heap", "_seq")
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, str]] = []
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, name: str, deadline: float) -> None:
+        # Die laufende Nummer hält gleich fällige Konten in Einfügereihenfolge
+        heapq.heappush(self._heap, (deadline, self._seq, name))
+        self._seq += 1
+
+    def stagger(self, names: list[str], start: float, interval: float) -> None:
+        """Spread names evenly over one interval starting at start."""
+        step = interval / max(1, len(names))
+        for idx, name in enumerate(names):
+            self.push(name, start + idx * step)
+
+    def next_deadline(self) -> float | None:
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: float) -> list[str]:
+        """Remove and return every name whose deadline is not after now."""
+        return list(self.pop_due_deadlines(now))
+
+    def pop_due_deadlines(self, now: float) -> dict[str, float]:
+        """Like pop_due, but return {name: scheduled deadline}."""
+        due = {}
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, name = heapq.heappop(self._heap)
+            due[name] = deadline
+        return due
+
+
+def run_queue(
+    queue: PollQueue,
+    clock,
+    poll,
+    until: float | None = None,
+    batch_window: float = 0.0,
+    retry_seconds: float = 30.0,
+    retry_max_seconds: float = 3600.0,
+) -> None:
+    """Poll accounts as their deadlines come up until the clock reaches until.
+
+    poll(due) gets {name: scheduled deadline} of the accounts to poll and
+    returns {name: next deadline}; accounts missing from the result are
+    dropped. Deadlines within batch_window seconds of the first due one are
+    polled together. If poll raises, the batch is queued again after
+    retry_delay(), so no account is lost.
+    """
+    failures: dict[str, int] = {}
+    while len(queue) and (until is None or clock.time() < until):
+        deadline = queue.next_deadline()
+        now = clock.time()
+        if deadline > now:
+            clock.sleep(deadline - now if until is None else min(deadline, until) - now)
+            continue
+        due = queue.pop_due_deadlines(now + batch_window)
+        try:
+            next_runs = poll(due)
+        except Exception:
+            logging.exception("Abruf von %s fehlgeschlagen", ", ".join(due))
+            retry_at = clock.time()
+            for name in due:
+                failures[name] = failures.get(name, 0) + 1
+                queue.push(name, retry_at + retry_delay(failures[name], retry_seconds, retry_max_seconds))
+            continue
+        for name in due:
+            failures.pop(name, None)
+        for name, next_run in next_runs.items():
+            queue.push(name, next_run)
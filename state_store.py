@@ -0,0 +1,230 @@
+"""SQLite state store for the Noten-Checker.
+
+Instead of rewriting two JSON files per user and cycle, the stored grade
+state is split into one row per account, per subject and per subject
+period. stage() compares a user's new state with the rows it already
+knows and queues only the rows that differ; commit() writes everything
+queued in one transaction. Accounts are read on first use, so startup
+time does not grow with the number of accounts.
+
+Import existing status files with:
+    python state_store.py import [--db grades.sqlite3] [old_grades_*.json ...]
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+DEFAULT_DB_FILE = "grades.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    account TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS subjects (
+    account TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (account, subject)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS periods (
+    account TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    period INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (account, subject, period)
+) WITHOUT ROWID;
+"""
+
+# Schlüssel eines Fachs, die zu einem Halbjahr gehören (wie in main.SubjectGrades)
+_PERIOD_KEY_RE = re.compile(r"^H(\d+)(Exams|Grades|GradesAverage|Average|FinalGrade)$")
+
+_UPSERT = {
+    "report": "INSERT OR REPLACE INTO reports (account, data) VALUES (?, ?)",
+    "subject": "INSERT OR REPLACE INTO subjects (account, subject, position, data) VALUES (?, ?, ?, ?)",
+    "period": "INSERT OR REPLACE INTO periods (account, subject, period, data) VALUES (?, ?, ?, ?)",
+}
+_DELETE = {
+    "report": "DELETE FROM reports WHERE account = ?",
+    "subject": "DELETE FROM subjects WHERE account = ? AND subject = ?",
+    "period": "DELETE FROM periods WHERE account = ? AND subject = ? AND period = ?",
+}
+
+
+def _dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+def split_report(data: dict) -> dict[tuple, tuple]:
+    """Split one status dict into {row key: row values}.
+
+    Keys are ("report",), ("subject", name) and ("period", name, number);
+    the values are the non-key columns of the row.
+    """
+    rows: dict[tuple, tuple] = {("report",): (_dump({k: v for k, v in data.items() if k != "subjects"}),)}
+    for position, (subject, info) in enumerate((data.get("subjects") or {}).items()):
+        own: dict = {}
+        periods: dict[int, dict] = {}
+        for key, value in (info or {}).items():
+            match = _PERIOD_KEY_RE.match(key)
+            if match:
+                periods.setdefault(int(match.group(1)), {})[match.group(2)] = value
+            else:
+                own[key] = value
+        rows[("subject", subject)] = (position, _dump(own))
+        for number, fields in periods.items():
+            rows[("period", subject, number)] = (_dump(fields),)
+    return rows
+
+
+def join_rows(rows: dict[tuple, tuple]) -> dict | None:
+    """Inverse of split_report; None if the account has no report row."""
+    report = rows.get(("report",))
+    if report is None:
+        return None
+    data = json.loads(report[0])
+    subjects = sorted((values[0], key[1], values[1]) for key, values in rows.items() if key[0] == "subject")
+    data["subjects"] = {name: json.loads(text) for _, name, text in subjects}
+    for key, values in rows.items():
+        if key[0] == "period" and key[1] in data["subjects"]:
+            info = data["subjects"][key[1]]
+            for field, value in json.loads(values[0]).items():
+                info[f"H{key[2]}{field}"] = value
+    return data
+
+
+class StateStore:
+    """Grade state of all accounts in one SQLite database (WAL mode)."""
+
+    __slots__ = ("path", "_conn", "_lock", "_rows", "_staged")
+
+    def __init__(self, path: str = DEFAULT_DB_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Im WAL-Modus bleibt die Datenbank auch mit NORMAL nach einem Absturz konsistent
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # Zuletzt gelesene oder geschriebene Zeilen je Konto, Grundlage für den Vergleich
+        self._rows: dict[str, dict[tuple, tuple]] = {}
+        self._staged: list[tuple[str, tuple]] = []
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def accounts(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT account FROM reports ORDER BY account")]
+
+    def _read_rows(self, account: str) -> dict[tuple, tuple]:
+        rows = self._rows.get(account)
+        if rows is not None:
+            return rows
+        rows = {}
+        for (data,) in self._conn.execute("SELECT data FROM reports WHERE account = ?", (account,)):
+            rows[("report",)] = (data,)
+        for subject, position, data in self._conn.execute(
+            "SELECT subject, position, data FROM subjects WHERE account = ?", (account,)
+        ):
+            rows[("subject", subject)] = (position, data)
+        for subject, period, data in self._conn.execute(
+            "SELECT subject, period, data FROM periods WHERE account = ?", (account,)
+        ):
+            rows[("period", subject, period)] = (data,)
+        self._rows[account] = rows
+        return rows
+
+    def load(self, account: str) -> dict | None:
+        """Return the stored status dict of one account, or None if there is none."""
+        with self._lock:
+            return join_rows(self._read_rows(account))
+
+    def stage(self, account: str, data: dict) -> int:
+        """Queue the rows of account that differ from data; return how many."""
+        new_rows = split_report(data)
+        with self._lock:
+            old_rows = self._read_rows(account)
+            changes = [
+                ("upsert", (key[0], (account, *key[1:], *values)))
+                for key, values in new_rows.items()
+                if old_rows.get(key) != values
+            ]
+            changes += [("delete", (key[0], (account, *key[1:]))) for key in old_rows if key not in new_rows]
+            # Innerhalb eines Kontos ist jeder Schlüssel eindeutig; sortiert fasst commit() mehr zusammen
+            changes.sort(key=lambda change: (change[0], change[1][0]))
+            self._staged.extend(changes)
+            self._rows[account] = new_rows
+        return len(changes)
+
+    def commit(self) -> int:
+        """Write all staged rows in one transaction; return the number of rows written."""
+        with self._lock:
+            staged, self._staged = self._staged, []
+            if not staged:
+                return 0
+            # Aufeinanderfolgende gleiche Anweisungen gebündelt, Reihenfolge bleibt erhalten
+            batches: list[tuple[str, list[tuple]]] = []
+            for op, (kind, params) in staged:
+                sql = _UPSERT[kind] if op == "upsert" else _DELETE[kind]
+                if batches and batches[-1][0] == sql:
+                    batches[-1][1].append(params)
+                else:
+                    batches.append((sql, [params]))
+            try:
+                with self._conn:
+                    for sql, params in batches:
+                        self._conn.executemany(sql, params)
+            except sqlite3.Error:
+                # Beim nächsten commit() erneut versuchen
+                self._staged = staged + self._staged
+                raise
+            return len(staged)
+
+
+def account_from_path(path: str) -> str:
+    """Account key of an old_grades_<Name>.json file."""
+    name = os.path.basename(path)
+    if name.startswith("old_grades_"):
+        name = name[len("old_grades_"):]
+    return name[:-5] if name.endswith(".json") else name
+
+
+def import_json_files(store: StateStore, paths: list[str]) -> dict[str, int]:
+    """Copy old_grades_*.json files into store; return the rows written per account."""
+    written = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            written[account_from_path(path)] = store.stage(account_from_path(path), data)
+    store.commit()
+    return written
+
+
+def main_cli(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    importer = sub.add_parser("import", help="old_grades_*.json in die Datenbank übernehmen")
+    importer.add_argument("files", nargs="*")
+    importer.add_argument("--db", default=os.getenv("STATE_DB_FILE", DEFAULT_DB_FILE))
+    args = parser.parse_args(argv)
+    paths = args.files or sorted(glob.glob("old_grades_*.json"))
+    store = StateStore(args.db)
+    try:
+        for account, rows in import_json_files(store, paths).items():
+            print(f"{account:30} {rows:6d} Zeilen")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,111 @@
+import math
+import random
+import sys
+import pathlib
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import analytics  # noqa: E402
+import grade_history  # noqa: E402
+from grade_history import GradeEvent  # noqa: E402
+
+DAY = 24 * 3600
+START = datetime(2025, 9, 1).timestamp()
+BACKENDS = [False, pytest.param(True, marks=pytest.mark.skipif(analytics.np is None, reason="NumPy fehlt"))]
+
+
+def small_history() -> list[GradeEvent]:
+    events = []
+    for day, grade, average in ((0, "10", 10.0), (30, "12", 11.0), (60, "14", 12.0)):
+        events.append(GradeEvent(START + day * DAY, "Anna", "Mathe", 1, "grade", grade, None, average))
+    events.append(GradeEvent(START + 150 * DAY, "Anna", "Mathe", 2, "exam", "8", 12.0, 8.0))
+    events.append(GradeEvent(START + 10 * DAY, "Ben", "Mathe", 1, "grade", "2-", None, 6.0))
+    events.append(GradeEvent(START + 20 * DAY, "Ben", "Mathe", 1, "grade", "6", 6.0, 6.0))
+    events.append(GradeEvent(START + 25 * DAY, "Ben", "Physik", 0, "average", None, 9.0, 9.5))
+    return events
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_statistics_on_a_small_history(use_numpy):
+    columns = analytics.GradeColumns.from_events(small_history(), use_numpy=use_numpy)
+    assert columns.numpy is use_numpy
+    assert len(columns) == 7
+
+    slopes = analytics.trends(columns)
+    assert set(slopes) == {("Anna", "Mathe"), ("Ben", "Mathe")}
+    assert slopes[("Ben", "Mathe")] == pytest.approx(0.0)
+
+    assert analytics.rolling_averages(columns, window=2) == {("Anna", "Mathe"): 11.0, ("Ben", "Mathe"): 6.0}
+    assert analytics.rolling_averages(columns, window=10)[("Anna", "Mathe")] == pytest.approx(11.0)
+    assert analytics.period_deltas(columns) == {("Anna", "Mathe"): [(1, 2, -4.0)]}
+
+    summary = analytics.cohort_summary(columns)
+    assert summary["Mathe"] == {
+        "accounts": 2,
+        "grades": 5,
+        "mean_grade": 10.0,
+        "mean_average": 7.0,
+        "min_average": 6.0,
+        "max_average": 8.0,
+    }
+    assert summary["Physik"]["accounts"] == 1 and summary["Physik"]["grades"] == 0
+    assert summary["Physik"]["mean_average"] == 9.5
+
+
+def random_history(events: int, seed: int = 5) -> list[GradeEvent]:
+    rng = random.Random(seed)
+    result = []
+    for i in range(events):
+        kind = rng.choice(grade_history.KINDS)
+        result.append(
+            GradeEvent(
+                START + i * 600 + rng.random(),
+                f"U{rng.randrange(40)}",
+                f"Fach {rng.randrange(12)}",
+                rng.randint(1, 4),
+                kind,
+                None if kind == "average" else rng.choice([str(rng.randint(0, 15)), "2+"]),
+                None,
+                rng.choice([None, round(rng.uniform(0, 15), 2)]),
+            )
+        )
+    return result
+
+
+def assert_close(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert_close(a[key], b[key])
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_close(x, y)
+    elif isinstance(a, float):
+        assert math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    else:
+        assert a == b
+
+
+def test_numpy_and_array_columns_agree():
+    pytest.importorskip("numpy")
+    events = random_history(20000)
+    vectorised = analytics.GradeColumns.from_events(events, use_numpy=True)
+    plain = analytics.GradeColumns.from_events(events, use_numpy=False)
+    for func in (analytics.trends, analytics.rolling_averages, analytics.period_deltas, analytics.cohort_summary):
+        assert_close(func(vectorised), func(plain))
+
+
+def test_report_cli_reads_history(tmp_path, capsys):
+    grade_history.GradeHistory(str(tmp_path)).append(small_history())
+    assert analytics.main_cli(["report", "--dir", str(tmp_path), "--since", "2025-09-01", "--user", "Anna"]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "7 Ereignisse, 2 Benutzer, 2 Fächer"
+    assert out[1].startswith("Anna") and "H1->H2 -4,00" in out[1]
+    assert not any(line.startswith("Ben") for line in out)
+    assert any(line.startswith("Physik") for line in out)
+    columns = analytics.load_columns(grade_history.GradeHistory(str(tmp_path)), start=START + 20 * DAY)
+    assert len(columns) == 5
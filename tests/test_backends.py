@@ -0,0 +1,145 @@
+import importlib
+import os
+import re
+import sys
+import pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+
+SYNTHETIC_PAGES = {
+    "stray_text": """
+    <table id='student_main_grades_table_1'><tbody>
+    <tr><td>Mathe</td><td>1</td><td></td><td>2</td>1<td>3,0</td><td class='final_average'>4,0</td></tr>
+    </tbody></table>
+    """,
+    "grouped_overview": """
+    <table id='student_main_grades_table_all'>
+    <thead><tr>
+    <th class='fixed_1'></th>
+    <th class='text-center' colspan='3'>1. Halbjahr | N1 Ø 11,50</th>
+    <th class='text-center' colspan='4'>2. Halbjahr | N2 Ø 12,00</th>
+    </tr></thead>
+    <tbody><tr>
+    <td>Mathe</td>
+    <td>12</td><td>12,00</td><td class='final_average'>12,75</td>
+    <td>13</td><td>13,00</td><td class='final_average'>12,75</td><td class='final_average'>12,00</td>
+    </tr></tbody></table>
+    """,
+    "final_grades_only": """
+    <table id='student_main_grades_table_1'><tbody></tbody></table>
+    <table id='student_main_grades_table_2'><tbody>
+    <tr><td>Skikurs</td><td></td><td></td><td></td><td></td><td class='final_average'></td><td class='final_average'></td></tr>
+    </tbody></table>
+    <div id='student_final_grades_container_1'><table><tbody>
+    <tr>
+    <td>Skikurs</td>
+    <td class='score_display display_avg'>-1,00</td><td class='score_display display_final_grade'></td>
+    <td class='score_display display_avg'>13,50</td><td class='score_display display_final_grade'>15</td>
+    </tr>
+    <tbody></table></div>
+    """,
+}
+
+
+def setup_env(monkeypatch):
+    for key in list(os.environ):
+        if re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+", key):
+            monkeypatch.setenv(key, "")
+    monkeypatch.setenv("USER1", "Test")
+    monkeypatch.setenv("USERNAME1", "u")
+    monkeypatch.setenv("PASSWORD1", "p")
+    monkeypatch.setenv("DISCORD_TOKEN", "t")
+    monkeypatch.setenv("DISCORD_CHANNEL_ID", "1")
+    monkeypatch.delenv("DEBUG_LOCAL", raising=False)
+    import main
+    importlib.reload(main)
+    import bench
+    return main, bench
+
+
+@pytest.mark.parametrize("fixture", ["index.html", "res_example.txt"])
+def test_backends_agree_on_captured_pages(monkeypatch, fixture):
+    main, bench = setup_env(monkeypatch)
+    html = open(fixture, encoding="utf-8").read()
+    results = bench.compare_backends(html)
+    assert "html.parser" in results
+    assert bench.backend_mismatches(results) == []
+    for name, (data, seconds) in results.items():
+        assert data["subjects"]
+        assert seconds > 0
+        print(f"{fixture} {name}: {seconds * 1000:.1f} ms")
+
+
+@pytest.mark.parametrize("name", sorted(SYNTHETIC_PAGES))
+def test_backends_agree_on_synthetic_pages(monkeypatch, name):
+    main, bench = setup_env(monkeypatch)
+    results = bench.compare_backends(SYNTHETIC_PAGES[name])
+    assert bench.backend_mismatches(results) == []
+
+
+def test_unknown_backend_falls_back_to_html_parser(monkeypatch):
+    main, _ = setup_env(monkeypatch)
+    assert main._resolve_parser_backend("does-not-exist") == "html.parser"
+    assert main._resolve_parser_backend("auto") == main.available_parser_backends()[0]
+
+
+def test_synthetic_page_matches_requested_scale(monkeypatch):
+    main, bench = setup_env(monkeypatch)
+    html = bench.synthetic_page(5, 3)
+    data = main.parse_grades(html)
+    assert len(data["subjects"]) == 5
+    assert data["PeriodLabels"] == ["H1", "H2", "H3", "H4"]
+    assert len(data["subjects"]["Deutsch Kurs 1 (erh. Niveau)"]["H1Grades"]) <= 3
+    assert main._stream_grade_tables(html) is not None
+    assert bench.backend_mismatches(bench.compare_backends(html)) == []
+
+
+def test_suite_reports_and_detects_regressions(monkeypatch):
+    main, bench = setup_env(monkeypatch)
+    results = bench.run_suite({"small": bench.synthetic_page(3, 2)}, repeat=1)
+    assert set(results) == {
+        f"small/{case}"
+        for case in (
+            "parse_grades",
+            "_has_grade_markup",
+            "_collect_subject_messages",
+            "_Outbox.add",
+            "_write_json_file",
+        )
+    }
+    for values in results.values():
+        assert values["seconds"] >= 0
+        assert values["peak_kb"] >= 0
+    assert bench.regressions(results, results) == []
+    slower = {key: dict(values, seconds=values["seconds"] / 2) for key, values in results.items()}
+    found = bench.regressions(results, slower, threshold=0.25)
+    assert any(line.startswith("small/parse_grades seconds") for line in found)
+
+
+def test_suite_fails_without_baseline(monkeypatch, tmp_path):
+    main, bench = setup_env(monkeypatch)
+    results = {"page/parse_grades": {"seconds": 0.001, "allocations": 1, "alloc_kb": 1.0, "peak_kb": 1.0}}
+    monkeypatch.setattr(bench, "run_suite", lambda pages, repeat: results)
+    baseline = tmp_path / "baseline.json"
+
+    def suite(*extra):
+        return bench.main_cli(["suite", "--scale", "1x1", "--baseline", str(baseline), *extra])
+
+    assert suite() == 2
+    baseline.write_text("{kaputt", encoding="utf-8")
+    assert suite() == 2
+    assert suite("--update-baseline") == 0
+    assert suite() == 0
+    # Eine Baseline, die keine der gemessenen Seiten kennt, vergleicht nichts
+    baseline.write_text('{"andere/parse_grades": {"seconds": 1}}', encoding="utf-8")
+    assert suite() == 2
+
+
+def test_meta_charset_decoding_matches_detection(monkeypatch):
+    main, bench = setup_env(monkeypatch)
+    with open("index.html", "rb") as f:
+        results = bench.compare_decoding(f.read(), repeat=1)
+    assert results["meta"][0] == results["detect"][0]
@@ -0,0 +1,145 @@
+import importlib
+import json
+import os
+import random
+import re
+import sys
+import pathlib
+import time
+from datetime import datetime
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import grade_history  # noqa: E402
+from grade_history import GradeEvent  # noqa: E402
+
+# Schuljahr 2025/26
+YEAR_START = datetime(2025, 8, 1).timestamp()
+YEAR_END = datetime(2026, 8, 1).timestamp()
+
+
+def school_year(users: int, subjects: int, per_subject: int, seed: int = 1) -> list[GradeEvent]:
+    rng = random.Random(seed)
+    events = []
+    for _ in range(users * subjects * per_subject):
+        user = f"U{rng.randrange(users)}"
+        subject = f"Fach {rng.randrange(subjects)}"
+        before = rng.choice([None, round(rng.uniform(5, 15), 2)])
+        events.append(
+            GradeEvent(0.0, user, subject, rng.randint(1, 2), rng.choice(grade_history.KINDS), str(rng.randint(0, 15)), before, 11.5)
+        )
+    times = sorted(rng.uniform(YEAR_START, YEAR_END) for _ in events)
+    return [event._replace(ts=ts) for event, ts in zip(events, times)]
+
+
+def test_queries_match_full_scan_across_segments(tmp_path):
+    events = school_year(users=10, subjects=6, per_subject=20)
+    history = grade_history.GradeHistory(str(tmp_path / "h"), segment_bytes=8 * 1024)
+    for start in range(0, len(events), 7):
+        history.append(events[start:start + 7])
+    assert history.segments() > 5
+
+    winter = (datetime(2025, 11, 1).timestamp(), datetime(2026, 2, 1).timestamp())
+    for reopened in (history, grade_history.GradeHistory(str(tmp_path / "h"), segment_bytes=8 * 1024)):
+        assert list(reopened.query("U3", "Fach 2")) == [e for e in events if e.user == "U3" and e.subject == "Fach 2"]
+        assert list(reopened.query("U3", "Fach 2", *winter)) == [
+            e for e in events if e.user == "U3" and e.subject == "Fach 2" and winter[0] <= e.ts < winter[1]
+        ]
+        assert list(reopened.query("U4", start=winter[0])) == [e for e in events if e.user == "U4" and e.ts >= winter[0]]
+        assert list(reopened.query("Niemand")) == []
+
+
+def test_torn_record_is_cut_off_on_open(tmp_path):
+    history = grade_history.GradeHistory(str(tmp_path))
+    event = GradeEvent(YEAR_START, "Test", "Mathe", 1, "grade", "12", None, 12.0)
+    history.append([event, event._replace(kind="average", value=None, average_before=12.0, average_after=12.5)])
+    segment = tmp_path / "00000001.seg"
+    size = segment.stat().st_size
+    with open(segment, "ab") as f:
+        f.write(grade_history._encode(event)[:-3])
+
+    reopened = grade_history.GradeHistory(str(tmp_path))
+    assert segment.stat().st_size == size
+    assert [e.kind for e in reopened.query("Test", "Mathe")] == ["grade", "average"]
+    reopened.append([event])
+    assert len(list(grade_history.GradeHistory(str(tmp_path)).query("Test"))) == 3
+
+
+def test_school_year_range_query_is_fast(tmp_path):
+    events = school_year(users=200, subjects=12, per_subject=12)
+    history = grade_history.GradeHistory(str(tmp_path))
+    history.append(events)
+    assert history.segments() > 1
+    start = time.perf_counter()
+    found = list(history.query("U7", "Fach 3", YEAR_START, YEAR_END))
+    elapsed = time.perf_counter() - start
+    assert found == [e for e in events if e.user == "U7" and e.subject == "Fach 3"]
+    print(f"{len(events)} Ereignisse, Abfrage {elapsed * 1000:.1f} ms")
+    assert elapsed < 0.5
+
+
+def test_run_once_records_detected_changes(monkeypatch, tmp_path):
+    for key in list(os.environ):
+        if re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+", key):
+            monkeypatch.setenv(key, "")
+    monkeypatch.setenv("USER1", "Test")
+    monkeypatch.setenv("USERNAME1", "u")
+    monkeypatch.setenv("PASSWORD1", "p")
+    monkeypatch.setenv("DISCORD_TOKEN", "t")
+    monkeypatch.setenv("DISCORD_CHANNEL_ID", "1")
+    monkeypatch.setenv("GRADE_HISTORY_DIR", str(tmp_path / "verlauf"))
+    monkeypatch.delenv("DEBUG_LOCAL", raising=False)
+    import main as m
+    importlib.reload(m)
+    monkeypatch.chdir(tmp_path)
+    m.old_data = {
+        "Test": {
+            "PeriodLabels": ["H1"],
+            "subjects": {
+                "Mathe": {"H1Grades": ["10"], "H1Exams": [], "CurrentPeriodAverage": 10.0},
+                "Physik": {"H1Grades": ["9"], "H1Exams": [], "CurrentPeriodAverage": 9.0},
+            },
+        }
+    }
+    new = json.loads(json.dumps(m.old_data["Test"]))
+    new["subjects"]["Mathe"].update(H1Grades=["10", "14"], H1Exams=["13"], CurrentPeriodAverage=12.5)
+    new["subjects"]["Physik"]["CurrentPeriodAverage"] = 9.5
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: new)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+
+    before = time.time()
+    m.run_once()
+
+    events = list(grade_history.GradeHistory(str(tmp_path / "verlauf")).query("Test", start=before))
+    assert [(e.subject, e.period, e.kind, e.value, e.average_before, e.average_after) for e in events] == [
+        ("Mathe", 1, "grade", "14", 10.0, 12.5),
+        ("Mathe", 1, "exam", "13", 10.0, 12.5),
+        ("Physik", 0, "average", None, 9.0, 9.5),
+    ]
+
+
+def test_first_poll_writes_no_events(monkeypatch, tmp_path):
+    for key in list(os.environ):
+        if re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+", key):
+            monkeypatch.setenv(key, "")
+    monkeypatch.setenv("USER1", "Test")
+    monkeypatch.setenv("USERNAME1", "u")
+    monkeypatch.setenv("PASSWORD1", "p")
+    monkeypatch.setenv("DISCORD_TOKEN", "t")
+    monkeypatch.setenv("DISCORD_CHANNEL_ID", "1")
+    monkeypatch.setenv("GRADE_HISTORY_DIR", str(tmp_path / "verlauf"))
+    monkeypatch.delenv("DEBUG_LOCAL", raising=False)
+    import main as m
+    importlib.reload(m)
+    monkeypatch.chdir(tmp_path)
+    m.old_data = {}
+    data = {
+        "PeriodLabels": ["H1"],
+        "subjects": {"Mathe": {"H1Grades": ["10", "14"], "H1Exams": ["13"], "CurrentPeriodAverage": 12.0}},
+    }
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: data)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+
+    assert m.run_once()["parsed"] == 1
+    # Vorhandene Noten sind beim ersten Abruf nicht neu aufgetaucht
+    assert list(grade_history.GradeHistory(str(tmp_path / "verlauf")).query("Test")) == []
@@ -0,0 +1,167 @@
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+ENV_FILE = "USER1=Test\nUSERNAME1=u\nPASSWORD1=p\nDISCORD_TOKEN=t\nDISCORD_CHANNEL_ID=1\n"
+
+
+def clear_user_env(monkeypatch):
+    for key in list(os.environ):
+        if re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+", key):
+            monkeypatch.setenv(key, "")
+
+
+def unset_env_file_keys(monkeypatch):
+    # load_dotenv setzt nur fehlende Variablen; so räumt monkeypatch sie wieder ab
+    for key in ("USER1", "USERNAME1", "PASSWORD1", "DISCORD_TOKEN", "DISCORD_CHANNEL_ID"):
+        monkeypatch.setenv(key, "")
+        monkeypatch.delenv(key)
+
+
+@pytest.fixture
+def main_module():
+    import main
+
+    yield main
+    importlib.reload(main)
+
+
+def test_import_has_no_side_effects(tmp_path):
+    (tmp_path / ".env").write_text(ENV_FILE, encoding="utf-8")
+    env = {k: v for k, v in os.environ.items() if not re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+|DISCORD_\w+", k)}
+    env.update(PYTHONPATH=str(ROOT), STATE_BACKEND="sqlite")
+    script = (
+        "import json, logging, os, sys, main\n"
+        "print(json.dumps({'modules': sorted(m for m in ('bs4', 'requests', 'aiohttp', 'asyncio', 'dotenv')"
+        " if m in sys.modules), 'handlers': len(logging.getLogger().handlers),"
+        " 'users': main.USERS, 'token': os.getenv('DISCORD_TOKEN')}))"
+    )
+    proc = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=env, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert json.loads(proc.stdout) == {"modules": [], "handlers": 0, "users": [], "token": None}
+    assert [p.name for p in tmp_path.iterdir()] == [".env"]
+
+
+def test_import_leaves_heavy_dependencies_unloaded():
+    # Die Zeit selbst misst `python bench.py import`; hier nur, was sie bestimmt
+    heavy = ("requests", "urllib3", "bs4", "lxml", "aiohttp", "yarl", "numpy", "asyncio", "dotenv", "analytics")
+    script = f"import json, sys, main; print(json.dumps([m for m in {heavy!r} if m in sys.modules]))"
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    proc = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    assert json.loads(proc.stdout) == []
+
+
+def test_grade_checker_with_explicit_config(main_module, monkeypatch, tmp_path):
+    m = main_module
+    monkeypatch.chdir(tmp_path)
+    config = m.Config(
+        {},
+        USERS=[{"name": "Test", "username": "u", "password": "p"}],
+        DISCORD_TOKEN="t",
+        DISCORD_CHANNEL_ID="1",
+        GRADE_HISTORY_DIR="",
+    )
+    data = m.parse_grades((ROOT / "index.html").read_text(encoding="utf-8"))
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: data)
+    sent = []
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: sent.append(msg) or True)
+
+    checker = m.GradeChecker(config)
+    assert checker.run_once()["parsed"] == 1
+    assert m.USERS is config.USERS and m.DISCORD_CHANNEL_ID == "1"
+    assert sent and (tmp_path / "old_grades_Test.json").exists()
+    # Ein zweiter Lauf kennt den Stand schon
+    sent.clear()
+    checker.run_once()
+    assert sent == []
+
+    with pytest.raises(ValueError, match="DISCORD_TOKEN"):
+        m.GradeChecker(m.Config({}, USERS=config.USERS)).run_once()
+    with pytest.raises(TypeError):
+        m.Config({}, UNBEKANNT=1)
+
+
+def test_grade_checker_reads_env_file_on_first_use(main_module, monkeypatch, tmp_path):
+    clear_user_env(monkeypatch)
+    unset_env_file_keys(monkeypatch)
+    m = importlib.reload(main_module)
+    assert m.USERS == []
+    (tmp_path / "noten.env").write_text(ENV_FILE, encoding="utf-8")
+
+    checker = m.GradeChecker(env_file=str(tmp_path / "noten.env"))
+    assert os.getenv("DISCORD_TOKEN") is None
+    assert checker.config.USERS == [{"name": "Test", "username": "u", "password": "p"}]
+    assert checker.config.DISCORD_TOKEN == "t"
+    # Erst ein Lauf macht die Konfiguration zur aktiven
+    assert m.USERS == []
+
+
+def test_second_checker_starts_without_state_of_the_first(main_module, monkeypatch, tmp_path):
+    m = main_module
+    monkeypatch.chdir(tmp_path)
+    data = m.parse_grades((ROOT / "index.html").read_text(encoding="utf-8"))
+    sessions = []
+
+    def fake_fetch(username, password, session=None, **kwargs):
+        sessions.append(session)
+        m._page_validators[kwargs["account"]] = ("fp", {"If-None-Match": "x"})
+        return data
+
+    monkeypatch.setattr(m, "fetch_html", fake_fetch)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+
+    def checker(concurrency, *names):
+        users = [{"name": name, "username": name.lower(), "password": "p"} for name in names]
+        return m.GradeChecker(
+            m.Config({}, USERS=users, DISCORD_TOKEN="t", DISCORD_CHANNEL_ID="1", GRADE_HISTORY_DIR="", POLL_CONCURRENCY=concurrency)
+        )
+
+    checker(1, "Anna").run_once()
+    first_pool = m._transport
+    assert m._host_slot(m._poll_host())._initial_value == 1
+    assert list(m._sessions) == ["Anna"] and "Anna" in m._page_validators
+
+    checker(5, "Ben", "Cem").run_once()
+    assert m._host_slot(m._poll_host())._initial_value == 5
+    assert sorted(m._sessions) == ["Ben", "Cem"]
+    assert "Anna" not in m._page_validators
+    assert m._transport is not first_pool and m._transport._pool_maxsize == 6
+    assert sessions[0] not in sessions[1:]
+
+
+def test_async_engine_inside_running_loop(main_module, monkeypatch, tmp_path):
+    import asyncio
+
+    m = main_module
+    monkeypatch.chdir(tmp_path)
+    data = m.parse_grades((ROOT / "index.html").read_text(encoding="utf-8"))
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: data)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+    config = m.Config(
+        {},
+        USERS=[{"name": "Test", "username": "u", "password": "p"}],
+        DISCORD_TOKEN="t",
+        DISCORD_CHANNEL_ID="1",
+        GRADE_HISTORY_DIR="",
+        POLL_ENGINE="async",
+        ASYNC_HTTP_CLIENT="executor",
+    )
+    checker = m.GradeChecker(config)
+
+    async def embedded():
+        with pytest.raises(RuntimeError, match="run_once_async"):
+            checker.run_once()
+        return await checker.run_once_async()
+
+    assert asyncio.run(embedded())["parsed"] == 1
+    assert (tmp_path / "old_grades_Test.json").exists()
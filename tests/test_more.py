@@ -4,6 +4,8 @@ from datetime import datetime
 from bs4 import BeautifulSoup
 import os
 import re
+import threading
+import time
 import sys
 import pathlib
 import pytest
@@ -18,6 +20,15 @@ def clear_user_env(monkeypatch):
 
 
 
+@pytest.fixture(params=["threads", "async"])
+def engine(request, monkeypatch):
+    monkeypatch.setenv("POLL_ENGINE", request.param)
+    # Die Tests ersetzen fetch_html und _send_discord_message; aiohttp würde
+    # beide umgehen
+    monkeypatch.setenv("ASYNC_HTTP_CLIENT", "executor")
+    return request.param
+
+
 def setup_basic_env(monkeypatch):
     clear_user_env(monkeypatch)
     monkeypatch.setenv("USER1", "Test")
@@ -250,6 +261,133 @@ def test_collect_messages_keeps_real_half_year_number(monkeypatch):
     assert any("Zeugnisnote (HJ2)" in msg for msg in msgs)
 
 
+def test_parse_grades_accepts_parsed_document(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    html = open("index.html", encoding="utf-8").read()
+    soup = BeautifulSoup(html, "html.parser")
+    assert m.parse_grades(soup) == m.parse_grades(html)
+
+
+def test_fetch_html_parses_grades_page_once(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.setenv("DEBUG_LOCAL", "true")
+    importlib.reload(m)
+    html = open("index.html", encoding="utf-8").read()
+
+    class DummyResp:
+        status_code = 200
+        text = html
+
+    class DummySession:
+        def get(self, url, **kwargs):
+            return DummyResp()
+
+    monkeypatch.setattr(m, "HTML_PARSER", "html.parser")
+    documents = []
+    import bs4
+
+    real_soup = bs4.BeautifulSoup
+
+    def counting_soup(markup, *args, **kwargs):
+        if isinstance(markup, str) and len(markup) > 1000:
+            documents.append(markup)
+        return real_soup(markup, *args, **kwargs)
+
+    monkeypatch.setattr(bs4, "BeautifulSoup", counting_soup)
+    data = m.fetch_html("", "", session=DummySession())
+    assert data["subjects"]
+    assert len(documents) == 1
+
+
+def test_slice_grade_regions_keeps_only_grade_containers(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    html = """
+    <html><head><script>var t = '<table id="student_main_grades_table_9">';</script></head>
+    <body>
+    <div id='student_calendar_container_1'><table><tr><td>Termin</td></tr></table></div>
+    <table id='student_main_grades_table_1'><tbody>
+    <tr><td>Mathe</td><td><table><tr><td>x</td></tr></table></td></tr>
+    </tbody></table>
+    <div id='student_final_grades_container_1'>
+    <!-- <div id='alt'> -->
+    <div><table><tbody><tr><td>Mathe</td></tr><tbody></table></div>
+    </div>
+    <div id='student_webinfo_container_1'>Info</div>
+    </body></html>
+    """
+    regions = m._slice_grade_regions(html)
+    assert "student_main_grades_table_1" in regions
+    assert regions.count("student_final_grades_container_1") == 1
+    assert "Termin" not in regions
+    assert "Info" not in regions
+    assert regions.rstrip().endswith("</div></div>")
+
+
+def test_slice_grade_regions_without_grade_markup(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    assert m._slice_grade_regions("<html>Bitte erneut anmelden</html>") == ""
+    assert m._slice_grade_regions("<table id='student_main_grades_table_1'><tr>") is None
+
+
+@pytest.mark.parametrize("fixture", ["index.html", "res_example.txt"])
+def test_region_parse_matches_full_document(monkeypatch, fixture):
+    m = setup_basic_env(monkeypatch)
+    html = open(fixture, encoding="utf-8").read()
+    full = m.parse_grades(BeautifulSoup(html, "html.parser"))
+    assert m.parse_grades(html) == full
+    assert len(m._slice_grade_regions(html)) * 5 < len(html)
+
+
+@pytest.mark.parametrize("fixture", ["index.html", "res_example.txt"])
+def test_stream_extractor_matches_tree_extraction(monkeypatch, fixture):
+    m = setup_basic_env(monkeypatch)
+    html = open(fixture, encoding="utf-8").read()
+    soup_tables = m._soup_grade_tables(BeautifulSoup(html, "html.parser"))
+    assert m._stream_grade_tables(html) == soup_tables
+    assert m._stream_grade_tables(m._slice_grade_regions(html)) == soup_tables
+    assert m.parse_grades(html, backend="stream") == m.parse_grades(html, backend="html.parser")
+
+
+def test_stream_extractor_rejects_nested_tables(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    html = """
+    <table id='student_main_grades_table_1'><tbody>
+    <tr><td>Mathe</td><td><table><tr><td>1</td></tr></table></td><td class='final_average'>4,0</td></tr>
+    </tbody></table>
+    """
+    assert m._stream_grade_tables(html) is None
+    assert m._stream_grade_tables("<table id='student_main_grades_table_1'><tbody><tr><td>x") is None
+    assert m.parse_grades(html, backend="stream") == m.parse_grades(html, backend="html.parser")
+
+
+def test_table_cache_reparses_only_changed_tables(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    html = open("index.html", encoding="utf-8").read()
+    reference = m.parse_grades(html)
+
+    assert m.parse_grades(html, cache_key="u") == reference
+    assert m.table_cache_stats["misses"] == 6
+    assert m.parse_grades(html, cache_key="u") == reference
+    assert m.table_cache_stats["hits"] == 6
+
+    start = html.index('id="student_main_grades_table_2"')
+    changed = html[:start] + html[start:].replace("<td></td>", "<td>7</td>", 1)
+    parsed = m.parse_grades(changed, cache_key="u")
+    assert parsed == m.parse_grades(changed)
+    assert parsed != reference
+    assert m.table_cache_stats["misses"] == 7
+    assert m.table_cache_stats["hits"] == 11
+
+
+def test_table_cache_is_bounded(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.setattr(m, "TABLE_CACHE_USERS", 2)
+    html = "<table id='student_main_grades_table_1'><tbody><tr><td>Mathe</td></tr></tbody></table>"
+    for key in ("a", "b", "c"):
+        m.parse_grades(html, cache_key=key)
+    assert list(m._table_cache) == ["b", "c"]
+
+
 def test_list_diff_insertion(monkeypatch):
     m = setup_basic_env(monkeypatch)
     old = ["10", "9"]
@@ -264,10 +402,11 @@ def test_check_env_missing(monkeypatch):
     monkeypatch.setenv("PASSWORD1", "p")
     monkeypatch.setenv("DISCORD_CHANNEL_ID", "")
     monkeypatch.setenv("DISCORD_TOKEN", "t")
-    importlib.invalidate_caches()
     import main
+    # Der Import selbst prüft nichts mehr
+    importlib.reload(main)
     with pytest.raises(SystemExit):
-        importlib.reload(main)
+        main.check_env()
 
 
 def test_load_json_file_corrupt_returns_empty(monkeypatch, tmp_path):
@@ -385,7 +524,7 @@ def test_fetch_html_rejects_unexpected_account_page(monkeypatch):
     assert m.fetch_html("u", "p", session=DummySession()) is None
 
 
-def test_run_once_keeps_failed_discord_subject_pending(monkeypatch, tmp_path):
+def test_run_once_keeps_failed_discord_subject_pending(monkeypatch, tmp_path, engine):
     m = setup_basic_env(monkeypatch)
     monkeypatch.chdir(tmp_path)
 
@@ -405,19 +544,892 @@ def test_run_once_keeps_failed_discord_subject_pending(monkeypatch, tmp_path):
     }
     m.USERS[:] = [{"name": "Test", "username": "u", "password": "p"}]
     m.old_data = {"Test": old}
-    monkeypatch.setattr(m, "fetch_html", lambda username, password, session=None: new_data)
+
+    fetches = []
+    monkeypatch.setattr(
+        m, "fetch_html", lambda username, password, session=None, **kwargs: fetches.append(username) or new_data
+    )
 
     sent = []
     def fake_send(msg):
         sent.append(msg)
         return "Mathe" in msg
+    # Eine Nachricht je Fach, damit nur Physik fehlschlägt
+    monkeypatch.setattr(m, "DISCORD_PACK_MESSAGES", False)
     monkeypatch.setattr(m, "_send_discord_message", fake_send)
     monkeypatch.setattr(m.time, "sleep", lambda _: None)
+    monkeypatch.setattr(m, "DISCORD_MESSAGE_DELAY_SECONDS", 0)
+    monkeypatch.setattr(m, "OUTBOX_RETRY_SECONDS", 3600)
 
     m.run_once()
 
+    # Der Stand ist sofort fortgeschrieben, Physik wartet in der Outbox
     stored = json.loads((tmp_path / "old_grades_Test.json").read_text(encoding="utf-8"))
-    assert stored["subjects"]["Mathe"]["H1Grades"] == ["12"]
-    assert stored["subjects"]["Physik"]["H1Grades"] == []
+    assert stored == new_data
     assert json.loads((tmp_path / "grades_Test.json").read_text(encoding="utf-8")) == new_data
     assert len(sent) == 2
+    assert [entry["subject"] for entry in m._discord_outbox().pending("Test")] == ["Physik"]
+    assert m._discord_dispatcher.deliver_due() == 0
+
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: sent.append(msg) or True)
+    assert m._discord_dispatcher.deliver_due(m.time.time() + 3600) == 1
+    assert "Physik" in sent[-1]
+    assert fetches == ["u"]
+    assert len(m._discord_outbox()) == 0
+    assert not (tmp_path / "discord_outbox.jsonl").exists()
+
+
+def test_outbox_replays_undelivered_entries_after_restart(monkeypatch, tmp_path):
+    monkeypatch.setenv("OUTBOX_FILE", str(tmp_path / "outbox.jsonl"))
+    m = setup_basic_env(monkeypatch)
+    first = m._discord_outbox().add("Test", [("Mathe", "m"), ("Physik", "p")])
+    second = m._discord_outbox().add("Zweiter", [("Chemie", "c")])
+    m._discord_outbox().done([first[0]])
+    # Absturz mitten im Schreiben einer Zeile
+    with open(tmp_path / "outbox.jsonl", "a", encoding="utf-8") as f:
+        f.write('{"op": "done", "id": ')
+
+    importlib.reload(m)
+    assert [(e["id"], e["subject"]) for e in m._discord_outbox().pending()] == [(first[1], "Physik"), (second[0], "Chemie")]
+    assert m._discord_outbox().add("Test", [("Bio", "b")]) == [second[0] + 1]
+    m._discord_outbox().done([first[1], second[0], second[0] + 1])
+    assert not (tmp_path / "outbox.jsonl").exists()
+
+
+def test_outbox_backs_off_and_compacts(monkeypatch, tmp_path):
+    monkeypatch.setenv("OUTBOX_FILE", str(tmp_path / "outbox.jsonl"))
+    monkeypatch.setenv("OUTBOX_RETRY_SECONDS", "10")
+    m = setup_basic_env(monkeypatch)
+    [entry_id] = m._discord_outbox().add("Test", [("Mathe", "m")])
+    assert [e["id"] for e in m._discord_outbox().claim(100.0)] == [entry_id]
+    assert m._discord_outbox().claim(100.0) == []
+    delays = []
+    for now in (100.0, 200.0, 300.0):
+        m._discord_outbox().retry([entry_id], now)
+        delays.append(m._discord_outbox().next_due() - now)
+        assert m._discord_outbox().claim(now) == []
+        m._discord_outbox().claim(m._discord_outbox().next_due())
+    assert delays == [10.0, 20.0, 40.0]
+
+    for i in range(m._Outbox.COMPACT_LINES):
+        m._discord_outbox().done(m._discord_outbox().add("Test", [(f"Fach {i}", "x")]))
+    lines = (tmp_path / "outbox.jsonl").read_text(encoding="utf-8").splitlines()
+    assert len(lines) < 10
+    assert json.loads(lines[0])["id"] == entry_id
+
+
+def test_run_once_returns_when_outbox_journal_fails(monkeypatch, tmp_path, engine):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    m.USERS[:] = [{"name": "Test", "username": "u", "password": "p"}]
+    m.old_data = {"Test": {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": []}}}}
+    new = {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": ["12"]}}}
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: new)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+
+    def failing_done(self, ids):
+        raise OSError("Datenträger voll")
+
+    monkeypatch.setattr(m._Outbox, "done", failing_done)
+    result = []
+    worker = threading.Thread(target=lambda: result.append(m.run_once()), daemon=True)
+    worker.start()
+    worker.join(10)
+    assert result, "run_once hängt"
+    # Der Eintrag ist wieder freigegeben und kommt später erneut
+    [entry] = m._discord_outbox().pending("Test")
+    assert not entry["claimed"] and entry["failures"] == 1
+
+
+def test_run_once_does_not_wait_forever_for_discord(monkeypatch, tmp_path):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    m.old_data = {"Test": {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": []}}}}
+    new = {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": ["12"]}}}
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: new)
+    monkeypatch.setattr(m, "_base_interval_seconds", lambda: 0.2)
+    release = threading.Event()
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: release.wait(10))
+    try:
+        started = time.monotonic()
+        assert m.run_once()["parsed"] == 1
+        assert time.monotonic() - started < 5
+        # Die Meldung hängt noch in der Zustellung und bleibt im Journal
+        assert len(m._discord_outbox()) == 1
+    finally:
+        release.set()
+    assert m._discord_dispatcher.flush(timeout=10)
+
+
+def test_one_failing_user_does_not_abort_the_cycle(monkeypatch, tmp_path, engine):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    m.USERS[:] = [{"name": name, "username": name.lower(), "password": "p"} for name in ("Anna", "Ben")]
+    m.old_data = {name: {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": []}}} for name in ("Anna", "Ben")}
+    new = {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": ["12"]}}}
+    failed = []
+
+    def fetch(username, *args, **kwargs):
+        if username == "anna":
+            raise KeyError("Parserfehler")
+        return new
+
+    monkeypatch.setattr(m, "fetch_html", fetch)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+
+    def note(user, changed, now=None):
+        if changed is None:
+            failed.append(user["name"])
+
+    monkeypatch.setattr(m, "_note_poll_outcome", note)
+
+    metrics = m.run_once()
+    assert metrics["failed"] == 1 and metrics["parsed"] == 1
+    assert failed == ["Anna"]
+    assert (tmp_path / "old_grades_Ben.json").exists()
+    assert not (tmp_path / "old_grades_Anna.json").exists()
+
+
+def test_async_engine_writes_state_off_the_event_loop(monkeypatch, tmp_path):
+    import asyncio
+
+    monkeypatch.setenv("POLL_ENGINE", "async")
+    monkeypatch.setenv("ASYNC_HTTP_CLIENT", "executor")
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    m.old_data = {"Test": {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": []}}}}
+    new = {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": ["12"]}}}
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: new)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+    on_loop = []
+    for name in ("_store_poll_result", "_settle", "_finish_cycle"):
+        original = getattr(m, name)
+
+        def wrapped(*args, _original=original, _name=name):
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(_name)
+            except RuntimeError:
+                pass
+            return _original(*args)
+
+        monkeypatch.setattr(m, name, wrapped)
+
+    assert m.run_once()["parsed"] == 1
+    assert on_loop == []
+    assert m._discord_outbox().pending("Test") == []
+
+
+def test_grade_fingerprint_ignores_form_tokens(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    html = open("index.html", encoding="utf-8").read()
+    marker = "<table id=\"student_main_grades_table_1\""
+    with_token = html.replace(
+        marker,
+        "<input type='hidden' name='_nonce' value='abc'>" + marker.replace("<table", "<table nonce='n1'"),
+        1,
+    )
+    other_token = with_token.replace("value='abc'", "value='xyz'").replace("nonce='n1'", "nonce='n2'")
+    assert m._grade_fingerprint(with_token) == m._grade_fingerprint(other_token)
+    assert m._grade_fingerprint(html) != m._grade_fingerprint(html.replace("<td>12,67</td>", "<td>12,68</td>", 1))
+    assert m._grade_fingerprint("<html>Login</html>") is None
+
+
+def test_fetch_html_returns_unchanged_for_known_fingerprint(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.setattr(m, "DEBUG_LOCAL", True)
+    html = open("index.html", encoding="utf-8").read()
+
+    class DummyResp:
+        status_code = 200
+        text = html
+
+    class DummySession:
+        def get(self, url, **kwargs):
+            return DummyResp()
+
+    data = m.fetch_html("", "", session=DummySession())
+    assert data["Fingerprint"] == m._grade_fingerprint(html)
+    monkeypatch.setattr(m, "parse_grades", lambda *a, **k: pytest.fail("parsed unchanged page"))
+    assert m.fetch_html("", "", session=DummySession(), previous_fingerprint=data["Fingerprint"]) is m.UNCHANGED
+
+
+def test_run_once_skips_unchanged_users(monkeypatch, tmp_path, engine):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    m.USERS[:] = [{"name": "Test", "username": "u", "password": "p"}]
+    m.old_data = {"Test": {"subjects": {}, "Fingerprint": "abc"}}
+    seen = []
+
+    def fake_fetch(username, password, session=None, previous_fingerprint=None, **kwargs):
+        seen.append(previous_fingerprint)
+        return m.UNCHANGED
+
+    monkeypatch.setattr(m, "fetch_html", fake_fetch)
+    monkeypatch.setattr(m, "diff_reports", lambda *a, **k: pytest.fail("diffed unchanged page"))
+
+    metrics = m.run_once()
+
+    assert seen == ["abc"]
+    assert metrics["unchanged"] == 1
+    assert m.cycle_metrics["unchanged"] >= 1
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("fixture", ["index.html", "res_example.txt"])
+def test_grade_report_roundtrip(monkeypatch, fixture):
+    m = setup_basic_env(monkeypatch)
+    html = open(fixture, encoding="utf-8").read()
+    data = m.parse_grades(html)
+    report = m.parse_grade_report(html)
+    assert report.to_dict() == data
+    assert m.GradeReport.from_dict(json.loads(json.dumps(data))).to_dict() == data
+
+
+def test_grade_report_keeps_unknown_keys(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    stored = {
+        "subjects": {"Mathe": {"H1Grades": ["12"], "Kommentar": "x"}},
+        "Fingerprint": "abc",
+        "Extra": 1,
+    }
+    report = m.GradeReport.from_dict(stored)
+    assert report.fingerprint == "abc"
+    assert report.known_period_numbers() == [1]
+    data = report.to_dict()
+    assert data["Extra"] == 1
+    assert data["subjects"]["Mathe"]["Kommentar"] == "x"
+
+
+def test_grade_model_uses_slots(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    report = m.parse_grade_report(open("index.html", encoding="utf-8").read())
+    subject = next(iter(report.subjects.values()))
+    period = next(iter(subject.periods.values()))
+    for obj in (report, subject, period):
+        assert not hasattr(obj, "__dict__")
+    with pytest.raises(AttributeError):
+        period.comment = "x"
+
+
+def test_diff_reports_returns_typed_change_set(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    old = {
+        "subjects": {
+            "Mathe": {"H1Grades": ["12"], "H1Exams": [], "CurrentPeriodAverage": 12.0},
+            "Deutsch": {"H1Grades": ["9"], "H1Exams": [], "CurrentPeriodAverage": 9.0},
+        },
+        "PeriodLabels": ["H1"],
+    }
+    new = json.loads(json.dumps(old))
+    new["subjects"]["Mathe"]["H1Grades"].append("14")
+    new["subjects"]["Mathe"]["H1FinalGrade"] = 13
+    new["subjects"]["Mathe"]["CurrentPeriodAverage"] = 13.0
+    changes = m.diff_reports(new, old)
+    assert [change.subject for change in changes] == ["Mathe"]
+    change = changes[0]
+    assert change.added_grades == [(1, "14")]
+    assert change.added_exams == []
+    assert change.final_grades == [(1, 13)]
+    assert change.average_changed and change.grade_related
+    messages = m.render_changes("Test", changes)
+    assert messages[0][0] == "Mathe"
+    assert "Neue Note in Mathe (H1): 14 Damit stehst du aktuell bei 13,00" in messages[0][1]
+    assert "Zeugnisnote (HJ1) in Mathe steht fest: 13" in messages[0][1]
+
+
+def test_diff_reports_skips_unchanged_subjects_by_fingerprint(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    report = m.parse_grade_report(open("index.html", encoding="utf-8").read())
+    same = m.GradeReport.from_dict(report.to_dict())
+    compared = []
+    monkeypatch.setattr(m, "_list_diff", lambda old, new: compared.append(new) or [])
+    # Gleiche Fächer werden über den Fingerprint übersprungen, ohne Listenvergleich
+    assert m.diff_reports(same, report) == []
+    assert compared == []
+
+
+def test_diff_reports_sees_changes_after_fingerprinting(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    report = m.parse_grade_report(open("index.html", encoding="utf-8").read())
+    changed = m.GradeReport.from_dict(report.to_dict())
+    assert m.diff_reports(changed, report) == []
+    name, subject = next((name, s) for name, s in changed.subjects.items() if s.periods)
+    number = min(subject.periods)
+    subject.periods[number].grades.append("15")
+    [change] = m.diff_reports(changed, report)
+    assert change.subject == name and change.added_grades == [(number, "15")]
+
+
+def test_list_diff_keeps_multiset_semantics(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    assert m._list_diff(["1", "2"], ["1", "2", "2"]) == ["2"]
+    assert m._list_diff(["2", "1"], ["1", "2", "2"]) == ["2"]
+    assert m._list_diff(None, ["3"]) == ["3"]
+    assert m._list_diff(["3"], []) == []
+
+
+def test_run_once_polls_users_concurrently_within_host_cap(monkeypatch, tmp_path, engine):
+    import threading
+    import time as time_module
+
+    monkeypatch.setenv("POLL_CONCURRENCY", "3")
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    m.USERS[:] = [{"name": f"U{i}", "username": f"u{i}", "password": "p"} for i in range(9)]
+    m.old_data = {}
+
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def fake_fetch(username, password, session=None, **kwargs):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time_module.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return {"PeriodLabels": ["H1"], "subjects": {"Mathe": {"H1Grades": [username]}}}
+
+    monkeypatch.setattr(m, "fetch_html", fake_fetch)
+    sent = []
+    handler_threads = set()
+
+    def fake_send(msg):
+        handler_threads.add(threading.current_thread().name)
+        sent.append(msg)
+        return True
+
+    monkeypatch.setattr(m, "_send_discord_message", fake_send)
+    monkeypatch.setattr(m, "DISCORD_MESSAGE_DELAY_SECONDS", 0)
+
+    start = time_module.perf_counter()
+    metrics = m.run_once()
+    elapsed = time_module.perf_counter() - start
+
+    assert active[1] == 3
+    assert elapsed < 9 * 0.05
+    assert metrics["parsed"] == 9
+    if engine == "threads":
+        # Zugestellt wird nacheinander vom Dispatcher-Thread
+        assert handler_threads == {"discord"}
+    for i in range(9):
+        stored = json.loads((tmp_path / f"old_grades_U{i}.json").read_text(encoding="utf-8"))
+        assert stored["subjects"]["Mathe"]["H1Grades"] == [f"u{i}"]
+        assert any(f"[U{i}] Neue Note in Mathe (H1): u{i}" in msg for msg in sent)
+
+
+class PortalResp:
+    def __init__(self, text="", status=200, url=""):
+        self.text = text
+        self.status_code = status
+        self.url = url
+
+
+class PortalSession:
+    """Fake portal that forgets the login after `valid_gets` account requests."""
+
+    def __init__(self, html, valid_gets=1000):
+        self.headers = {}
+        self.cookies = {}
+        self.calls = []
+        self.html = html
+        self.logged_in = False
+        self.session_gets = valid_gets
+        self.valid_gets = valid_gets
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def get(self, url, **kwargs):
+        self.calls.append("get " + url.rsplit("/webinfo", 1)[-1])
+        if "account" not in url:
+            return PortalResp('<input name="_nonce" value="x"><input name="_f_secure" value="y">', url=url)
+        if not self.logged_in or self.valid_gets <= 0:
+            self.logged_in = False
+            return PortalResp("<form>Login</form>", url="https://100308.fuxnoten.online/webinfo/")
+        self.valid_gets -= 1
+        return PortalResp(self.html, url=url)
+
+    def post(self, url, data=None, allow_redirects=True, **kwargs):
+        self.calls.append("post")
+        self.logged_in = True
+        self.valid_gets = self.session_gets
+        return PortalResp("", url="https://100308.fuxnoten.online/webinfo/account/")
+
+
+def test_fetch_html_reuses_logged_in_session(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    session = PortalSession(open("index.html", encoding="utf-8").read())
+    session.logged_in = True
+    data = m.fetch_html("u", "p", session=session, logged_in=True)
+    assert data["subjects"]
+    assert session.calls == ["get /account/"]
+
+
+def test_fetch_html_relogs_in_after_redirect_to_login(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    session = PortalSession(open("index.html", encoding="utf-8").read())
+    data = m.fetch_html("u", "p", session=session, logged_in=True)
+    assert data["subjects"]
+    assert session.calls == ["get /account/", "get ", "post", "get /account/"]
+    assert m.session_stats["expired"] == 1
+
+
+def test_run_once_keeps_sessions_between_cycles(monkeypatch, tmp_path, engine):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    html = open(pathlib.Path(__file__).resolve().parents[1] / "index.html", encoding="utf-8").read()
+    sessions = []
+
+    def make_session():
+        sessions.append(PortalSession(html, valid_gets=2))
+        return sessions[-1]
+
+    import requests
+
+    monkeypatch.setattr(requests, "Session", make_session)
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+    monkeypatch.setattr(m, "DISCORD_MESSAGE_DELAY_SECONDS", 0)
+    m.USERS[:] = [{"name": "Test", "username": "u", "password": "p"}]
+    m.old_data = {}
+
+    for _ in range(4):
+        m.run_once()
+
+    assert len(sessions) == 1
+    assert sessions[0].calls == [
+        "get ", "post", "get /account/",  # erster Login
+        "get /account/",  # wiederverwendet
+        "get /account/", "get ", "post", "get /account/",  # abgelaufen, neu angemeldet
+        "get /account/",
+    ]
+
+
+def test_session_cookies_survive_restart(monkeypatch, tmp_path):
+    monkeypatch.setenv("SESSION_COOKIE_DIR", str(tmp_path / "cookies"))
+    m = setup_basic_env(monkeypatch)
+    user = {"name": "Test Nutzer", "username": "u", "password": "p"}
+    entry = m._user_session(user)
+    assert entry["logged_in"] is False
+    entry["session"].cookies.set("PHPSESSID", "abc", domain="100308.fuxnoten.online", path="/")
+    m._save_session_cookies(entry, user["name"])
+    path = tmp_path / "cookies" / "cookies_Test_Nutzer.json"
+    assert oct(path.stat().st_mode & 0o777) == "0o600"
+
+    importlib.reload(m)
+    restored = m._user_session(user)
+    assert restored["logged_in"] is True
+    assert restored["session"].cookies.get("PHPSESSID") == "abc"
+
+
+def test_aiohttp_sessions_share_the_cookie_files(monkeypatch, tmp_path):
+    pytest.importorskip("aiohttp")
+    import asyncio
+
+    monkeypatch.setenv("SESSION_COOKIE_DIR", str(tmp_path / "cookies"))
+    m = setup_basic_env(monkeypatch)
+    user = {"name": "Test", "username": "u", "password": "p"}
+    entry = m._user_session(user)
+    entry["session"].cookies.set("PHPSESSID", "abc", domain="100308.fuxnoten.online", path="/")
+    entry["session"].cookies.set("lang", "de", domain=".fuxnoten.online", path="/", expires=int(time.time()) + 3600)
+    m._save_session_cookies(entry, user["name"])
+    saved = json.loads((tmp_path / "cookies" / "cookies_Test.json").read_text())
+
+    async def restore():
+        restored = m._async_user_session(user)
+        cookies = m._dump_aiohttp_cookies(restored["session"])
+        await restored["session"].close()
+        return restored["logged_in"], cookies
+
+    logged_in, cookies = asyncio.run(restore())
+    assert logged_in is True
+    key = lambda cookie: cookie["name"]  # noqa: E731
+    assert sorted(cookies, key=key) == sorted(saved, key=key)
+
+
+def test_async_discord_session_is_separate_from_the_portal(monkeypatch):
+    pytest.importorskip("aiohttp")
+    import asyncio
+
+    m = setup_basic_env(monkeypatch)
+
+    async def sessions():
+        portal = m._async_user_session({"name": "Test"})["session"]
+        discord = m._async_discord_api()
+        result = dict(discord.headers), discord.connector is portal.connector
+        m._reset_connections()
+        await asyncio.sleep(0)
+        return result
+
+    headers, shared = asyncio.run(sessions())
+    assert headers == {"Authorization": "Bot t"}
+    assert not shared
+
+
+def test_portal_and_discord_share_keep_alive_pool(monkeypatch, tmp_path, engine):
+    import threading
+    import portal_generator
+
+    server = portal_generator.make_server(portal_generator.new_portal(subjects=4, grades=3), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://localhost:{server.server_address[1]}/index.html"
+        monkeypatch.setenv("DEBUG_LOCAL_URL", url)
+        monkeypatch.setenv("POLL_CONCURRENCY", "2")
+        m = setup_basic_env(monkeypatch)
+        monkeypatch.setenv("DEBUG_LOCAL", "true")
+        importlib.reload(m)
+        monkeypatch.chdir(tmp_path)
+        m.USERS[:] = [{"name": f"U{i}", "username": f"u{i}", "password": ""} for i in range(4)]
+        m.old_data = {}
+        monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+        monkeypatch.setattr(m, "DISCORD_MESSAGE_DELAY_SECONDS", 0)
+
+        for _ in range(3):
+            m.run_once()
+        assert m._discord_http().get_adapter("https://discord.com") is m._shared_adapter()
+    finally:
+        server.shutdown()
+        thread.join()
+
+    stats = m.transport_stats()
+    assert stats["requests"] == 12
+    assert stats["connections"] <= 3
+    assert stats["reuse_ratio"] >= 0.75
+
+
+def test_fetch_html_async_matches_sync_on_debug_local_server(monkeypatch):
+    import asyncio
+    import threading
+    import portal_generator
+
+    server = portal_generator.make_server(portal_generator.new_portal(subjects=5, grades=4), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        monkeypatch.setenv("DEBUG_LOCAL_URL", f"http://localhost:{server.server_address[1]}/index.html")
+        m = setup_basic_env(monkeypatch)
+        monkeypatch.setenv("DEBUG_LOCAL", "true")
+        importlib.reload(m)
+        expected = m.fetch_html("", "")
+        assert asyncio.run(m.fetch_html_async("", "")) == expected
+        assert asyncio.run(m.fetch_html_async("", "", previous_fingerprint=expected["Fingerprint"])) is m.UNCHANGED
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def test_aiohttp_engine_polls_debug_local_server(monkeypatch, tmp_path):
+    pytest.importorskip("aiohttp")
+    import threading
+    import portal_generator
+
+    server = portal_generator.make_server(portal_generator.new_portal(subjects=5, grades=4), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        monkeypatch.setenv("DEBUG_LOCAL_URL", f"http://localhost:{server.server_address[1]}/index.html")
+        monkeypatch.setenv("POLL_ENGINE", "async")
+        m = setup_basic_env(monkeypatch)
+        monkeypatch.setenv("DEBUG_LOCAL", "true")
+        importlib.reload(m)
+        monkeypatch.chdir(tmp_path)
+        m.USERS[:] = [{"name": f"U{i}", "username": f"u{i}", "password": ""} for i in range(3)]
+        m.old_data = {}
+        sent = []
+
+        async def fake_send(msg):
+            sent.append(msg)
+            return True
+
+        monkeypatch.setattr(m, "_send_discord_message_async", fake_send)
+        monkeypatch.setattr(m, "DISCORD_MESSAGE_DELAY_SECONDS", 0)
+
+        first = m.run_once()
+        second = m.run_once()
+        expected = m.fetch_html("", "")
+    finally:
+        server.shutdown()
+        thread.join()
+
+    assert first["parsed"] == 3
+    assert second["unchanged"] == 3
+    assert sent
+    for i in range(3):
+        stored = json.loads((tmp_path / f"old_grades_U{i}.json").read_text(encoding="utf-8"))
+        assert stored == json.loads(json.dumps(expected))
+
+
+class StreamResp:
+    def __init__(self, body: bytes, chunk_size: int = 4096):
+        self.status_code = 200
+        self.encoding = "utf-8"
+        self.body = body
+        self.chunk = chunk_size
+        self.sent = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        while self.sent < len(self.body):
+            chunk = self.body[self.sent:self.sent + self.chunk]
+            self.sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize("chunk_size", [509, 4096, 65536])
+def test_region_scanner_matches_grade_regions(monkeypatch, chunk_size):
+    m = setup_basic_env(monkeypatch)
+    html = open("index.html", encoding="utf-8").read()
+    tricky = (
+        "<script>var t = '<table id=\"student_main_grades_table_9\">';</script>"
+        "<!-- <div id='student_final_grades_container_0'> -->" + html
+    )
+    for page in (html, tricky):
+        scanner = m._GradeRegionScanner()
+        for start in range(0, len(page), chunk_size):
+            scanner.feed(page[start:start + chunk_size])
+        regions, _ = scanner.result()
+        assert scanner.done
+        assert regions == m._grade_regions(page)
+
+
+def test_region_scanner_falls_back_on_truncated_page(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    html = open("index.html", encoding="utf-8").read()
+    scanner = m._GradeRegionScanner()
+    scanner.feed(html[:40000])
+    regions, fallback = scanner.result()
+    assert regions is None
+    assert "student_main_grades_table_1" in fallback
+
+
+def test_streamed_page_stops_after_final_container(monkeypatch):
+    import portal_generator
+
+    m = setup_basic_env(monkeypatch)
+    page = portal_generator.portal_page(6, 4) + "<div>" + "x" * 200_000 + "</div>"
+    resp = StreamResp(page.encode("utf-8"))
+    data = m._evaluate_response(resp, None, "Test", "Notenübersicht")
+    assert resp.closed
+    assert resp.sent < len(resp.body) - 150_000
+    assert data == m._evaluate_grade_page(page)
+
+
+def test_streamed_page_over_size_limit_is_rejected(monkeypatch, caplog):
+    import portal_generator
+
+    monkeypatch.setenv("MAX_PAGE_BYTES", "10000")
+    m = setup_basic_env(monkeypatch)
+    resp = StreamResp(portal_generator.portal_page(6, 4, padding_kb=64).encode("utf-8"))
+    with caplog.at_level("ERROR"):
+        assert m._evaluate_response(resp, None, "Test", "Notenübersicht") is None
+    assert resp.closed
+    assert resp.sent <= 10000 + resp.chunk
+    assert "größer als 10000 Bytes" in caplog.text
+
+
+def test_page_encoding_comes_from_header_meta_or_config(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    latin = "<html><head><meta charset='iso-8859-1'></head><td>Französisch</td></html>".encode("latin-1")
+    assert "Französisch" in m._decode_page(latin)
+    assert "Französisch" in m._decode_page(latin, "text/html; charset=ISO-8859-1")
+    # Kein charset im Header und kein <meta>: UTF-8 statt ISO-8859-1
+    assert m._decode_page("<td>Französisch</td>".encode("utf-8"), "text/html") == "<td>Französisch</td>"
+    monkeypatch.setattr(m, "PAGE_ENCODING", "cp1252")
+    assert "Französisch" in m._decode_page("<td>Französisch</td>".encode("cp1252"), "text/html; charset=utf-8")
+
+
+def test_fetch_paths_never_sniff_the_charset(monkeypatch):
+    import portal_generator
+
+    m = setup_basic_env(monkeypatch)
+    page = portal_generator.portal_page(4, 3).replace("<meta charset='utf-8'>", "<meta charset='iso-8859-1'>")
+    body = page.encode("latin-1")
+
+    class BytesResp(StreamResp):
+        headers = {"Content-Type": "text/html"}
+        content = body
+
+        @property
+        def text(self):
+            raise AssertionError("resp.text würde den Zeichensatz erraten")
+
+    expected = m._evaluate_grade_page(page)
+    assert m._evaluate_response(BytesResp(body, chunk_size=100), None, None, "Notenübersicht") == expected
+    monkeypatch.setattr(m, "STREAM_GRADES_PAGE", False)
+    assert m._evaluate_response(BytesResp(body), None, None, "Notenübersicht") == expected
+
+
+def _serve_portal(**server_kwargs):
+    import threading
+    import portal_generator
+
+    state = portal_generator.new_portal(subjects=5, grades=4, padding_kb=32)
+    server = portal_generator.make_server(state, port=0, **server_kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return state, server, thread
+
+
+def test_conditional_compressed_fetch_counts_bytes(monkeypatch):
+    import portal_generator
+
+    state, server, thread = _serve_portal(validators=True, compress=True)
+    try:
+        monkeypatch.setenv("DEBUG_LOCAL_URL", f"http://localhost:{server.server_address[1]}/index.html")
+        m = setup_basic_env(monkeypatch)
+        monkeypatch.setenv("DEBUG_LOCAL", "true")
+        importlib.reload(m)
+        first = m.fetch_html("u", "")
+        traffic = m.poll_traffic.pop("u")
+        assert 0 < traffic["wire_bytes"] < traffic["decoded_bytes"] / 3
+
+        assert m.fetch_html("u", "", previous_fingerprint=first["Fingerprint"]) is m.UNCHANGED
+        traffic = m.poll_traffic.pop("u")
+        assert traffic["not_modified"] == 1
+        assert traffic["wire_bytes"] == traffic["decoded_bytes"] == 0
+
+        # Ohne passenden gespeicherten Stand wird nicht bedingt gefragt
+        assert m.fetch_html("u", "", previous_fingerprint="anders")["Fingerprint"] == first["Fingerprint"]
+        with server.state_lock:
+            portal_generator.mutate(state, 1)
+        changed = m.fetch_html("u", "", previous_fingerprint=first["Fingerprint"])
+        assert changed["Fingerprint"] != first["Fingerprint"]
+    finally:
+        server.shutdown()
+        thread.join()
+    assert m.traffic_stats["not_modified"] == 1
+    assert m.traffic_stats["requests"] == 4
+
+
+def test_aiohttp_fetch_answers_304_with_unchanged(monkeypatch):
+    pytest.importorskip("aiohttp")
+    import asyncio
+
+    state, server, thread = _serve_portal(validators=True)
+    try:
+        monkeypatch.setenv("DEBUG_LOCAL_URL", f"http://localhost:{server.server_address[1]}/index.html")
+        m = setup_basic_env(monkeypatch)
+        monkeypatch.setenv("DEBUG_LOCAL", "true")
+        importlib.reload(m)
+
+        async def poll_twice():
+            async with m._aiohttp_session() as session:
+                first = await m.fetch_html_async("u", "", session=session)
+                second = await m.fetch_html_async("u", "", session=session, previous_fingerprint=first["Fingerprint"])
+            await m._async_connector.close()
+            return first, second
+
+        first, second = asyncio.run(poll_twice())
+    finally:
+        server.shutdown()
+        thread.join()
+    assert first["subjects"]
+    assert second is m.UNCHANGED
+    assert m.poll_traffic["u"]["not_modified"] == 1
+
+
+def test_debug_users_without_username_keep_their_own_traffic(monkeypatch, tmp_path):
+    state, server, thread = _serve_portal(validators=True)
+    try:
+        monkeypatch.setenv("DEBUG_LOCAL_URL", f"http://localhost:{server.server_address[1]}/index.html")
+        m = setup_basic_env(monkeypatch)
+        monkeypatch.setenv("DEBUG_LOCAL", "true")
+        importlib.reload(m)
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(m, "GRADE_HISTORY_DIR", "")
+        monkeypatch.setattr(m, "_send_discord_message", lambda msg: True)
+        users = [{"name": name, "username": None, "password": None} for name in ("Anna", "Ben")]
+        first = m.run_once(users)
+        second = m.run_once(users)
+    finally:
+        server.shutdown()
+        thread.join()
+    assert first["requests"] == 2 and m.poll_traffic == {}
+    assert sorted(m._page_validators) == ["Anna", "Ben"]
+    # Jedes Konto fragt mit seinen eigenen Validatoren bedingt nach
+    assert second["not_modified"] == 2
+
+
+def test_pack_messages_respects_discord_limit(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    items = [(f"Fach{i}", f"[Test] Neue Note in Fach{i} (H1): {i}\n" + "x" * 300) for i in range(20)]
+    items.append(("Lang", "\n".join("y" * 150 for _ in range(30))))
+    packed = m.pack_messages(items)
+    assert all(len(content) <= 2000 for content, _ in packed)
+    assert len(packed) < len(items) // 2
+    assert sum(keys == {"Lang"} for _, keys in packed) >= 2
+    assert "\n\n".join(content for content, _ in packed).replace("\n", "") == "".join(
+        text for _, text in items
+    ).replace("\n", "")
+    monkeypatch.setattr(m, "DISCORD_PACK_MESSAGES", False)
+    assert [keys for _, keys in m.pack_messages(items[:3])] == [{"Fach0"}, {"Fach1"}, {"Fach2"}]
+
+
+def test_discord_send_follows_rate_limit_bucket(monkeypatch):
+    m = setup_basic_env(monkeypatch)
+    sleeps = []
+    clock = [1000.0]
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(m.time, "sleep", fake_sleep)
+    monkeypatch.setattr(m.time, "time", lambda: clock[0])
+
+    class Resp:
+        def __init__(self, status, headers, text=""):
+            self.status_code = status
+            self.headers = headers
+            self.text = text
+
+    responses = [
+        Resp(200, {"X-RateLimit-Remaining": "1", "X-RateLimit-Reset-After": "2.5"}),
+        Resp(200, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": "2.0"}),
+        Resp(429, {"Retry-After": "1.5"}, '{"retry_after": 1.25}'),
+        Resp(429, {}, '{"retry_after": 0.5}'),
+        Resp(200, {"X-RateLimit-Remaining": "4", "X-RateLimit-Reset-After": "5"}),
+    ]
+
+    class Http:
+        def post(self, url, **kwargs):
+            return responses.pop(0)
+
+    monkeypatch.setattr(m, "_discord_http", Http)
+    assert m._send_discord_message("a")
+    assert m._send_discord_message("b")
+    assert sleeps == []
+    # Bucket leer: vor der dritten Nachricht bis zum Reset warten, 429 zweimal abwarten
+    assert m._send_discord_message("c")
+    assert sleeps == [2.0, 1.25, 0.5]
+    assert responses == []
+
+
+def test_forty_notifications_are_packed_without_fixed_sleeps(monkeypatch, tmp_path, engine):
+    m = setup_basic_env(monkeypatch)
+    monkeypatch.chdir(tmp_path)
+    subjects = {
+        f"Fach {i} Leistungskurs (erhöhtes Anforderungsniveau)": {"H1Grades": ["12"], "H1Exams": []}
+        for i in range(40)
+    }
+    old = {"PeriodLabels": ["H1"], "subjects": {name: {"H1Grades": [], "H1Exams": []} for name in subjects}}
+    m.USERS[:] = [{"name": "Test", "username": "u", "password": "p"}]
+    m.old_data = {"Test": old}
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: {"PeriodLabels": ["H1"], "subjects": subjects})
+    sent = []
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: sent.append(msg) or len(sent) > 1)
+    monkeypatch.setattr(m.time, "sleep", lambda s: pytest.fail("fixed sleep"))
+    monkeypatch.setattr(m, "OUTBOX_RETRY_SECONDS", 3600)
+
+    m.run_once()
+
+    assert 1 < len(sent) < 10
+    assert sum(msg.count("Neue Note") for msg in sent) == 40
+    # Genau die Fächer der ersten, fehlgeschlagenen Nachricht bleiben offen
+    assert 0 < len(m._discord_outbox()) == sent[0].count("Neue Note")
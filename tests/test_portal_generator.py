@@ -0,0 +1,68 @@
+import importlib
+import os
+import re
+import sys
+import pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import portal_generator  # noqa: E402
+
+
+def setup_env(monkeypatch):
+    for key in list(os.environ):
+        if re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+", key):
+            monkeypatch.setenv(key, "")
+    monkeypatch.setenv("USER1", "Test")
+    monkeypatch.setenv("USERNAME1", "u")
+    monkeypatch.setenv("PASSWORD1", "p")
+    monkeypatch.setenv("DISCORD_TOKEN", "t")
+    monkeypatch.setenv("DISCORD_CHANNEL_ID", "1")
+    monkeypatch.delenv("DEBUG_LOCAL", raising=False)
+    import main
+    importlib.reload(main)
+    return main
+
+
+@pytest.mark.parametrize("stray_text", [0.0, 0.2])
+@pytest.mark.parametrize("backend", ["stream", "html.parser"])
+def test_generated_page_parses_to_generated_grades(monkeypatch, stray_text, backend):
+    main = setup_env(monkeypatch)
+    state = portal_generator.new_portal(subjects=20, grades=10, current_period=3, seed=7, stray_text=stray_text)
+    html = portal_generator.render_page(state)
+    assert main._stream_grade_tables(html) is not None
+    data = main.parse_grades(html, backend=backend)
+    expected = portal_generator.expected_grades(state)
+    assert set(data["subjects"]) == set(expected)
+    assert data["PeriodLabels"] == ["H1", "H2", "H3", "H4"]
+    for subject, periods in expected.items():
+        info = data["subjects"][subject]
+        for period, values in periods.items():
+            assert info[f"H{period}Grades"] == values["grades"]
+            assert info[f"H{period}Exams"] == values["exams"]
+        assert info["H1FinalGrade"] is not None
+        assert info["H3FinalGrade"] is None
+
+
+def test_mutate_adds_exactly_the_reported_grades(monkeypatch):
+    main = setup_env(monkeypatch)
+    state = portal_generator.new_portal(subjects=12, grades=6, current_period=2, seed=3)
+    before = main.parse_grades(portal_generator.render_page(state))
+    added = portal_generator.mutate(state, additions=4)
+    after = main.parse_grades(portal_generator.render_page(state))
+    messages = main.collect_messages("Test", after, before)
+    reported = sum(m.count("Neue Note") + m.count("Neue Klassenarbeitsnote") for m in messages)
+    assert reported == len(added) == 4
+    for subject, period, grade in added:
+        assert any(f"{subject} (H{period}): {grade}" in m for m in messages)
+
+
+def test_soak_reports_every_added_grade(monkeypatch):
+    setup_env(monkeypatch)
+    monkeypatch.chdir(pathlib.Path(__file__).resolve().parents[1])
+    results = portal_generator.soak(users=3, cycles=3, additions=2, subjects=8, grades=5, current_period=1)
+    assert [row["cycle"] for row in results] == [0, 1, 2]
+    assert all(row["ok"] for row in results)
+    assert results[1]["reported"] == 2 * 3
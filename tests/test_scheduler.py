@@ -0,0 +1,236 @@
+import importlib
+import os
+import random
+import re
+import sys
+import pathlib
+from datetime import datetime, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import scheduler  # noqa: E402
+
+WEEK = 7 * 24 * 3600
+# Montag, 5. Januar 2026, 0:00 Ortszeit
+START = datetime(2026, 1, 5).timestamp()
+
+
+def setup_env(monkeypatch, tmp_path):
+    for key in list(os.environ):
+        if re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+", key):
+            monkeypatch.setenv(key, "")
+    monkeypatch.setenv("USER1", "Test")
+    monkeypatch.setenv("USERNAME1", "u")
+    monkeypatch.setenv("PASSWORD1", "p")
+    monkeypatch.setenv("DISCORD_TOKEN", "t")
+    monkeypatch.setenv("DISCORD_CHANNEL_ID", "1")
+    monkeypatch.setenv("SCHEDULER", "adaptive")
+    monkeypatch.setenv("POLL_MIN_MINUTES", "2")
+    monkeypatch.setenv("POLL_JITTER", "0")
+    monkeypatch.setenv("POLL_SCHEDULE_FILE", str(tmp_path / "poll_schedule.json"))
+    monkeypatch.delenv("DEBUG_LOCAL", raising=False)
+    import main
+    importlib.reload(main)
+    return main
+
+
+def afternoon_grades(weeks: int, seed: int = 1) -> list[float]:
+    """Grades entered on weekday afternoons between 14 and 18 o'clock."""
+    rng = random.Random(seed)
+    events = []
+    for day in range(weeks * 7):
+        moment = datetime.fromtimestamp(START) + timedelta(days=day)
+        if moment.weekday() >= 5:
+            continue
+        for _ in range(3):
+            events.append((moment + timedelta(hours=14 + rng.random() * 4)).timestamp())
+    return sorted(events)
+
+
+def replay(events: list[float], start: float, end: float, next_poll) -> tuple[int, float]:
+    """Poll from start to end; return the number of polls and the mean detection delay."""
+    polls, delays = 0, []
+    pending = [ts for ts in events if start <= ts < end]
+    now = start
+    while now < end:
+        polls += 1
+        found = [ts for ts in pending if ts <= now]
+        pending = pending[len(found):]
+        delays.extend(now - ts for ts in found)
+        now += next_poll(now, bool(found))
+    return polls, sum(delays) / len(delays)
+
+
+def test_adaptive_schedule_polls_less_and_detects_faster():
+    events = afternoon_grades(weeks=4)
+    schedule = scheduler.UserSchedule()
+    for ts in events:
+        if ts < START + 3 * WEEK:
+            schedule.record(ts, changed=True)
+    rng = random.Random(3)
+
+    def adaptive(now, changed):
+        schedule.record(now, changed)
+        return scheduler.next_interval(schedule, now, 120, 3600, jitter=0.1, rng=rng)
+
+    fixed_polls, fixed_delay = replay(events, START + 3 * WEEK, START + 4 * WEEK, lambda now, changed: 300)
+    polls, delay = replay(events, START + 3 * WEEK, START + 4 * WEEK, adaptive)
+    assert fixed_polls == 2016
+    assert polls < fixed_polls * 0.7
+    assert delay < fixed_delay
+
+
+def test_quiet_polls_back_off_exponentially_within_bounds():
+    schedule = scheduler.UserSchedule()
+    intervals = []
+    for _ in range(8):
+        intervals.append(scheduler.next_interval(schedule, START, 300, 3600))
+        schedule.record(START, changed=False)
+    assert intervals[:5] == [300, 600, 1200, 2400, 3600]
+    assert max(intervals) == 3600
+    schedule.record(START, changed=True)
+    assert scheduler.next_interval(schedule, START, 300, 3600) == 300
+
+
+def test_backoff_never_sleeps_past_an_active_hour():
+    schedule = scheduler.UserSchedule(changes=afternoon_grades(weeks=2), quiet=10)
+    monday_noon = START + 12 * 3600
+    assert not schedule.is_hot(monday_noon)
+    assert schedule.is_hot(START + 15 * 3600)
+    assert scheduler.next_interval(schedule, monday_noon, 120, 4 * 3600) == 3600
+
+
+def test_jitter_never_pushes_a_poll_past_an_active_hour():
+    schedule = scheduler.UserSchedule(changes=afternoon_grades(weeks=2), quiet=10)
+    monday_noon = START + 12 * 3600
+    rng = random.Random(1)
+    values = [scheduler.next_interval(schedule, monday_noon, 120, 3600, jitter=0.3, rng=rng) for _ in range(50)]
+    assert max(values) == 3600 and min(values) < 3600
+    values = [scheduler.next_interval(schedule, monday_noon, 120, 4 * 3600, jitter=0.3, rng=rng) for _ in range(50)]
+    assert set(values) == {3600}
+
+
+def test_jitter_spreads_poll_times():
+    schedule = scheduler.UserSchedule()
+    rng = random.Random(0)
+    values = {round(scheduler.next_interval(schedule, START, 300, 3600, jitter=0.1, rng=rng)) for _ in range(20)}
+    assert len(values) > 10
+    assert all(270 <= value <= 330 for value in values)
+
+
+def test_adaptive_default_polls_hot_hours_faster_than_fixed(monkeypatch, tmp_path):
+    m = setup_env(monkeypatch, tmp_path)
+    assert m.Config({"INTERVAL_MINUTES": "10"}).POLL_MIN_MINUTES == 5
+    assert m.Config({"INTERVAL_MINUTES": "1"}).POLL_MIN_MINUTES == 1
+    assert m.Config({"INTERVAL_MINUTES": "10", "POLL_MIN_MINUTES": "7"}).POLL_MIN_MINUTES == 7
+
+
+def test_main_keeps_adaptive_schedule_per_user(monkeypatch, tmp_path):
+    m = setup_env(monkeypatch, tmp_path)
+    user = m.USERS[0]
+    assert m._initial_queue(START).pop_due(START) == ["Test"]
+
+    m._note_poll_outcome(user, changed=False, now=START)
+    assert m._user_schedules()["Test"].next_run == START + 240
+
+    m._note_poll_outcome(user, changed=None, now=START + 240)
+    assert m._user_schedules()["Test"].quiet == 1
+    assert m._user_schedules()["Test"].next_run == START + 270
+
+    m._write_json_file(m.POLL_SCHEDULE_FILE, scheduler.dump_schedules(m._user_schedules()))
+    importlib.reload(m)
+    queue = m._initial_queue(START)
+    assert queue.pop_due(START + 269) == []
+    assert queue.pop_due(START + 270) == ["Test"]
+
+
+def test_week_replays_with_staggered_deadlines():
+    clock = scheduler.SimulatedClock(START)
+    names = [f"U{i}" for i in range(50)]
+    queue = scheduler.PollQueue()
+    queue.stagger(names, START, 300)
+    polls = []
+
+    def poll(due):
+        polls.extend((clock.time(), name) for name in due)
+        return {name: clock.time() + 300 for name in due}
+
+    scheduler.run_queue(queue, clock, poll, until=START + WEEK)
+    assert len(polls) == 50 * 2016
+    # Gleichmäßig verteilt: nie mehr als ein Benutzer je 6-Sekunden-Fenster
+    per_window = {}
+    for ts, _ in polls:
+        per_window[int((ts - START) // 6)] = per_window.get(int((ts - START) // 6), 0) + 1
+    assert max(per_window.values()) == 1
+
+
+def test_run_queue_requeues_a_batch_whose_poll_raises():
+    clock = scheduler.SimulatedClock(START)
+    queue = scheduler.PollQueue()
+    queue.stagger(["A", "B"], START, 300)
+    polls = []
+
+    def poll(due):
+        polls.append((clock.time() - START, sorted(due)))
+        if len(polls) <= 2:
+            raise OSError("Portal weg")
+        return {name: deadline + 300 for name, deadline in due.items()}
+
+    scheduler.run_queue(queue, clock, poll, until=START + 600, retry_seconds=30)
+    assert polls[:4] == [(0, ["A"]), (30, ["A"]), (90, ["A"]), (150, ["B"])]
+    assert sorted(name for _, names in polls for name in names).count("B") == 2
+    assert len(queue) == 2
+
+
+def test_staggered_deadlines_do_not_drift(monkeypatch, tmp_path):
+    m = setup_env(monkeypatch, tmp_path)
+    monkeypatch.setenv("SCHEDULER", "staggered")
+    importlib.reload(m)
+    monkeypatch.chdir(tmp_path)
+    m._clock = scheduler.SimulatedClock(START)
+    m.old_data = {}
+    polls = []
+
+    def slow_poll(user, fingerprint):
+        polls.append(m._clock.time() - START)
+        m._clock.sleep(7)
+        return m.UNCHANGED
+
+    monkeypatch.setattr(m, "_poll_user", slow_poll)
+    m.run_scheduled(until=START + 3000)
+    assert polls == [300.0 * i for i in range(10)]
+
+
+def test_rate_limiter_caps_requests_per_second():
+    clock = scheduler.SimulatedClock(START)
+    limiter = scheduler.RateLimiter(2.0, burst=6)
+    for _ in range(100):
+        clock.sleep(limiter.reserve(3, clock.time()))
+    assert clock.time() - START == (300 - 6) / 2.0
+    clock.sleep(3600)
+    assert limiter.reserve(6, clock.time()) == 0.0
+
+
+def test_scheduled_loop_retries_failed_users_early(monkeypatch, tmp_path):
+    m = setup_env(monkeypatch, tmp_path)
+    monkeypatch.setenv("SCHEDULER", "staggered")
+    monkeypatch.setenv("MAX_REQUESTS_PER_SECOND", "0.5")
+    monkeypatch.setenv("USER2", "Zweiter")
+    monkeypatch.setenv("USERNAME2", "z")
+    monkeypatch.setenv("PASSWORD2", "p")
+    importlib.reload(m)
+    monkeypatch.chdir(tmp_path)
+    m._clock = scheduler.SimulatedClock(START)
+    m.old_data = {}
+    polls = []
+
+    def fake_poll(user, fingerprint):
+        m._wait_for_request_budget(3)
+        polls.append((m._clock.time() - START, user["name"]))
+        return None if len(polls) == 1 else m.UNCHANGED
+
+    monkeypatch.setattr(m, "_poll_user", fake_poll)
+    m.run_scheduled(until=START + 900)
+    # Erster Abruf scheitert: Wiederholung nach 30 s statt nach 5 Minuten
+    assert polls[:4] == [(0, "Test"), (30, "Test"), (150, "Zweiter"), (330, "Test")]
+    assert [ts for ts, name in polls if name == "Zweiter"] == [150, 450, 750]
@@ -0,0 +1,131 @@
+import copy
+import importlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import state_store  # noqa: E402
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def setup_env(monkeypatch, tmp_path, backend="sqlite"):
+    for key in list(os.environ):
+        if re.fullmatch(r"(USER|USERNAME|PASSWORD)\d+", key):
+            monkeypatch.setenv(key, "")
+    monkeypatch.setenv("USER1", "Test Nutzer")
+    monkeypatch.setenv("USERNAME1", "u")
+    monkeypatch.setenv("PASSWORD1", "p")
+    monkeypatch.setenv("DISCORD_TOKEN", "t")
+    monkeypatch.setenv("DISCORD_CHANNEL_ID", "1")
+    monkeypatch.setenv("STATE_BACKEND", backend)
+    monkeypatch.setenv("STATE_DB_FILE", str(tmp_path / "grades.sqlite3"))
+    monkeypatch.delenv("DEBUG_LOCAL", raising=False)
+    import main
+    importlib.reload(main)
+    return main
+
+
+@pytest.fixture
+def pages(monkeypatch, tmp_path):
+    m = setup_env(monkeypatch, tmp_path, backend="json")
+    return {name: m.parse_grades((ROOT / name).read_text(encoding="utf-8")) for name in ("index.html", "res_example.txt")}
+
+
+def test_rows_roundtrip_status_files(pages):
+    for data in pages.values():
+        data = json.loads(json.dumps(data))
+        assert state_store.join_rows(state_store.split_report(data)) == data
+        assert list(state_store.join_rows(state_store.split_report(data))["subjects"]) == list(data["subjects"])
+
+
+def test_only_changed_rows_are_written(pages, tmp_path):
+    data = json.loads(json.dumps(pages["index.html"]))
+    store = state_store.StateStore(str(tmp_path / "s.sqlite3"))
+    assert store._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    written = store.stage("a", data)
+    assert written == len(state_store.split_report(data))
+    assert store.commit() == written
+
+    assert store.stage("a", copy.deepcopy(data)) == 0
+    changed = copy.deepcopy(data)
+    subject = next(iter(changed["subjects"]))
+    changed["subjects"][subject]["H1Grades"].append("15")
+    del changed["subjects"][list(changed["subjects"])[-1]]
+    rows_of_last = sum(1 for key in state_store.split_report(data) if len(key) > 1 and key[1] == list(data["subjects"])[-1])
+    assert store.stage("a", changed) == 1 + rows_of_last
+    assert store.commit() == 1 + rows_of_last
+    store.close()
+
+    reopened = state_store.StateStore(str(tmp_path / "s.sqlite3"))
+    assert reopened._rows == {}
+    assert reopened.load("a") == changed
+    assert reopened.load("missing") is None
+    assert reopened.accounts() == ["a"]
+
+
+def test_failed_commit_keeps_rows_staged(pages, tmp_path):
+    store = state_store.StateStore(str(tmp_path / "s.sqlite3"))
+    store.stage("a", pages["index.html"])
+    other = sqlite3.connect(str(tmp_path / "s.sqlite3"), timeout=0)
+    other.execute("BEGIN EXCLUSIVE")
+    store._conn.execute("PRAGMA busy_timeout = 0")
+    with pytest.raises(sqlite3.OperationalError):
+        store.commit()
+    other.rollback()
+    assert store.commit() > 0
+    assert store.load("a") == json.loads(json.dumps(pages["index.html"]))
+
+
+def test_importer_copies_old_grade_files(pages, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name, data in (("Test_Nutzer", pages["index.html"]), ("Zweiter", pages["res_example.txt"])):
+        (tmp_path / f"old_grades_{name}.json").write_text(json.dumps(data), encoding="utf-8")
+    assert state_store.main_cli(["import", "--db", "import.sqlite3"]) == 0
+    store = state_store.StateStore("import.sqlite3")
+    assert store.accounts() == ["Test_Nutzer", "Zweiter"]
+    assert store.load("Zweiter") == json.loads(json.dumps(pages["res_example.txt"]))
+
+
+def test_run_once_keeps_state_in_sqlite(monkeypatch, tmp_path, pages):
+    m = setup_env(monkeypatch, tmp_path)
+    monkeypatch.chdir(tmp_path)
+    data = json.loads(json.dumps(pages["index.html"]))
+    # Bestehende JSON-Datei wird beim ersten Zugriff übernommen
+    (tmp_path / "old_grades_Test_Nutzer.json").write_text(json.dumps(data), encoding="utf-8")
+    changed = copy.deepcopy(data)
+    subject = next(iter(changed["subjects"]))
+    changed["subjects"][subject]["H1Grades"].append("15")
+    changed["Fingerprint"] = "neu"
+    monkeypatch.setattr(m, "fetch_html", lambda *a, **k: copy.deepcopy(changed))
+    sent = []
+    monkeypatch.setattr(m, "_send_discord_message", lambda msg: sent.append(msg) or True)
+    assert m.old_data == {}
+
+    assert m.run_once()["state_rows"] == len(state_store.split_report(changed))
+    assert len(sent) == 1 and subject in sent[0]
+    assert sorted(p.name for p in tmp_path.iterdir() if p.suffix == ".json") == ["old_grades_Test_Nutzer.json"]
+
+    changed["subjects"][subject]["H1Grades"].append("14")
+    changed["Fingerprint"] = "neuer"
+    # Nur der Bericht (Fingerprint) und das geänderte Halbjahr
+    assert m.run_once()["state_rows"] == 2
+    assert m.run_once()["state_rows"] == 0
+
+    importlib.reload(m)
+    assert m.old_data == {}
+    assert m._old_report("Test Nutzer").to_dict() == changed
+
+
+def test_bench_state_writes_less_than_json_files(pages):
+    import bench
+
+    results = bench.compare_state_stores(json.loads(json.dumps(pages["index.html"])), accounts=20)
+    assert results["sqlite"]["cycle_bytes"] * 5 < results["json"]["cycle_bytes"]